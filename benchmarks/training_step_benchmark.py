@@ -0,0 +1,101 @@
+"""
+Compares the step times of the networks built by get_net in eager mode and compiled as with --compile
+(torch.compile and channels_last weights, see compile_net), in float32 and with --precision bf16 (forward
+passes under autocast to bfloat16).
+Each (net, mode) pair runs in a fresh process so that compiled graphs and their caches are not shared.
+first step is the time of the first training step, compilation included, the train and eval step
+times are the best of the following steps. Training steps are those of fedavg (SGD with momentum) and
+evaluation steps those of test_model, in inference mode. loss delta is the difference between the loss
+of the first step and its float32 value (that of the first mode).
+
+    python benchmarks/training_step_benchmark.py --nets LeNet resnet18 resnet50 vgg16 AlexNet
+    python benchmarks/training_step_benchmark.py --nets resnet18 resnet50 --modes eager bf16 --resize_size 128
+"""
+import os
+import sys
+import time
+import argparse
+from multiprocessing import get_context
+
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from federa.client.src.net import get_net, compile_net
+from federa.client.src.net_lib import autocast
+
+
+#compiled, precision
+MODES = {"eager": (False, "fp32"), "compiled": (True, "fp32"), "bf16": (False, "bf16"),
+         "compiled bf16": (True, "bf16")}
+#AlexNet downsamples too much for smaller images
+MIN_SIZE = {"AlexNet": 64}
+
+
+def run(net_name, mode, batch_size, resize_size, steps, queue):
+    torch.manual_seed(0)
+    net = get_net({"net": net_name, "dataset": "CIFAR10"})
+    compiled, precision = MODES[mode]
+    if compiled:
+        net = compile_net(net)
+    size = max(resize_size, MIN_SIZE.get(net_name, 0))
+    images = torch.rand(batch_size, 3, size, size)
+    labels = torch.randint(0, 10, (batch_size,))
+    criterion = torch.nn.CrossEntropyLoss()
+    optimizer = torch.optim.SGD(net.parameters(), lr=0.001, momentum=0.9)
+
+    def train_step():
+        optimizer.zero_grad()
+        with autocast("cpu", precision):
+            loss = criterion(net(images), labels)
+        loss.backward()
+        optimizer.step()
+        return loss.item()
+
+    def timed(step):
+        start = time.perf_counter()
+        step()
+        return time.perf_counter() - start
+
+    def eval_step():
+        with autocast("cpu", precision):
+            net(images)
+
+    net.train()
+    start = time.perf_counter()
+    loss = train_step()
+    first_step = time.perf_counter() - start
+    train_times = [timed(train_step) for _ in range(steps)]
+    net.eval()
+    with torch.inference_mode():
+        eval_step()
+        eval_times = [timed(eval_step) for _ in range(steps)]
+
+    queue.put({"net": net_name, "mode": mode, "size": size, "loss": loss, "first_s": first_step,
+               "train_ms": 1000 * min(train_times), "eval_ms": 1000 * min(eval_times)})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nets", nargs="+", default=["LeNet", "resnet18", "resnet50", "vgg16", "AlexNet"])
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--resize_size", type=int, default=32)
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES))
+    args = parser.parse_args()
+
+    context = get_context("spawn")
+    print(f"{'net':<10} {'mode':<14} {'size':>5} {'first step s':>13} {'train step ms':>14} {'eval step ms':>13} "
+          f"{'loss delta':>11}")
+    for net in args.nets:
+        fp32_loss = None
+        for mode in args.modes:
+            queue = context.Queue()
+            process = context.Process(target=run, args=(net, mode, args.batch_size, args.resize_size,
+                                                        args.steps, queue))
+            process.start()
+            result = queue.get()
+            process.join()
+            if fp32_loss is None:
+                fp32_loss = result['loss']
+            print(f"{result['net']:<10} {result['mode']:<14} {result['size']:>5} {result['first_s']:>13.1f} "
+                  f"{result['train_ms']:>14.1f} {result['eval_ms']:>13.1f} {result['loss'] - fp32_loss:>11.2e}")
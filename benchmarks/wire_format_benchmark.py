@@ -0,0 +1,95 @@
+"""
+Compares the tensor wire format with the torch.save / torch.load payloads it replaced.
+Each (net, codec) pair runs in a fresh process so that the peak RSS it reports only
+covers one encode and one decode of a TrainOrder payload.
+wire_format_chunked streams the payload through 1 MB chunks, as with --chunk_size 1. Its chunks are
+produced lazily while they are decoded, so its encode time is part of its decode time.
+
+    python benchmarks/wire_format_benchmark.py --nets LeNet resnet18 resnet50 vgg16
+"""
+import os
+import sys
+import time
+import argparse
+import resource
+from io import BytesIO
+from multiprocessing import get_context
+
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from federa.server.src.server_lib import get_net
+from federa.server.src.wire_format import encode_payload, decode_payload, encode_payload_chunks, PayloadDecoder
+
+
+def torch_save_encode(payload):
+    buffer = BytesIO()
+    torch.save(payload, buffer)
+    return buffer.getvalue()
+
+
+def torch_load_decode(data):
+    return torch.load(BytesIO(data), map_location="cpu")
+
+
+def chunked_encode(payload):
+    return encode_payload_chunks(payload, 2**20)
+
+
+def chunked_decode(chunks):
+    decoder = PayloadDecoder()
+    for chunk in chunks:
+        decoder.feed(chunk)
+    return decoder.result()
+
+
+CODECS = {
+    "torch.save": (torch_save_encode, torch_load_decode),
+    "wire_format": (encode_payload, decode_payload),
+    "wire_format_chunked": (chunked_encode, chunked_decode),
+}
+
+
+def peak_rss_mb():
+    #ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(net, codec, repeats, queue):
+    encode, decode = CODECS[codec]
+    state_dict = get_net({"net": net, "dataset": "CIFAR10"}).state_dict()
+    payload = {"model_parameters": state_dict, "control_variate": [tensor.clone() for tensor in state_dict.values()],
+               "control_variate2": None}
+    rss_before = peak_rss_mb()
+
+    encode_times, decode_times = [], []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        data = encode(payload)
+        encode_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        decoded = decode(data)
+        decode_times.append(time.perf_counter() - start)
+        del data, decoded
+
+    queue.put({"net": net, "codec": codec, "encode_ms": 1000 * min(encode_times),
+               "decode_ms": 1000 * min(decode_times), "peak_rss_mb": peak_rss_mb() - rss_before})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nets", nargs="+", default=["LeNet", "resnet18", "resnet50", "vgg16"])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    context = get_context("spawn")
+    print(f"{'net':<10} {'codec':<20} {'encode ms':>10} {'decode ms':>10} {'peak RSS MB':>12}")
+    for net in args.nets:
+        for codec in CODECS:
+            queue = context.Queue()
+            process = context.Process(target=run, args=(net, codec, args.repeats, queue))
+            process.start()
+            result = queue.get()
+            process.join()
+            print(f"{result['net']:<10} {result['codec']:<20} {result['encode_ms']:>10.1f} "
+                  f"{result['decode_ms']:>10.1f} {result['peak_rss_mb']:>12.1f}")
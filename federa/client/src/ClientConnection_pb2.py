@@ -19,12 +19,11 @@ DESCRIPTOR = _descriptor.FileDescriptor(
   syntax='proto3',
   serialized_options=None,
   #create_key=_descriptor._internal_create_key,
-  serialized_pb=b'\n\x16\x43lientConnection.proto\"\xa3\x01\n\rServerMessage\x12\x1f\n\ntrainOrder\x18\x01 \x01(\x0b\x32\x0b.TrainOrder\x12\x1d\n\tevalOrder\x18\x02 \x01(\x0b\x32\n.EvalOrder\x12)\n\x0f\x64isconnectOrder\x18\x03 \x01(\x0b\x32\x10.DisconnectOrder\x12\'\n\x0esetParamsOrder\x18\x04 \x01(\x0b\x32\x0f.SetParamsOrder\"\x8a\x01\n\rClientMessage\x12%\n\rtrainResponse\x18\x01 \x01(\x0b\x32\x0e.TrainResponse\x12#\n\x0c\x65valResponse\x18\x02 \x01(\x0b\x32\r.EvalResponse\x12-\n\x11setParamsResponse\x18\x03 \x01(\x0b\x32\x12.SetParamsResponse\"9\n\nTrainOrder\x12\x17\n\x0fmodelParameters\x18\x01 \x01(\x0c\x12\x12\n\nconfigDict\x18\x02 \x01(\x0c\">\n\rTrainResponse\x12\x17\n\x0fmodelParameters\x18\x01 \x01(\x0c\x12\x14\n\x0cresponseDict\x18\x02 \x01(\x0c\"8\n\tEvalOrder\x12\x17\n\x0fmodelParameters\x18\x01 \x01(\x0c\x12\x12\n\nconfigDict\x18\x02 \x01(\x0c\"$\n\x0c\x45valResponse\x12\x14\n\x0cresponseDict\x18\x01 \x01(\x0c\")\n\x0eSetParamsOrder\x12\x17\n\x0fmodelParameters\x18\x01 \x01(\x0c\"\x13\n\x11SetParamsResponse\"9\n\x0f\x44isconnectOrder\x12\x0f\n\x07message\x18\x01 \x01(\t\x12\x15\n\rreconnectTime\x18\x02 \x01(\x05\x32\x41\n\x10\x43lientConnection\x12-\n\x07\x43onnect\x12\x0e.ClientMessage\x1a\x0e.ServerMessage(\x01\x30\x01\x62\x06proto3'
+  serialized_pb=b'\n\x16ClientConnection.proto"\xc4\x01\n\rServerMessage\x12\x1f\n\ntrainOrder\x18\x01 \x01(\x0b2\x0b.TrainOrder\x12\x1d\n\tevalOrder\x18\x02 \x01(\x0b2\n.EvalOrder\x12)\n\x0fdisconnectOrder\x18\x03 \x01(\x0b2\x10.DisconnectOrder\x12\'\n\x0esetParamsOrder\x18\x04 \x01(\x0b2\x0f.SetParamsOrder\x12\x1f\n\nmodelChunk\x18\x05 \x01(\x0b2\x0b.ModelChunk"\xc1\x01\n\rClientMessage\x12%\n\rtrainResponse\x18\x01 \x01(\x0b2\x0e.TrainResponse\x12#\n\x0cevalResponse\x18\x02 \x01(\x0b2\r.EvalResponse\x12-\n\x11setParamsResponse\x18\x03 \x01(\x0b2\x12.SetParamsResponse\x12\x1f\n\nmodelChunk\x18\x04 \x01(\x0b2\x0b.ModelChunk\x12\x14\n\x0cmodelVersion\x18\x05 \x01(\x04"u\n\nTrainOrder\x12\x17\n\x0fmodelParameters\x18\x01 \x01(\x0c\x12\x12\n\nconfigDict\x18\x02 \x01(\x0c\x12\x0f\n\x07chunked\x18\x03 \x01(\x08\x12\x14\n\x0cmodelVersion\x18\x04 \x01(\x04\x12\x13\n\x0bbaseVersion\x18\x05 \x01(\x04"O\n\rTrainResponse\x12\x17\n\x0fmodelParameters\x18\x01 \x01(\x0c\x12\x14\n\x0cresponseDict\x18\x02 \x01(\x0c\x12\x0f\n\x07chunked\x18\x03 \x01(\x08"8\n\tEvalOrder\x12\x17\n\x0fmodelParameters\x18\x01 \x01(\x0c\x12\x12\n\nconfigDict\x18\x02 \x01(\x0c"$\n\x0cEvalResponse\x12\x14\n\x0cresponseDict\x18\x01 \x01(\x0c"e\n\x0eSetParamsOrder\x12\x17\n\x0fmodelParameters\x18\x01 \x01(\x0c\x12\x0f\n\x07chunked\x18\x02 \x01(\x08\x12\x14\n\x0cmodelVersion\x18\x03 \x01(\x04\x12\x13\n\x0bbaseVersion\x18\x04 \x01(\x04"\x13\n\x11SetParamsResponse"9\n\x0fDisconnectOrder\x12\x0f\n\x07message\x18\x01 \x01(\t\x12\x15\n\rreconnectTime\x18\x02 \x01(\x05"\x1a\n\nModelChunk\x12\x0c\n\x04data\x18\x01 \x01(\x0c2A\n\x10ClientConnection\x12-\n\x07Connect\x12\x0e.ClientMessage\x1a\x0e.ServerMessage(\x010\x01b\x06proto3'
 )
 
 
 
-
 _SERVERMESSAGE = _descriptor.Descriptor(
   name='ServerMessage',
   full_name='ServerMessage',
@@ -61,6 +60,13 @@ _SERVERMESSAGE = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='modelChunk', full_name='ServerMessage.modelChunk', index=4,
+      number=5, type=11, cpp_type=10, label=1,
+      has_default_value=False, default_value=None,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
   ],
   extensions=[
   ],
@@ -74,7 +80,7 @@ _SERVERMESSAGE = _descriptor.Descriptor(
   oneofs=[
   ],
   serialized_start=27,
-  serialized_end=190,
+  serialized_end=223,
 )
 
 
@@ -107,6 +113,20 @@ _CLIENTMESSAGE = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='modelChunk', full_name='ClientMessage.modelChunk', index=3,
+      number=4, type=11, cpp_type=10, label=1,
+      has_default_value=False, default_value=None,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='modelVersion', full_name='ClientMessage.modelVersion', index=4,
+      number=5, type=4, cpp_type=4, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
   ],
   extensions=[
   ],
@@ -119,8 +139,8 @@ _CLIENTMESSAGE = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=193,
-  serialized_end=331,
+  serialized_start=226,
+  serialized_end=419,
 )
 
 
@@ -146,6 +166,27 @@ _TRAINORDER = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='chunked', full_name='TrainOrder.chunked', index=2,
+      number=3, type=8, cpp_type=7, label=1,
+      has_default_value=False, default_value=False,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='modelVersion', full_name='TrainOrder.modelVersion', index=3,
+      number=4, type=4, cpp_type=4, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='baseVersion', full_name='TrainOrder.baseVersion', index=4,
+      number=5, type=4, cpp_type=4, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
   ],
   extensions=[
   ],
@@ -158,8 +199,8 @@ _TRAINORDER = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=333,
-  serialized_end=390,
+  serialized_start=421,
+  serialized_end=538,
 )
 
 
@@ -185,6 +226,13 @@ _TRAINRESPONSE = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='chunked', full_name='TrainResponse.chunked', index=2,
+      number=3, type=8, cpp_type=7, label=1,
+      has_default_value=False, default_value=False,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
   ],
   extensions=[
   ],
@@ -197,8 +245,8 @@ _TRAINRESPONSE = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=392,
-  serialized_end=454,
+  serialized_start=540,
+  serialized_end=619,
 )
 
 
@@ -236,8 +284,8 @@ _EVALORDER = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=456,
-  serialized_end=512,
+  serialized_start=621,
+  serialized_end=677,
 )
 
 
@@ -268,8 +316,8 @@ _EVALRESPONSE = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=514,
-  serialized_end=550,
+  serialized_start=679,
+  serialized_end=715,
 )
 
 
@@ -288,6 +336,27 @@ _SETPARAMSORDER = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='chunked', full_name='SetParamsOrder.chunked', index=1,
+      number=2, type=8, cpp_type=7, label=1,
+      has_default_value=False, default_value=False,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='modelVersion', full_name='SetParamsOrder.modelVersion', index=2,
+      number=3, type=4, cpp_type=4, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='baseVersion', full_name='SetParamsOrder.baseVersion', index=3,
+      number=4, type=4, cpp_type=4, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
   ],
   extensions=[
   ],
@@ -300,8 +369,8 @@ _SETPARAMSORDER = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=552,
-  serialized_end=593,
+  serialized_start=717,
+  serialized_end=818,
 )
 
 
@@ -325,8 +394,8 @@ _SETPARAMSRESPONSE = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=595,
-  serialized_end=614,
+  serialized_start=820,
+  serialized_end=839,
 )
 
 
@@ -364,17 +433,51 @@ _DISCONNECTORDER = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=616,
-  serialized_end=673,
+  serialized_start=841,
+  serialized_end=898,
+)
+
+
+_MODELCHUNK = _descriptor.Descriptor(
+  name='ModelChunk',
+  full_name='ModelChunk',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  #create_key=_descriptor._internal_create_key,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='data', full_name='ModelChunk.data', index=0,
+      number=1, type=12, cpp_type=9, label=1,
+      has_default_value=False, default_value=b"",
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      serialized_options=None, file=DESCRIPTOR),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  serialized_options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=900,
+  serialized_end=926,
 )
 
 _SERVERMESSAGE.fields_by_name['trainOrder'].message_type = _TRAINORDER
 _SERVERMESSAGE.fields_by_name['evalOrder'].message_type = _EVALORDER
 _SERVERMESSAGE.fields_by_name['disconnectOrder'].message_type = _DISCONNECTORDER
 _SERVERMESSAGE.fields_by_name['setParamsOrder'].message_type = _SETPARAMSORDER
+_SERVERMESSAGE.fields_by_name['modelChunk'].message_type = _MODELCHUNK
 _CLIENTMESSAGE.fields_by_name['trainResponse'].message_type = _TRAINRESPONSE
 _CLIENTMESSAGE.fields_by_name['evalResponse'].message_type = _EVALRESPONSE
 _CLIENTMESSAGE.fields_by_name['setParamsResponse'].message_type = _SETPARAMSRESPONSE
+_CLIENTMESSAGE.fields_by_name['modelChunk'].message_type = _MODELCHUNK
 DESCRIPTOR.message_types_by_name['ServerMessage'] = _SERVERMESSAGE
 DESCRIPTOR.message_types_by_name['ClientMessage'] = _CLIENTMESSAGE
 DESCRIPTOR.message_types_by_name['TrainOrder'] = _TRAINORDER
@@ -384,6 +487,7 @@ DESCRIPTOR.message_types_by_name['EvalResponse'] = _EVALRESPONSE
 DESCRIPTOR.message_types_by_name['SetParamsOrder'] = _SETPARAMSORDER
 DESCRIPTOR.message_types_by_name['SetParamsResponse'] = _SETPARAMSRESPONSE
 DESCRIPTOR.message_types_by_name['DisconnectOrder'] = _DISCONNECTORDER
+DESCRIPTOR.message_types_by_name['ModelChunk'] = _MODELCHUNK
 _sym_db.RegisterFileDescriptor(DESCRIPTOR)
 
 ServerMessage = _reflection.GeneratedProtocolMessageType('ServerMessage', (_message.Message,), {
@@ -435,8 +539,7 @@ SetParamsOrder = _reflection.GeneratedProtocolMessageType('SetParamsOrder', (_me
   })
 _sym_db.RegisterMessage(SetParamsOrder)
 
-SetParamsResponse = _reflection.GeneratedProtocolMessageType('SetParamsResponse', (
-  _message.Message,),{
+SetParamsResponse = _reflection.GeneratedProtocolMessageType('SetParamsResponse', (_message.Message,), {
   'DESCRIPTOR' : _SETPARAMSRESPONSE,
   '__module__' : 'ClientConnection_pb2'
   # @@protoc_insertion_point(class_scope:SetParamsResponse)
@@ -450,6 +553,13 @@ DisconnectOrder = _reflection.GeneratedProtocolMessageType('DisconnectOrder', (_
   })
 _sym_db.RegisterMessage(DisconnectOrder)
 
+ModelChunk = _reflection.GeneratedProtocolMessageType('ModelChunk', (_message.Message,), {
+  'DESCRIPTOR' : _MODELCHUNK,
+  '__module__' : 'ClientConnection_pb2'
+  # @@protoc_insertion_point(class_scope:ModelChunk)
+  })
+_sym_db.RegisterMessage(ModelChunk)
+
 
 
 _CLIENTCONNECTION = _descriptor.ServiceDescriptor(
@@ -459,8 +569,8 @@ _CLIENTCONNECTION = _descriptor.ServiceDescriptor(
   index=0,
   serialized_options=None,
   #create_key=_descriptor._internal_create_key,
-  serialized_start=675,
-  serialized_end=740,
+  serialized_start=928,
+  serialized_end=993,
   methods=[
   _descriptor.MethodDescriptor(
     name='Connect',
@@ -476,5 +586,3 @@ _CLIENTCONNECTION = _descriptor.ServiceDescriptor(
 _sym_db.RegisterServiceDescriptor(_CLIENTCONNECTION)
 
 DESCRIPTOR.services_by_name['ClientConnection'] = _CLIENTCONNECTION
-
-# @@protoc_insertion_point(module_scope)
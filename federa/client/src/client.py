@@ -4,15 +4,18 @@ import time
 
 import grpc
 from . import ClientConnection_pb2_grpc
-from .ClientConnection_pb2 import ClientMessage
+from .ClientConnection_pb2 import ClientMessage, ModelChunk
+from .wire_format import PayloadDecoder
 
-from .client_lib import train, evaluate, set_parameters
+from .client_lib import train, evaluate, set_parameters, GlobalModel, ClientSession
 
 def client_start(config):
     keep_going = True
     wait_time = 0
     ip_address = config["ip_address"]
     device = torch.device(config["device"])
+    #network, data loaders and upload residual, kept over the rounds and reconnections
+    session = ClientSession(device, config.get("client_id", 0))
     #device = torch.device("cuda:2" if torch.cuda.is_available() else "cpu")
 
     while keep_going:
@@ -28,26 +31,42 @@ def client_start(config):
         client_buffer = Queue(maxsize = 10)
         print("Connected with server")
 
+        #decodes the model chunks that precede a chunked order as they arrive
+        chunks = PayloadDecoder()
+        #last global model received on this connection, the server sends deltas against it
+        global_model = GlobalModel()
+
         #wait for incoming messages from the server in client_buffer
         #then according to fields present in them call the appropraite function
         for server_message in stub.Connect( iter(client_buffer.get, None) ):
+            if server_message.HasField("modelChunk"):
+                chunks.feed(server_message.modelChunk.data)
+                continue
+
             if server_message.HasField("evalOrder"):
                 eval_order_message = server_message.evalOrder
-                eval_response_message = evaluate(eval_order_message, device)
-                message_to_server = ClientMessage(evalResponse = eval_response_message)
+                eval_response_message = evaluate(eval_order_message, session)
+                message_to_server = ClientMessage(evalResponse = eval_response_message,
+                                                  modelVersion = global_model.version)
                 client_buffer.put(message_to_server)
 
             if server_message.HasField("trainOrder"):
                 train_order_message = server_message.trainOrder
-                train_response_message = train(train_order_message, device)
-                message_to_server = ClientMessage(trainResponse = train_response_message)
+                model_chunks, train_response_message = train(train_order_message, chunks, global_model, session)
+                #the trained model is streamed in chunks ahead of the response when the server asks for it
+                for chunk in model_chunks:
+                    client_buffer.put(ClientMessage(modelChunk = ModelChunk(data = chunk)))
+                message_to_server = ClientMessage(trainResponse = train_response_message,
+                                                  modelVersion = global_model.version)
                 client_buffer.put(message_to_server)
+                chunks = PayloadDecoder()
 
             if server_message.HasField("setParamsOrder"):
                 set_parameters_order_message = server_message.setParamsOrder
-                set_parameters(set_parameters_order_message, device)
-                message_to_server = ClientMessage(setParamsResponse = None)
+                set_parameters(set_parameters_order_message, chunks, global_model, session)
+                message_to_server = ClientMessage(setParamsResponse = None, modelVersion = global_model.version)
                 client_buffer.put(message_to_server)
+                chunks = PayloadDecoder()
 
             if server_message.HasField("disconnectOrder"):
                 print("Current FL process is done ")
@@ -1,44 +1,183 @@
 import torch
-from io import BytesIO
 import json
 import time
 import os
+import threading
 from datetime import datetime
 from codecarbon import  OfflineEmissionsTracker
-from .net import get_net
-from .net_lib import test_model, load_data
+from .net import get_net, compile_net
+from .net_lib import test_model, load_data, subset_loader, SampleCounter
 from .net_lib import train_model, train_fedavg, train_scaffold, train_mimelite, train_mime, train_feddyn
-from torch.utils.data import DataLoader
-from .get_data import get_data
+from .wire_format import encode_payload, encode_payload_chunks, decode_payload
+from .model_delta import apply_delta
+from .quantization import quantize_update, quantize_tensors
+from .sparsification import sparsify_update
+from .snapshot import ParameterSnapshot
 
 from .ClientConnection_pb2 import  EvalResponse, TrainResponse
 
 #create a new directory inside FL_checkpoints and store the aggragted models in each round
 fl_timestamp = f"{datetime.now().strftime('%Y-%m-%d %H-%M-%S')}"
 save_dir_path = f"client_checkpoints/{fl_timestamp}"
-os.makedirs(save_dir_path)
+#DataLoader worker processes import this module again in the same second
+os.makedirs(save_dir_path, exist_ok=True)
 
-def evaluate(eval_order_message, device):
+#the global model this client last received and its version. the server sends the next versions
+#as deltas against it, or leaves the model out when it did not change
+class GlobalModel:
+    def __init__(self):
+        self.version = 0
+        self.state_dict = None
+
+    #state dict carried by an order, given the version it has and the version it is a delta against
+    def receive(self, model_data, version, base_version):
+        if base_version == 0:
+            state_dict = model_data
+        elif base_version != self.version:
+            raise ValueError(f"Received a delta against model version {base_version}, holding {self.version}")
+        elif model_data is None:
+            state_dict = self.state_dict
+        else:
+            state_dict = apply_delta(self.state_dict, model_data)
+        self.version = version
+        #nothing to keep when the server does not keep versions
+        self.state_dict = state_dict if version else None
+        return state_dict
+
+#state kept by a client for as long as it runs. the network and the data loaders are built once for a
+#configuration and reused in every round, an order then only loads its parameters into the network
+class ClientSession:
+    #settings of a training order the data loaders depend on
+    DATA_SETTINGS = ('dataset', 'net', 'niid', 'batch_size', 'resize_size', 'dataset_cache', 'prefetch',
+                     'num_workers', 'persistent_workers', 'pin_memory', 'prefetch_factor',
+                     'partition', 'num_users', 'dirichlet_alpha', 'shards_per_user', 'classes_per_user')
+
+    #client_id selects the share of the partitioned dataset this client trains on
+    def __init__(self, device, client_id = 0):
+        self.device = device
+        self.client_id = client_id
+        #configuration of the last training order, evaluation and set_parameters orders use it
+        self.config = None
+        self.model_key, self.model = None, None
+        self.data_key, self.loaders = None, None
+        #what sparse uploads of earlier rounds left out, see sparsification.py
+        self.residual = {}
+        #FedDyn gradient correction of this client, see train_feddyn, and the lock on its file
+        self.feddyn_state, self.feddyn_lock = None, None
+        #starting point of the trainers, its buffers are reused from round to round
+        self.snapshot = ParameterSnapshot()
+        #test subset of --client_eval sampled
+        self.sample_key, self.sample_loader = None, None
+        #post-train evaluation running in the background with --client_eval async, and the results of the
+        #last one, sent with the next training reply
+        self.evaluation, self.evaluation_results = None, None
+
+    #configuration of the last training order, read from config.json when this client has not trained yet
+    def last_config(self):
+        if self.config is None:
+            with open("config.json", "r", encoding='utf-8') as jsonfile:
+                self.config = json.load(jsonfile)
+        return self.config
+
+    #the network of the configuration, holding the given parameters. test_model leaves the kept network in
+    #eval mode, it is handed out in train mode as a new one would be
+    def get_model(self, config, state_dict):
+        model_key = (config['net'], config['dataset'], config.get('compile', 0))
+        if model_key != self.model_key:
+            self.model = get_net(config= config).to(self.device)
+            #compiled once, the network is kept from round to round
+            if config.get('compile', 0):
+                self.model = compile_net(self.model)
+            self.model_key = model_key
+        self.model.load_state_dict(state_dict)
+        self.model.train()
+        return self.model
+
+    #the FedDyn gradient correction is kept in memory and saved after every round in a file of the share of
+    #the dataset this client trains on, a restarted client picks it up from there
+    def feddyn_path(self):
+        return f"client_checkpoints/feddyn_state_{self.client_id}.pt"
+
+    #the file of a client_id is used by one running client at a time, a second client with the same
+    #client_id is refused instead of sharing it. the lock is released by the system when the client exits
+    def lock_feddyn_state(self):
+        if self.feddyn_lock is not None:
+            return
+        lock = open(f"{self.feddyn_path()}.lock", "a+b")
+        try:
+            if os.name == "nt":
+                import msvcrt
+                msvcrt.locking(lock.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            raise RuntimeError(f"Another client runs FedDyn with client_id {self.client_id}, "
+                               "give every client a different --client_id") from None
+        self.feddyn_lock = lock
+
+    def get_feddyn_state(self, model):
+        self.lock_feddyn_state()
+        num_parameters = sum(param.numel() for param in model.parameters())
+        if self.feddyn_state is None and os.path.isfile(self.feddyn_path()):
+            self.feddyn_state = torch.load(self.feddyn_path(), map_location=self.device)
+        #a new network starts from no correction
+        if self.feddyn_state is None or self.feddyn_state.numel() != num_parameters:
+            self.feddyn_state = torch.zeros(num_parameters, device=self.device)
+        return self.feddyn_state
+
+    def set_feddyn_state(self, state):
+        self.feddyn_state = state
+        temporary_path = f"{self.feddyn_path()}.{os.getpid()}.tmp"
+        torch.save(state, temporary_path)
+        os.replace(temporary_path, self.feddyn_path())
+
+    #trainloader, testloader and number of examples of the configuration
+    def get_loaders(self, config):
+        data_key = tuple(config.get(setting) for setting in self.DATA_SETTINGS)
+        if data_key != self.data_key:
+            self.loaders = load_data(dict(config, client_id = self.client_id))
+            self.data_key = data_key
+        return self.loaders
+
+    #loader of the client_eval_samples test samples of --client_eval sampled, the same in every round
+    def get_sample_loader(self, config):
+        _, testloader, _ = self.get_loaders(config)
+        sample_key = (self.data_key, config.get('client_eval_samples', 1000))
+        if sample_key != self.sample_key:
+            self.sample_loader = subset_loader(testloader, sample_key[1], seed = self.client_id)
+            self.sample_key = sample_key
+        return self.sample_loader
+
+    #runs evaluation() in a background thread, its results are kept for the next training reply
+    def evaluate_in_background(self, evaluation):
+        def run():
+            self.evaluation_results = evaluation()
+        self.evaluation = threading.Thread(target = run, daemon = True)
+        self.evaluation.start()
+
+    #waits for the background evaluation to end, the network can be changed again after it
+    def wait_evaluation(self):
+        if self.evaluation is not None:
+            self.evaluation.join()
+            self.evaluation = None
+
+def evaluate(eval_order_message, session):
     model_parameters_bytes = eval_order_message.modelParameters
-    model_parameters = torch.load( BytesIO(model_parameters_bytes), map_location="cpu" )
+    model_parameters = decode_payload(model_parameters_bytes)
 
     config_dict_bytes = eval_order_message.configDict
     config_dict = json.loads( config_dict_bytes.decode("utf-8") )
 
     state_dict = model_parameters
     print("Evaluation:",config_dict)
-    with open("config.json", "r", encoding='utf-8') as jsonfile:
-        config_dict = json.load(jsonfile)
-    model = get_net(config= config_dict).to(device)
-    model.load_state_dict(state_dict)
-
-    _, testset = get_data(config= config_dict)
-    testloader = DataLoader(testset, batch_size=config_dict['batch_size'])
-
-    #_, testloader, _ = load_data(config_dict)
+    session.wait_evaluation()
+    config_dict = session.last_config()
+    model = session.get_model(config_dict, state_dict)
+    _, testloader, _ = session.get_loaders(config_dict)
 
-
-    eval_loss, eval_accuracy = test_model(model, testloader, device)
+    eval_loss, eval_accuracy = test_model(model, testloader, session.device, config_dict.get("precision", "fp32"))
 
     response_dict = {"eval_loss": eval_loss, "eval_accuracy": eval_accuracy}
     response_dict_bytes = json.dumps(response_dict).encode("utf-8")
@@ -46,18 +185,23 @@ def evaluate(eval_order_message, device):
     return eval_response_message
 
 
-def train(train_order_message, device):
-    data_bytes = train_order_message.modelParameters
-    data = torch.load( BytesIO(data_bytes), map_location="cpu" )
-    model_parameters, control_variate,  = data['model_parameters'], data['control_variate']
+#chunks holds the model when the order is chunked, it was streamed ahead of the order
+def train(train_order_message, chunks, global_model, session):
+    device = session.device
+    if train_order_message.chunked:
+        data = chunks.result()
+    else:
+        data = decode_payload(train_order_message.modelParameters)
+    session.wait_evaluation()
+    model_parameters = global_model.receive(data['model_parameters'], train_order_message.modelVersion,
+                                            train_order_message.baseVersion)
+    control_variate = data['control_variate']
     control_variate2 = data['control_variate2']
     config_dict_bytes = train_order_message.configDict
     config_dict = json.loads( config_dict_bytes.decode("utf-8") )
     carbon_tracker = config_dict["carbon-tracker"]
 
-    model = get_net(config= config_dict)
-    model.load_state_dict(model_parameters)
-    model = model.to(device)
+    model = session.get_model(config_dict, model_parameters)
     epochs = config_dict["epochs"]
     if config_dict["timeout"]:
         deadline = time.time() + config_dict["timeout"]
@@ -69,20 +213,34 @@ def train(train_order_message, device):
         tracker = OfflineEmissionsTracker(country_iso_code="IND", output_dir = save_dir_path)
         tracker.start()
 
-    trainloader, testloader, _ = load_data(config_dict)
+    trainloader, testloader, _ = session.get_loaders(config_dict)
+    #counts the samples the trainer goes through, feddyn trains on one batch per epoch and a deadline can
+    #end an epoch early
+    trainloader = SampleCounter(trainloader)
     print("Training started")
+    #fp32, or bf16 for forward passes under autocast to bfloat16
+    precision = config_dict.get("precision", "fp32")
+    training_start = time.perf_counter()
     if config_dict['algorithm'] == 'mimelite':
-        model, control_variate = train_mimelite(model, control_variate, trainloader, epochs, device, deadline)
+        model, control_variate = train_mimelite(model, control_variate, trainloader, epochs, device, deadline,
+                                                config_dict.get("gradient_batch_size"), session.snapshot,
+                                                precision)
     elif config_dict['algorithm'] == 'scaffold':
-        model, control_variate = train_scaffold(model, control_variate, trainloader, epochs, device, deadline)
+        model, control_variate = train_scaffold(model, control_variate, trainloader, epochs, device, deadline,
+                                                session.snapshot, precision)
     elif config_dict['algorithm'] == 'mime':
-        model, control_variate = train_mime(model, control_variate, control_variate2, trainloader, epochs, device, deadline)
+        model, control_variate = train_mime(model, control_variate, control_variate2, trainloader, epochs, device, deadline,
+                                            session.snapshot, precision)
     elif config_dict['algorithm'] == 'fedavg':
-        model = train_fedavg(model, trainloader, epochs, device, deadline)
+        model = train_fedavg(model, trainloader, epochs, device, deadline, precision)
     elif config_dict['algorithm'] == 'feddyn':
-        model = train_feddyn(model, trainloader, epochs, device, deadline)
+        model, feddyn_state = train_feddyn(model, session.get_feddyn_state(model), trainloader, epochs, device,
+                                           deadline, session.snapshot, precision)
+        session.set_feddyn_state(feddyn_state)
     else:
-        model = train_model(model, trainloader, epochs, device, deadline)
+        model = train_model(model, trainloader, epochs, device, deadline, session.snapshot, precision)
+    #throughput of the training loop, data loading included
+    samples_per_second = trainloader.samples / (time.perf_counter() - training_start)
 
     if carbon_tracker==1:
         emissions: float = tracker.stop()
@@ -95,37 +253,84 @@ def train(train_order_message, device):
     json_path = "config.json"
     with open(json_path, "w", encoding='utf-8') as jsonfile:
         jsonfile.write(myJSON)
+    session.config = config_dict
 
     trained_model_parameters = model.state_dict()
     #Create a dictionary where model_parameters and control_variate are stored which needs to be sent to the server
     data_to_send = {}
     data_to_send['model_parameters'] = trained_model_parameters
     data_to_send['control_variate'] = control_variate #If there is no control_variate, this will become None
-    buffer = BytesIO()
-    torch.save(data_to_send, buffer)
-    buffer.seek(0)
-    data_to_send_bytes = buffer.read()
-
-    print("Evaluation")
-    train_loss, train_accuracy = test_model(model, testloader, device)
-    response_dict = {"train_loss": train_loss, "train_accuracy": train_accuracy}
+    #with upload_bits the update is quantized, the model as its difference with the received global model
+    #unless the aggregator says the trainer already returned that difference (uploads_deltas).
+    #with upload_topk or upload_threshold the model is sparsified instead
+    upload_bits = config_dict.get("upload_bits")
+    per_channel = config_dict.get("upload_granularity") == "channel"
+    update_base = None if config_dict.get("uploads_deltas") else model_parameters
+    if config_dict.get("upload_topk") or config_dict.get("upload_threshold"):
+        data_to_send['model_parameters'] = sparsify_update(trained_model_parameters, update_base, session.residual,
+                                                           config_dict.get("upload_topk"),
+                                                           config_dict.get("upload_threshold"))
+    elif upload_bits:
+        data_to_send['model_parameters'] = quantize_update(trained_model_parameters, update_base,
+                                                           upload_bits, per_channel)
+    if upload_bits:
+        if control_variate is not None:
+            data_to_send['control_variate'] = quantize_tensors(control_variate, upload_bits, per_channel)
+    #with a chunk_size the model goes back as chunks, encoded lazily while they are being sent
+    chunk_size = config_dict.get("chunk_size")
+    if chunk_size:
+        model_chunks = encode_payload_chunks(data_to_send, chunk_size)
+        data_to_send_bytes = b""
+    else:
+        model_chunks = []
+        data_to_send_bytes = encode_payload(data_to_send)
+
+    response_dict = {"samples_per_second": samples_per_second}
+    #results of the evaluation that ran in the background after the previous training
+    previous_results, session.evaluation_results = session.evaluation_results, None
+    #the trained model is evaluated in the rounds that are a multiple of client_eval_every, on the whole
+    #test set (full), on a fixed subset of it (sampled) or after this reply has been sent (async).
+    #no reply follows the last round, so async evaluates it on the whole test set before replying
+    client_eval = config_dict.get("client_eval", "full")
+    round = config_dict.get("round", 0)
+    evaluates = client_eval != "off" and round % config_dict.get("client_eval_every", 1) == 0
+    in_background = client_eval == "async" and round != config_dict.get("num_of_rounds")
+    if client_eval == "sampled":
+        testloader = session.get_sample_loader(config_dict)
+    def evaluation():
+        print("Evaluation")
+        train_loss, train_accuracy = test_model(model, testloader, device, precision)
+        return {"train_loss": train_loss, "train_accuracy": train_accuracy, "eval_round": round}
+    if evaluates and not in_background:
+        response_dict.update(evaluation())
+    if previous_results is not None:
+        #in the last round they are reported apart from the results of this round
+        if "eval_round" in response_dict:
+            response_dict["previous_eval"] = previous_results
+        else:
+            response_dict.update(previous_results)
     response_dict_bytes = json.dumps(response_dict).encode("utf-8")
 
     train_response_message = TrainResponse(
         modelParameters = data_to_send_bytes,
-        responseDict = response_dict_bytes)
+        responseDict = response_dict_bytes,
+        chunked = bool(chunk_size))
 
     save_model_state(model)
-    return train_response_message
+    if evaluates and in_background:
+        session.evaluate_in_background(evaluation)
+    return model_chunks, train_response_message
 
 #replace current model with the model provided
-def set_parameters(set_parameters_order_message, device):
-    model_parameters_bytes = set_parameters_order_message.modelParameters
-    model_parameters = torch.load( BytesIO(model_parameters_bytes), map_location="cpu" )
-    with open("config.json", "r", encoding='utf-8') as jsonfile:
-        config_dict = json.load(jsonfile)
-    model = get_net(config= config_dict).to(device)
-    model.load_state_dict(model_parameters)
+def set_parameters(set_parameters_order_message, chunks, global_model, session):
+    if set_parameters_order_message.chunked:
+        model_data = chunks.result()
+    else:
+        model_data = decode_payload(set_parameters_order_message.modelParameters)
+    model_parameters = global_model.receive(model_data, set_parameters_order_message.modelVersion,
+                                            set_parameters_order_message.baseVersion)
+    session.wait_evaluation()
+    model = session.get_model(session.last_config(), model_parameters)
     save_model_state(model)
 
 #save the current model to model_checkpoints
@@ -1,4 +1,4 @@
-import torch
+from .distribution import Partition
 
 #from PIL import Image
 from torch.utils import data
@@ -28,14 +28,22 @@ class distributionDataloader(data.Dataset):
         self.stdv = 78.5675
 
 
-        self.data_idxs = torch.load(data_path)['datapoints'][clientID]
+        partition = Partition(data_path)
+        if not 0 <= clientID < partition.num_users:
+            raise ValueError(f"Client id {clientID} out of range, the dataset is split among {partition.num_users} users")
+        self.data_idxs = partition.datapoints(clientID)
 
 
     def __len__(self):
         return len(self.data_idxs)
 
     def __getitem__(self, index):
-        image = self.trainset[self.data_idxs[index]][0]
-        label = self.trainset[self.data_idxs[index]][1]
+        image, label = self.trainset[int(self.data_idxs[index])]
 
         return image, label
+
+    #whole batches are read at once from datasets that support it (see dataset_cache.py)
+    def __getitems__(self, indices):
+        if hasattr(self.trainset, "__getitems__"):
+            return self.trainset.__getitems__(self.data_idxs[indices])
+        return [self[index] for index in indices]
@@ -1,25 +1,87 @@
 import numpy as np
-import torch
 import random
 import os
+import json
+import hashlib
+from torch.utils.data import Subset
+
+from .partitioner import partition, histograms, largest_remainder
+
+#labels of a whole dataset as a NumPy array, read from the label array the dataset keeps
+#(targets for torchvision datasets and customDataset) instead of decoding every sample
+def dataset_labels(dataset):
+    if isinstance(dataset, Subset):
+        return dataset_labels(dataset.dataset)[np.asarray(dataset.indices)]
+    for attribute in ('targets', 'labels'):
+        labels = getattr(dataset, attribute, None)
+        if labels is not None:
+            return np.asarray(labels)
+    return np.array([dataset[i][1] for i in range(len(dataset))])
+
+#A partition is stored as a single int64 .npy array so that it can be memory-mapped:
+#   [num_users, num_classes, offsets (num_users + 1), histograms (num_users * num_classes), datapoints]
+#where the datapoints of user i are datapoints[offsets[i]:offsets[i + 1]].
+#Files are named after a hash of everything the partition depends on, so a partition is generated once and
+#then shared by the rounds and by all the clients of a host. They are written to a temporary file that is
+#renamed into place, readers never see a partial file and need no lock.
+class Partition:
+    def __init__(self, path):
+        self.array = np.load(path, mmap_mode='r')
+        self.num_users, self.num_classes = (int(value) for value in self.array[:2])
+        self.offsets = self.array[2:3 + self.num_users]
+        histograms_start = 3 + self.num_users
+        self.datapoints_start = histograms_start + self.num_users * self.num_classes
+        self.histograms = self.array[histograms_start:self.datapoints_start].reshape(self.num_users, self.num_classes)
+
+    #indices into the dataset of the samples of a user, a view of the memory-mapped file
+    def datapoints(self, user):
+        return self.array[self.datapoints_start + self.offsets[user]:self.datapoints_start + self.offsets[user + 1]]
+
+#the settings a partition depends on, besides the dataset, seed, number of users and dataset length
+PARTITION_SETTINGS = {"niid": ("niid",), "dirichlet": ("dirichlet_alpha",), "shards": ("shards_per_user",),
+                      "classes": ("classes_per_user",)}
+
+def partition_path(config, dataset_length, seed, num_users):
+    scheme = config.get('partition', 'niid')
+    settings = [config.get(setting) for setting in PARTITION_SETTINGS[scheme]]
+    key = json.dumps([config['dataset'], scheme, settings, seed, num_users, dataset_length])
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(os.getcwd(), 'Distribution', config['dataset'], f'split_{digest}.npy')
+
+#stores a split in CSR form, the datapoints of user i being datapoints[offsets[i]:offsets[i + 1]]
+def save_partition(path, offsets, datapoints, class_histogram):
+    class_histogram = np.asarray(class_histogram)
+    array = np.concatenate([class_histogram.shape, offsets, class_histogram.ravel(), datapoints]).astype(np.int64)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as file:
+        np.save(file, array)
+    os.replace(temporary_path, path)
+
+#splits trainset among the users and returns the path of the partition file, which is only generated
+#when no earlier call (of this or another client) has done it already.
+#config['partition'] selects a scheme of partitioner.py, by default the niid scheme below is used
 def data_distribution(config, trainset):
-    labels = []
-    base_dir = os.getcwd()
-    storepath = os.path.join(base_dir, 'Distribution/', config['dataset']+'/')
     seed = 10
+    num_users = config.get('num_users', 5)
+    path = partition_path(config, len(trainset), seed, num_users)
+    if os.path.exists(path):
+        return path
     random.seed(seed)
-    num_users = 5
-
-    #Calculate the number of samples present per class
-    trainset_list = list(range(len(trainset)))
-    for i in trainset_list:
-        labels.append(trainset[i][1])
-    unique_labels = np.unique(np.array(labels))
-    label_index_list = {}
-    for key in unique_labels:
-        label_index_list[key] = []
-    for index, label in enumerate(labels):
-        label_index_list[label].append(index)
+    np.random.seed(seed)
+
+    if config.get('partition', 'niid') != 'niid':
+        labels = dataset_labels(trainset)
+        offsets, datapoints = partition(config, labels, num_users, np.random.default_rng(seed))
+        save_partition(path, offsets, datapoints, histograms(labels, offsets, datapoints))
+        return path
+
+    #Calculate the number of samples present per class.
+    #a stable sort groups the indices by class and keeps them in ascending order within a class
+    labels = dataset_labels(trainset)
+    unique_labels, class_counts = np.unique(labels, return_counts=True)
+    class_indices = np.split(np.argsort(labels, kind='stable'), np.cumsum(class_counts)[:-1])
+    label_index_list = {key: indices.tolist() for key, indices in zip(unique_labels, class_indices)}
     num_classes = len(unique_labels)
 
     #Calculate the value of the probability distribution. For K=1, it will be iid distribution
@@ -47,10 +109,8 @@ def data_distribution(config, trainset):
                     zero_array[np.random.choice(len(zero_array),1)] =1
                     data_presence_indicator[:,i] = zero_array
             dist = np.multiply(dist,data_presence_indicator)
-        psum = np.sum(dist, axis=1)
-        for i in range(dist.shape[0]):
-            dist[i] = dist[i]*len(label_index_list[i])/(psum[i]+0.00001)
-        dist = np.floor(dist).astype(int)
+        #number of samples of every class per client, rounded so that they add up to the size of the class
+        dist = largest_remainder(dist, class_counts)
 
         # If any client does not get any data then this logic helps to allocate the required samples among the clients
         gainers = list(np.where(np.sum(dist, axis=0) != 0))[0]
@@ -65,16 +125,6 @@ def data_distribution(config, trainset):
                     dist[digit, donor] = dist[digit, donor] - num_transfer
                     dist[digit, losers[index]] = num_transfer
 
-        #Logic to check if the summation of all the samples among the clients is equal to
-        # # the total number of samples present for that class. If not it will adjust.
-        for num in range(num_classes):
-            while dist[num].sum() != len(label_index_list[num]):
-                index = random.randint(0,num_users-1)
-                if dist[num].sum() < len(label_index_list[num]):
-                    dist[num][index]+=1
-                else:
-                    dist[num][index]-=1
-
         #Division of samples number among the clients
         split = [[] for i in range(num_classes)]
         for num in range(num_classes):
@@ -96,10 +146,7 @@ def data_distribution(config, trainset):
                 else:
                     class_stats[i].append(1)
 
-        #Store the dataset division in the folder
-        if not os.path.exists(storepath):
-            os.makedirs(storepath)
-        file_name = 'data_split_niid_'+ str(K)+'.pt'
-
-        torch.save({'datapoints': datapoints, 'histograms': class_histogram,
-                    'class_statitics': class_stats}, storepath + file_name)
+    #Store the dataset division in the folder, class_stats follow from the histograms
+    offsets = np.cumsum([0] + [len(user_datapoints) for user_datapoints in datapoints])
+    save_partition(path, offsets, np.concatenate(datapoints), class_histogram)
+    return path
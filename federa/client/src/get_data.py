@@ -2,7 +2,10 @@ import os
 from torchvision import transforms,datasets
 from torch.utils import data
 import numpy as np
+import torch
 from PIL import Image
+from .dataset_cache import cached_dataset, array_dataset, as_nchw, collate, Batch
+from .packed_dataset import open_packed
 
 # Define a function to get the train and test datasets based on the given configuration
 def get_data(config):
@@ -13,36 +16,25 @@ def get_data(config):
             os.makedirs(dataset_path)
 
     # Get the train and test datasets for each supported dataset
-    if config['dataset'] == 'MNIST':
-        # Apply transformations to the images
-        apply_transform = transforms.Compose([transforms.Resize(config["resize_size"]), transforms.ToTensor()])
-        # Download and load the trainset
-        trainset = datasets.MNIST(root='client_dataset/MNIST', train=True, download=True, transform=apply_transform)
-        # Download and load the testset
-        testset = datasets.MNIST(root='client_dataset/MNIST', train=False, download=True, transform=apply_transform)
-    elif config['dataset'] == 'FashionMNIST':
-        apply_transform = transforms.Compose([transforms.Resize(config['resize_size']), transforms.ToTensor()])
-        trainset = datasets.FashionMNIST(root='client_dataset/FashionMNIST',
-                                        train=True, download=True, transform=apply_transform)
-        testset = datasets.FashionMNIST(root='client_dataset/FashionMNIST',
-                                        train=False, download=True, transform=apply_transform)
-    elif config['dataset'] == 'CIFAR10':
-        apply_transform = transforms.Compose([transforms.Resize(config['resize_size']), transforms.ToTensor()])
-        trainset = datasets.CIFAR10(root='client_dataset/CIFAR10',
-                                    train=True, download=True, transform=apply_transform)
-        testset = datasets.CIFAR10(root='client_dataset/CIFAR10',
-                                   train=False, download=True, transform=apply_transform)
-    elif config['dataset'] == 'CIFAR100':
-        apply_transform = transforms.Compose([transforms.Resize(config['resize_size']), transforms.ToTensor()])
-        trainset = datasets.CIFAR100(root='client_dataset/CIFAR100',
-                                     train=True, download=True, transform=apply_transform)
-        testset = datasets.CIFAR100(root='client_dataset/CIFAR100',
-                                    train=False, download=True, transform=apply_transform)
+    builtin_datasets = {'MNIST': datasets.MNIST, 'FashionMNIST': datasets.FashionMNIST,
+                        'CIFAR10': datasets.CIFAR10, 'CIFAR100': datasets.CIFAR100}
+    if config['dataset'] in builtin_datasets:
+        # Images are resized batch by batch after collation, or once into a memory-mapped cache,
+        # see dataset_cache.py
+        dataset_class = builtin_datasets[config['dataset']]
+        root = f"client_dataset/{config['dataset']}"
+        load = cached_dataset if config.get('dataset_cache', 1) else array_dataset
+        trainset = load(dataset_class, root, True, config['resize_size'])
+        testset = load(dataset_class, root, False, config['resize_size'])
     elif config['dataset'] == 'CUSTOM':
         apply_transform = transforms.Compose([transforms.Resize(config['resize_size']), transforms.ToTensor()])
-        # Load the custom dataset
-        trainset = customDataset(root='client_custom_dataset/CUSTOM/train', transform=apply_transform)
-        testset = customDataset(root='client_custom_dataset/CUSTOM/test', transform=apply_transform)
+        # Load the custom dataset, packed into memory-mapped shards on first use (see packed_dataset.py)
+        # and resized batch by batch after collation when its images allow it
+        packed = config.get('dataset_cache', 1)
+        trainset = customDataset(root='client_custom_dataset/CUSTOM/train', transform=apply_transform, packed=packed,
+                                 resize_size=config['resize_size'])
+        testset = customDataset(root='client_custom_dataset/CUSTOM/test', transform=apply_transform, packed=packed,
+                                resize_size=config['resize_size'])
     else:
         # Raise an error if an unsupported dataset is specified
         raise ValueError(f"Unsupported dataset type: {config['dataset']}")
@@ -52,7 +44,7 @@ def get_data(config):
     return trainset, testset
 
 class customDataset(data.Dataset):
-    def __init__(self, root, transform=None):
+    def __init__(self, root, transform=None, packed=True, resize_size=None):
         """
         Custom dataset class for loading image and label data from a folder of .npy files.
         Args:
@@ -60,14 +52,28 @@ class customDataset(data.Dataset):
             transform (callable, optional): A function/transform that takes
               an PIL image and returns a transformed version.
                                             E.g, `transforms.RandomCrop`
+            packed (bool, optional): Read the samples from a packed copy of the folder
+              instead of one .npy file per sample.
+            resize_size (int, optional): Serve whole batches, resized to resize_size after
+              collation, instead of transforming every sample. Used when the samples are packed
+              uint8 images of one shape, transform is then left unused.
         """
 
         self.root = root
-        samples = sample_return(root)
-
-        self.samples = samples
+        if packed:
+            self.shards = open_packed(root, sample_return)
+            self.samples = None
+            self.targets = self.shards.labels
+        else:
+            self.shards = None
+            samples = sample_return(root)
+
+            self.samples = samples
+            #labels of all samples, so that they can be read without loading the images
+            self.targets = np.array([label for _, label in samples], dtype=np.int64)
 
         self.transform = transform
+        self.resize_size = resize_size if self.shards is not None and batchable(self.shards) else None
 
     def __getitem__(self, index):
         """
@@ -78,9 +84,15 @@ class customDataset(data.Dataset):
             img (PIL.Image): The image data.
             label (int): The label for the image data.
         """
-        img, label= self.samples[index]
+        if self.resize_size is not None:
+            images, labels = collate(self.__getitems__([index]))
+            return images[0], int(labels[0])
+        if self.shards is not None:
+            img, label = self.shards.array(index), int(self.targets[index])
+        else:
+            img, label= self.samples[index]
 
-        img = np.load(img)
+            img = np.load(img)
 
         img = Image.fromarray(img)
 
@@ -90,8 +102,27 @@ class customDataset(data.Dataset):
 
         return img, label
 
+    def __getitems__(self, indices):
+        """
+        Retrieves the samples at the given indices, as a batch collated by `collate`.
+        """
+        if self.resize_size is None:
+            return [self[index] for index in indices]
+        indices = np.asarray(indices)
+        images = torch.from_numpy(np.ascontiguousarray(as_nchw(self.shards.stack(indices))))
+        return Batch(images, torch.from_numpy(self.targets[indices]), self.resize_size)
+
     def __len__(self):
-        return len(self.samples)
+        return len(self.targets)
+
+def batchable(shards):
+    """
+    Whether packed samples are uint8 grayscale, RGB or RGBA images of one shape,
+    which can be resized as a batch the way PIL resizes them one by one.
+    """
+    if shards.shape is None or shards.dtype != np.uint8:
+        return False
+    return len(shards.shape) == 2 or (len(shards.shape) == 3 and shards.shape[2] in (3, 4))
 
 def sample_return(root):
     # Initialize an empty list to hold the samples
@@ -1,3 +1,4 @@
+import torch
 from torch import nn
 from torchvision import models
 
@@ -21,7 +22,7 @@ class LeNet(nn.Module):
         x = self.conv2(x)
         x = self.relu(x)
         x = self.pool2(x)
-        x = x.view(-1, 400)
+        x = x.reshape(-1, 400)
         x = self.fc1(x)
         x = self.relu(x)
         x = self.fc2(x)
@@ -67,3 +68,12 @@ def get_net(config):
         else:
             net = models.alexnet(num_classes=100)
     return net
+
+#--compile: the network runs with channels_last weights and a forward compiled by torch.compile. only its
+#forward is replaced, so it stays the same module with the parameters and state_dict keys of the eager network
+#(torch.compile(net) would wrap it), and the compiled graphs are built on its first batches and kept for as
+#long as the network is
+def compile_net(net):
+    net = net.to(memory_format=torch.channels_last)
+    net.forward = torch.compile(net.forward)
+    return net
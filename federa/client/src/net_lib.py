@@ -1,45 +1,90 @@
-import os
 import time
-from copy import deepcopy
 from math import ceil
 from tqdm import tqdm
 
 
 import torch
+from torch.func import functional_call
 
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Subset
 
 
 from .data_utils import distributionDataloader
 from .distribution import data_distribution
 from .get_data import  get_data
+from .dataset_cache import collate
+from .optimizers import MimeSGD, ScaffoldSGD
+from .snapshot import ParameterSnapshot
+from .packed_dataset import PrefetchDataLoader
 # DEVICE = torch.device("cuda:2" if torch.cuda.is_available() else "cpu")
 # #device id  of this should be same in client_lib device
 
+#DataLoader arguments of the loader settings of the configuration. with workers, batches are prepared in
+#worker processes while the network trains, and persistent workers are kept by the loaders of the client
+#session from one round to the next
+def loader_options(config):
+    options = {"collate_fn": collate, "num_workers": config.get('num_workers', 0),
+               "pin_memory": bool(config.get('pin_memory', 0)) and torch.cuda.is_available()}
+    if options["num_workers"]:
+        options["persistent_workers"] = bool(config.get('persistent_workers', 1))
+        options["prefetch_factor"] = config.get('prefetch_factor', 2)
+    return options
+
 def load_data(config):
     trainset, testset = get_data(config)
+    options = loader_options(config)
     # Data distribution for non-custom datasets
     if config['dataset'] != 'CUSTOM':
-        data_distribution(config, trainset)
-        data_path = os.path.join(os.getcwd(), 'Distribution/', config['dataset'],
-                                 'data_split_niid_'+ str(config['niid'])+'.pt')
-        datasets = distributionDataloader(config,  trainset, data_path)
-        trainloader = DataLoader(datasets, batch_size= config['batch_size'], shuffle=True)
-        testloader = DataLoader(testset, batch_size=config['batch_size'])
+        data_path = data_distribution(config, trainset)
+        datasets = distributionDataloader(config,  trainset, data_path, clientID = config.get('client_id', 0))
+        trainloader = DataLoader(datasets, batch_size= config['batch_size'], shuffle=True, **options)
+        testloader = DataLoader(testset, batch_size=config['batch_size'], **options)
         num_examples = {"trainset": len(datasets), "testset": len(testset)}
     else:
-        trainloader = DataLoader(trainset, batch_size= config['batch_size'], shuffle=True)
-        testloader = DataLoader(testset, batch_size=config['batch_size'])
+        # CUSTOM samples are transformed one by one, the next batch can be prepared in the background
+        loader_class = PrefetchDataLoader if config.get('prefetch', 0) else DataLoader
+        trainloader = loader_class(trainset, batch_size= config['batch_size'], shuffle=True, **options)
+        testloader = loader_class(testset, batch_size=config['batch_size'], **options)
         num_examples = {"trainset": len(trainset), "testset": len(testset)}
 
     # Return data loaders and number of examples in train and test datasets
     return trainloader, testloader, num_examples
 
+#loader of a random subset of samples of the dataset of loader, always the same for a given seed
+def subset_loader(loader, samples, seed = 0):
+    indices = torch.randperm(len(loader.dataset), generator=torch.Generator().manual_seed(seed))[:samples]
+    return DataLoader(Subset(loader.dataset, indices.sort().values.tolist()), batch_size = loader.batch_size,
+                      collate_fn = loader.collate_fn)
+
+
+#iterates over the batches of loader counting their samples, the trainers take it in place of loader
+class SampleCounter:
+    def __init__(self, loader):
+        self.loader = loader
+        self.samples = 0
+
+    def __iter__(self):
+        for images, labels in self.loader:
+            self.samples += len(labels)
+            yield images, labels
+
+    def __len__(self):
+        return len(self.loader)
+
+    #dataset, batch_size and collate_fn of loader
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
 
 def flush_memory():
     torch.cuda.empty_cache()
 
-def train_model(net, trainloader, epochs, device, deadline=None):
+#--precision bf16: the forward passes and losses of the trainers and of test_model run under autocast to
+#bfloat16. the parameters, their gradients and the updates of the optimizers stay float32
+def autocast(device, precision = "fp32"):
+    return torch.autocast(torch.device(device).type, dtype=torch.bfloat16, enabled=precision == "bf16")
+
+def train_model(net, trainloader, epochs, device, deadline=None, snapshot=None, precision="fp32"):
 
     """
     Trains a neural network model on a given dataset using SGD optimizer with Cross Entropy Loss criterion.
@@ -48,23 +93,26 @@ def train_model(net, trainloader, epochs, device, deadline=None):
         trainloader: PyTorch DataLoader object for training dataset
         epochs: number of epochs to train the model
         deadline: optional deadline time for training
+        snapshot: ParameterSnapshot the received model is kept in, reused from round to round
+        precision: "bf16" runs the forward passes under autocast to bfloat16
 
     Returns:
         trained model with the difference between trained model and the received model
     """
-    x = deepcopy(net)
+    # Set the model to training mode, the snapshot keeps the mode of the network
+    net.train()
+    x = (snapshot or ParameterSnapshot()).capture(net)
     # Define the loss function and optimizer
     criterion = torch.nn.CrossEntropyLoss()
     optimizer = torch.optim.SGD(net.parameters(), lr=0.001, momentum=0.9)
-    # Set the model to training mode
-    net.train()
 
     # Train the model for the specified number of epochs
     for _ in tqdm(range(epochs)):
         for images, labels in trainloader:
             images, labels = images.to(device), labels.to(device)
             optimizer.zero_grad()
-            loss = criterion(net(images), labels)
+            with autocast(device, precision):
+                loss = criterion(net(images), labels)
             loss.backward()
             optimizer.step()
             # Check if the deadline time has been reached
@@ -75,12 +123,11 @@ def train_model(net, trainloader, epochs, device, deadline=None):
                 break
 
     # Calculate the difference between the trained model and the received model
-    for param_net, param_x in zip(net.parameters(), x.parameters()):
-        param_net.data = param_net.data - param_x.data
+    x.subtract_from(net)
 
     return net
 
-def train_fedavg(net, trainloader, epochs, device, deadline=None):
+def train_fedavg(net, trainloader, epochs, device, deadline=None, precision="fp32"):
     """
     Trains a given neural network using the Federated Averaging (FedAvg) algorithm.
 
@@ -89,6 +136,7 @@ def train_fedavg(net, trainloader, epochs, device, deadline=None):
     trainloader: A PyTorch DataLoader containing the training dataset
     epochs: An integer specifying the number of training epochs
     deadline: An optional deadline (in seconds) for the training process
+    precision: "bf16" runs the forward passes under autocast to bfloat16
 
     Returns:
     A trained PyTorch neural network model
@@ -109,11 +157,10 @@ def train_fedavg(net, trainloader, epochs, device, deadline=None):
             # Zero the gradients
             optimizer.zero_grad()
 
-            # Forward pass
-            outputs = net(images)
-
-            # Compute the loss
-            loss = criterion(outputs, labels)
+            # Forward pass and loss
+            with autocast(device, precision):
+                outputs = net(images)
+                loss = criterion(outputs, labels)
 
             # Backward pass
             loss.backward()
@@ -130,30 +177,31 @@ def train_fedavg(net, trainloader, epochs, device, deadline=None):
 
     # Return the trained model
     return net
-def train_feddyn(net, trainloader, epochs, device, deadline=None):
+def train_feddyn(net, prev_grads, trainloader, epochs, device, deadline=None, snapshot=None,
+                 precision="fp32"):
     """
     Trains a given neural network using the FedDyn algorithm.
     Args:
     net: A PyTorch neural network model
+    prev_grads: The flat FedDyn gradient correction of this client, from its previous rounds
     trainloader: A PyTorch DataLoader containing the training dataset
     epochs: An integer specifying the number of training epochs
     deadline: An optional deadline (in seconds) for the training process
+    snapshot: ParameterSnapshot the received and the trained model are kept in, reused from round to round
+    precision: "bf16" runs the forward passes under autocast to bfloat16
 
     Returns:
-    A trained PyTorch neural network model
+    A trained PyTorch neural network model and the updated gradient correction
     """
-    x = deepcopy(net)
-    prev_grads = None
-    if os.path.isfile("client_checkpoints/prev_grads.pt"):
-        prev_grads = torch.load("client_checkpoints/prev_grads.pt", map_location=device)
-    else:
-        for param in net.parameters():
-            if not isinstance(prev_grads, torch.Tensor):
-                prev_grads = torch.zeros_like(param.view(-1))
-                prev_grads.to(device)
-            else:
-                prev_grads = torch.cat((prev_grads, torch.zeros_like(param.view(-1))), dim=0)
-                prev_grads.to(device)
+    net.train()
+    #The parameters are trained as one flat vector for the whole round, the network computes with views of it
+    x = (snapshot or ParameterSnapshot()).capture(net)
+    received = x.vector
+    trained = x.hold("trained", net.parameters(), net, copy=True)
+    flat = x.flat["trained"].detach().requires_grad_(True)
+    names = x.names
+    shapes = [param.shape for param in trained]
+    numels = [param.numel() for param in trained]
 
     criterion = torch.nn.CrossEntropyLoss()
     lr = 0.001
@@ -161,31 +209,19 @@ def train_feddyn(net, trainloader, epochs, device, deadline=None):
     for _ in tqdm(range(epochs)):
         inputs,labels = next(iter(trainloader))
         inputs, labels = inputs.float().to(device), labels.long().to(device)
-        output = net(inputs)
-        loss = criterion(output, labels) #Calculate the loss with respect to y's output and labels
-
-        #Dynamic Regularisation
-        lin_penalty = 0.0
-        curr_params = None
-        for param in net.parameters():
-            if not isinstance(curr_params, torch.Tensor):
-                curr_params = param.view(-1)
-            else:
-                curr_params = torch.cat((curr_params, param.view(-1)), dim=0)
-
-        lin_penalty = torch.sum(curr_params * prev_grads)
-        loss -= lin_penalty
-
-        quad_penalty = 0.0
-        for y, z in zip(net.parameters(), x.parameters()):
-            quad_penalty += torch.nn.functional.mse_loss(y.data, z.data, reduction='sum')
-
-        loss += (alpha/2) * quad_penalty
+        views = {name: view.view(shape) for name, view, shape in zip(names, torch.split(flat, numels), shapes)}
+        with autocast(device, precision):
+            output = functional_call(net, views, (inputs,))
+            loss = criterion(output, labels) #Calculate the loss with respect to y's output and labels
 
-        gradients = torch.autograd.grad(loss,net.parameters())
+        #Dynamic Regularisation, the quadratic penalty is computed on the detached parameters and does not
+        #contribute to the gradient
+        loss -= torch.dot(flat, prev_grads)
+        loss += (alpha/2) * torch.sum(torch.square(flat.detach() - received))
 
-        for param, grad in zip(net.parameters(),gradients):
-            param.data -= lr * grad.data
+        gradient, = torch.autograd.grad(loss, flat)
+        with torch.no_grad():
+            flat -= lr * gradient
 
         if deadline:
             current_time = time.time()
@@ -193,20 +229,31 @@ def train_feddyn(net, trainloader, epochs, device, deadline=None):
                 print("deadline occurred.")
                 break
 
-    #Calculate the difference between updated model (y) and the received model (x)
-    delta = None
-    for y, z in zip(net.parameters(), x.parameters()):
-        if not isinstance(delta, torch.Tensor):
-            delta = torch.sub(y.data.view(-1), z.data.view(-1))
-        else:
-            delta = torch.cat((delta, torch.sub(y.data.view(-1), z.data.view(-1))),dim=0)
-
-    #Update prev_grads using delta which is scaled by alpha
-    prev_grads = torch.sub(prev_grads, delta, alpha = alpha)
-    torch.save(prev_grads, "client_checkpoints/prev_grads.pt")
-    return net
+    flat = flat.detach()
+    with torch.no_grad():
+        for param, tensor in zip(net.parameters(), trained):
+            param.copy_(tensor)
+
+    #Update prev_grads using the difference between the updated model and the received model, scaled by alpha
+    prev_grads = torch.sub(prev_grads, flat - received, alpha = alpha)
+    return net, prev_grads
+
+#gradient of the mean loss of net at snapshot x over the dataset of trainloader. it is accumulated over
+#batches of batch_size samples (those of trainloader by default) weighted by their size, so that only one
+#batch is in memory at a time
+def full_gradient(net, x, trainloader, criterion, device, batch_size = None, precision = "fp32"):
+    data = DataLoader(trainloader.dataset, batch_size = batch_size or trainloader.batch_size,
+                      collate_fn = trainloader.collate_fn)
+    gradient = [torch.zeros_like(param) for param in x.weights]
+    for images, labels in data:
+        images, labels = images.to(device), labels.to(device)
+        with autocast(device, precision):
+            grads = x.gradient(net, criterion, images, labels)
+        torch._foreach_add_(gradient, grads, alpha = len(labels) / len(trainloader.dataset))
+    return gradient
 
-def train_mimelite(net, state, trainloader, epochs, device, deadline=None):
+def train_mimelite(net, state, trainloader, epochs, device, deadline=None, gradient_batch_size=None,
+                   snapshot=None, precision="fp32"):
     """
     Trains a given neural network using the MimeLite algorithm.
 
@@ -215,30 +262,32 @@ def train_mimelite(net, state, trainloader, epochs, device, deadline=None):
     trainloader: A PyTorch DataLoader containing the training dataset
     epochs: An integer specifying the number of training epochs
     deadline: An optional deadline (in seconds) for the training process
+    gradient_batch_size: Batch size of the gradient over the whole dataset, that of trainloader by default
+    snapshot: ParameterSnapshot the received model and state are kept in, reused from round to round
+    precision: "bf16" runs the forward passes under autocast to bfloat16
 
     Returns:
     A trained PyTorch neural network model
 
     In the case of MimeLite, control_variate is nothing but a state like in case of momentum method
     """
-    x = deepcopy(net)
+    net.train()
+    x = (snapshot or ParameterSnapshot()).capture(net)
 
     criterion = torch.nn.CrossEntropyLoss()
-    lr = 0.001
-    momentum = 0.9
-    net.train()
+    optimizer = MimeSGD(net.parameters(), x.hold("state", state, net), lr=0.001, momentum=0.9)
 
     for _ in tqdm(range(epochs)):
         for images, labels in trainloader:
             images, labels = images.to(device), labels.to(device)
-            loss = criterion(net(images), labels)
+            optimizer.zero_grad()
+            with autocast(device, precision):
+                loss = criterion(net(images), labels)
 
             #Compute (full-batch) gradient of loss with respect to net's parameters
-            grads = torch.autograd.grad(loss,net.parameters())
-            #Update net's parameters using gradients
-            with torch.no_grad():
-                for param,grad,s in zip(net.parameters(), grads, state):
-                    param.data = param.data - lr * ((1-momentum) * grad.data + momentum * s.to(device).data)
+            loss.backward()
+            #Update net's parameters using gradients and the server state
+            optimizer.step()
 
         if deadline:
             current_time = time.time()
@@ -246,17 +295,13 @@ def train_mimelite(net, state, trainloader, epochs, device, deadline=None):
                 print("deadline occurred.")
                 break
 
-    #Compute gradient wrt the received model (x) using the wholde dataset
-    data = DataLoader(trainloader.dataset, batch_size = len(trainloader) * trainloader.batch_size, shuffle = True)
-    for images, labels in data:
-        images, labels = images.to(device), labels.to(device)
-        output = x(images)
-        loss = criterion(output, labels) #Calculate the loss with respect to y's output and labels
-        gradient_x = torch.autograd.grad(loss,x.parameters())
+    #Compute gradient wrt the received model (x) using the whole dataset
+    gradient_x = full_gradient(net, x, trainloader, criterion, device, gradient_batch_size, precision)
 
     return net, gradient_x
 
-def train_mime(net, state, control_variate, trainloader, epochs, device, deadline=None):
+def train_mime(net, state, control_variate, trainloader, epochs, device, deadline=None, snapshot=None,
+               precision="fp32"):
     """
     Trains a given neural network using the Mime algorithm.
 
@@ -265,38 +310,37 @@ def train_mime(net, state, control_variate, trainloader, epochs, device, deadlin
     trainloader: A PyTorch DataLoader containing the training dataset
     epochs: An integer specifying the number of training epochs
     deadline: An optional deadline (in seconds) for the training process
+    snapshot: ParameterSnapshot the received model, state and control variate are kept in, reused from
+              round to round
+    precision: "bf16" runs the forward passes under autocast to bfloat16
 
     Returns:
     A trained PyTorch neural network model
     """
-    x = deepcopy(net)
+    net.train()
+    x = (snapshot or ParameterSnapshot()).capture(net)
 
     criterion = torch.nn.CrossEntropyLoss()
-    lr = 0.001
-    momentum = 0.9
-    net.train()
-    x.train()
-    #control_variate = control_variate.to(DEVICE)
+    optimizer = MimeSGD(net.parameters(), x.hold("state", state, net), lr=0.001, momentum=0.9,
+                        control_variate=x.hold("control_variate", control_variate, net))
+    gradient_x = [torch.zeros_like(param) for param in x.weights]
     for epoch in tqdm(range(epochs)):
         for images, labels in trainloader:
             images, labels = images.to(device), labels.to(device)
-            loss = criterion(net(images), labels)
+            optimizer.zero_grad()
+            with autocast(device, precision):
+                loss = criterion(net(images), labels)
 
             #Compute (full-batch) gradient of loss with respect to net's parameters
-            grads_y = torch.autograd.grad(loss,net.parameters())
+            loss.backward()
 
             if epoch == 0:
-                output = x(images)
-                loss = criterion(output, labels)
-                grads_x = torch.autograd.grad(loss,x.parameters())
-
-            #Update net's parameters using gradients
-            with torch.no_grad():
-                for g_y, g_x, c in zip(grads_y, grads_x, control_variate):
-                    g_y.data -= g_x.data + c.to(device)
+                with autocast(device, precision):
+                    grads_x = x.gradient(net, criterion, images, labels)
+                torch._foreach_add_(gradient_x, grads_x, alpha = len(labels) / len(trainloader.dataset))
 
-                for param,grad,s in zip(net.parameters(), grads_y, state):
-                    param.data = param.data - lr * ((1-momentum) * grad.data + momentum * s.to(device).data)
+            #Update net's parameters using the corrected gradients and the server state
+            optimizer.step(grads_x)
 
         if deadline:
             current_time = time.time()
@@ -304,17 +348,12 @@ def train_mime(net, state, control_variate, trainloader, epochs, device, deadlin
                 print("deadline occurred.")
                 break
 
-    #Compute gradient wrt the received model (x) using the wholde dataset
-    data = DataLoader(trainloader.dataset, batch_size = len(trainloader) * trainloader.batch_size, shuffle = True)
-    for images, labels in data:
-        images, labels = images.to(device), labels.to(device)
-        output = x(images)
-        loss = criterion(output, labels) #Calculate the loss with respect to y's output and labels
-        gradient_x = torch.autograd.grad(loss,x.parameters())
-
+    #The gradient wrt the received model (x) using the whole dataset is the average of the gradients of the
+    #first epoch, weighted by batch size
     return net, gradient_x
 
-def train_scaffold(net, server_c, trainloader, epochs, device, deadline=None):
+def train_scaffold(net, server_c, trainloader, epochs, device, deadline=None, snapshot=None,
+                   precision="fp32"):
     """
     Trains a given neural network using the Scaffold algorithm.
 
@@ -323,29 +362,34 @@ def train_scaffold(net, server_c, trainloader, epochs, device, deadline=None):
     trainloader: A PyTorch DataLoader containing the training dataset
     epochs: An integer specifying the number of training epochs
     deadline: An optional deadline (in seconds) for the training process
+    snapshot: ParameterSnapshot the received model and control variate are kept in, reused from round to round
+    precision: "bf16" runs the forward passes under autocast to bfloat16
 
     Returns:
     A trained PyTorch neural network model
 
     """
-    x = deepcopy(net)
-    client_c = deepcopy(server_c)
+    net.train()
+    x = (snapshot or ParameterSnapshot()).capture(net)
+    server_c = x.hold("server_c", server_c, net)
+    #the client control variate starts from the server one, neither is modified during the round
+    client_c = server_c
     criterion = torch.nn.CrossEntropyLoss()
     lr = 0.001
+    optimizer = ScaffoldSGD(net.parameters(), server_c, client_c, lr)
 
     for _ in tqdm(range(epochs)):
         for images, labels in trainloader:
             images, labels = images.to(device), labels.to(device)
-            loss = criterion(net(images), labels)
+            optimizer.zero_grad()
+            with autocast(device, precision):
+                loss = criterion(net(images), labels)
 
             #Compute (full-batch) gradient of loss with respect to net's parameters
-            grads = torch.autograd.grad(loss,net.parameters())
+            loss.backward()
 
             #Update y's parameters using gradients, client_c and server_c [Algorithm line no:10]
-
-            for param,grad,s_c,c_c in zip(net.parameters(),grads,server_c,client_c):
-                s_c, c_c = s_c.to(device), c_c.to(device)
-                param.data = param.data - lr * (grad.data + (s_c.data - c_c.data))
+            optimizer.step()
 
         if deadline:
             current_time = time.time()
@@ -353,34 +397,26 @@ def train_scaffold(net, server_c, trainloader, epochs, device, deadline=None):
                 print("deadline occurred.")
                 break
 
-    delta_c = [torch.zeros_like(param) for param in net.parameters()]
-    new_client_c = deepcopy(delta_c)
-
-    for param_net, param_x in zip(net.parameters(), x.parameters()):
-        param_net.data = param_net.data - param_x.data
+    x.subtract_from(net)
 
+    #new_client_c = client_c - server_c - (y - x) / a
     a = (ceil(len(trainloader.dataset) / trainloader.batch_size) * epochs * lr)
-    for n_c, c_l, c_g, diff in zip(new_client_c, client_c, server_c, net.parameters()):
-        c_l = c_l.to(device)
-        c_g = c_g.to(device)
-        n_c.data += c_l.data - c_g.data - diff.data / a
+    new_client_c = torch._foreach_sub(client_c, server_c)
+    torch._foreach_sub_(new_client_c, torch._foreach_div(list(net.parameters()), a))
 
     #Calculate delta_c which equals to new_client_c-client_c
-    for d_c, n_c_l, c_l in zip(delta_c, new_client_c, client_c):
-        d_c = d_c.to(device)
-        c_l = c_l.to(device)
-        d_c.data.add_(n_c_l.data - c_l.data)
-
+    delta_c = torch._foreach_sub(new_client_c, client_c)
 
     return net, delta_c
 
 
-def test_model(net, testloader, device):
+def test_model(net, testloader, device, precision="fp32"):
     """Evaluate the performance of a model on a test dataset.
 
     Args:
     net (torch.nn.Module): The neural network model to evaluate.
     testloader (torch.utils.data.DataLoader): The data loader for the test dataset.
+    precision (str): "bf16" runs the network under autocast to bfloat16.
 
     Returns:
     Tuple: The average loss and accuracy of the model on the test dataset.
@@ -388,11 +424,12 @@ def test_model(net, testloader, device):
     criterion = torch.nn.CrossEntropyLoss()
     net.eval()
     test_loss, correct, total = 0.0, 0, 0
-    with torch.no_grad():
+    with torch.inference_mode():
         for images, labels in tqdm(testloader):
             images, labels = images.to(device), labels.to(device)
-            outputs = net(images)
-            test_loss += criterion(outputs, labels).item()
+            with autocast(device, precision):
+                outputs = net(images)
+                test_loss += criterion(outputs, labels).item()
             _, predicted = torch.max(outputs.data, 1)
             total += labels.size(0)
             correct += (predicted == labels).sum().item()
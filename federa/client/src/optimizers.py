@@ -0,0 +1,52 @@
+import torch
+from torch.optim import Optimizer
+
+#Optimizers of the client trainers of Mime, MimeLite and Scaffold.
+#
+#The tensors a round receives from the server (momentum state, control variates) are moved to the device
+#once, when the optimizer is built, and every step updates all the parameters with a few multi-tensor
+#torch._foreach_* calls instead of a Python loop over them. The updates are computed in the same order as
+#the per-tensor loops they replace, so they give the same parameters.
+
+def _on_device(tensors, params):
+    return [tensor.to(param.device) for tensor, param in zip(tensors, params)]
+
+#SGD step with the momentum of a fixed server state s: p -= lr * ((1 - momentum) * g + momentum * s).
+#Mime also corrects the gradients with those of the received model and the server control variate:
+#g -= grads_x + control_variate
+class MimeSGD(Optimizer):
+    def __init__(self, params, server_state, lr, momentum, control_variate = None):
+        super().__init__(params, {"lr": lr, "momentum": momentum})
+        params = self.param_groups[0]["params"]
+        #the momentum term is the same in every step of a round
+        self.momentum_term = torch._foreach_mul(_on_device(server_state, params), momentum)
+        self.control_variate = None if control_variate is None else _on_device(control_variate, params)
+
+    #grads_x are the gradients of the received model on the same batch, Mime only
+    @torch.no_grad()
+    def step(self, grads_x = None):
+        group = self.param_groups[0]
+        params = group["params"]
+        grads = [param.grad for param in params]
+        if self.control_variate is not None:
+            torch._foreach_sub_(grads, torch._foreach_add(grads_x, self.control_variate))
+        update = torch._foreach_mul(grads, 1 - group["momentum"])
+        torch._foreach_add_(update, self.momentum_term)
+        torch._foreach_mul_(update, group["lr"])
+        torch._foreach_sub_(params, update)
+
+#SGD step corrected by the control variates: p -= lr * (g + (server_c - client_c))
+class ScaffoldSGD(Optimizer):
+    def __init__(self, params, server_c, client_c, lr):
+        super().__init__(params, {"lr": lr})
+        params = self.param_groups[0]["params"]
+        #the correction is the same in every step of a round
+        self.correction = torch._foreach_sub(_on_device(server_c, params), _on_device(client_c, params))
+
+    @torch.no_grad()
+    def step(self):
+        group = self.param_groups[0]
+        params = group["params"]
+        update = torch._foreach_add([param.grad for param in params], self.correction)
+        torch._foreach_mul_(update, group["lr"])
+        torch._foreach_sub_(params, update)
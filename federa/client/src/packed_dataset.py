@@ -0,0 +1,148 @@
+import os
+import shutil
+import threading
+from queue import Queue, Empty, Full
+import numpy as np
+from torch.utils.data import DataLoader
+
+#Packed copies of CUSTOM datasets (directories of one .npy file per sample).
+#
+#The first time a directory is used its samples are packed into a few large shard files, the raw bytes of
+#the arrays one after the other, with an index of the shard, byte offset, shape, dtype and label of every
+#sample. Later uses memory-map the shards and read a sample as a view of them, instead of listing the
+#directory and opening one file per sample. The packed copy sits next to the directory, in <root>.packed,
+#and is built in a temporary directory renamed into place so that concurrent clients never see a partial one.
+#Delete it to repack after the directory changes.
+#This module is kept identical on the client and on the server.
+
+SHARD_SIZE = 256 * 2**20
+
+def packed_root(root):
+    return os.path.normpath(root) + ".packed"
+
+#samples is a list of (path of a .npy file, label)
+def pack_samples(samples, destination, shard_size = SHARD_SIZE):
+    temporary = f"{destination}.{os.getpid()}.tmp"
+    os.makedirs(temporary, exist_ok=True)
+    shards, offsets, shapes, dtypes, labels = [], [], [], [], []
+    shard, shard_file, shard_bytes = -1, None, 0
+    for path, label in samples:
+        array = np.ascontiguousarray(np.load(path))
+        #a new shard is started when the current one would grow past shard_size
+        if shard_file is None or (shard_bytes and shard_bytes + array.nbytes > shard_size):
+            if shard_file is not None:
+                shard_file.close()
+            shard += 1
+            shard_file = open(os.path.join(temporary, f"shard_{shard}.bin"), "wb")
+            shard_bytes = 0
+        shards.append(shard)
+        offsets.append(shard_bytes)
+        shapes.append(array.shape)
+        dtypes.append(array.dtype.str)
+        labels.append(label)
+        shard_file.write(array.tobytes())
+        shard_bytes += array.nbytes
+    if shard_file is not None:
+        shard_file.close()
+    #shapes may differ in length, they are padded with -1
+    max_dims = max((len(shape) for shape in shapes), default=0)
+    padded_shapes = np.full((len(shapes), max_dims), -1, dtype=np.int64)
+    for index, shape in enumerate(shapes):
+        padded_shapes[index, :len(shape)] = shape
+    np.savez(os.path.join(temporary, "index.npz"), shards=np.array(shards, dtype=np.int64),
+             offsets=np.array(offsets, dtype=np.int64), shapes=padded_shapes, dtypes=np.array(dtypes),
+             labels=np.array(labels, dtype=np.int64))
+    try:
+        os.rename(temporary, destination)
+    except OSError:
+        #another process packed the same directory first
+        shutil.rmtree(temporary, ignore_errors=True)
+
+class PackedShards:
+    def __init__(self, root):
+        self.root = root
+        index = np.load(os.path.join(root, "index.npz"))
+        self.shard_ids, self.offsets, self.shapes = index["shards"], index["offsets"], index["shapes"]
+        self.dtypes = [np.dtype(dtype) for dtype in index["dtypes"]]
+        self.labels = index["labels"]
+        self.shards = [np.memmap(os.path.join(root, f"shard_{shard}.bin"), dtype=np.uint8, mode='r')
+                       for shard in np.unique(self.shard_ids)]
+        #shape and dtype of the samples when they all share them, else None
+        shapes = np.unique(self.shapes, axis=0)
+        self.shape = tuple(int(dim) for dim in shapes[0] if dim >= 0) if len(shapes) == 1 else None
+        self.dtype = self.dtypes[0] if len(set(self.dtypes)) == 1 else None
+
+    #DataLoader worker processes map the shards again instead of receiving a copy of them
+    def __getstate__(self):
+        return self.root
+
+    def __setstate__(self, root):
+        self.__init__(root)
+
+    def __len__(self):
+        return len(self.labels)
+
+    #array of a sample, a view of its memory-mapped shard
+    def array(self, index):
+        shape = tuple(int(dim) for dim in self.shapes[index] if dim >= 0)
+        dtype = self.dtypes[index]
+        start = self.offsets[index]
+        data = self.shards[self.shard_ids[index]][start:start + int(np.prod(shape)) * dtype.itemsize]
+        return data.view(dtype).reshape(shape)
+
+    #the samples at indices stacked in one array, they must share their shape and dtype
+    def stack(self, indices):
+        return np.stack([self.array(index) for index in indices])
+
+#the packed copy of a CUSTOM directory, packed first if needed. label_samples(root) lists (path, label)
+def open_packed(root, label_samples):
+    destination = packed_root(root)
+    if not os.path.exists(os.path.join(destination, "index.npz")):
+        pack_samples(label_samples(root), destination)
+    return PackedShards(destination)
+
+
+#DataLoader that loads the next batch in a background thread while the current one is being used
+class PrefetchDataLoader(DataLoader):
+    def __iter__(self):
+        batches = Queue(maxsize=1)
+        done = object()
+        #set once the consumer stops iterating, whether or not it reached the end of the loader
+        stop = threading.Event()
+
+        #waits for room in the queue until the consumer is gone, returns whether item was queued
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        #the thread ends when the consumer stops early, releasing the loader iterator and its workers
+        def load(iterator):
+            try:
+                for batch in iterator:
+                    if not put(batch):
+                        return
+            except Exception as error:
+                put(error)
+            put(done)
+
+        threading.Thread(target=load, args=(super().__iter__(),), daemon=True).start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is done:
+                    return
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            #also run when the generator is closed or collected before its end
+            stop.set()
+            try:
+                batches.get_nowait()
+            except Empty:
+                pass
@@ -0,0 +1,93 @@
+import numpy as np
+
+#Vectorized partitioning schemes, meant for splitting a dataset among thousands of simulated clients.
+#
+#Every scheme takes the labels of the dataset (a NumPy array), the number of users and a NumPy Generator,
+#and returns the split in CSR form (offsets, indices): the samples of user i are indices[offsets[i]:offsets[i+1]].
+#Sample counts are rounded with the largest remainder method, so they always add up to the number of
+#samples without any correction loop.
+#   dirichlet: the samples of every class are split among the users in Dirichlet(alpha) proportions
+#   shards:    the samples are sorted by class and cut in num_users * shards_per_user shards, every user
+#              gets shards_per_user of them at random
+#   classes:   every user holds classes_per_user classes, and the samples of a class are split evenly among
+#              the users holding it
+
+#integer counts proportional to weights along the last axis, adding up to totals.
+#rows whose weights are all zero are split evenly
+def largest_remainder(weights, totals):
+    weights = np.asarray(weights, dtype=np.float64)
+    totals = np.asarray(totals, dtype=np.int64)
+    row_sums = weights.sum(axis=-1, keepdims=True)
+    weights = np.where(row_sums > 0, weights, 1.0)
+    quotas = weights / weights.sum(axis=-1, keepdims=True) * totals[..., None]
+    counts = np.floor(quotas).astype(np.int64)
+    missing = totals - counts.sum(axis=-1)
+    #rank of every entry by its remainder, the `missing` largest ones get one more sample
+    rank = np.argsort(np.argsort(counts - quotas, axis=-1, kind='stable'), axis=-1, kind='stable')
+    return counts + (rank < missing[..., None])
+
+#indices of the samples grouped by class, in random order within every class
+def _class_order(labels, rng):
+    shuffled = rng.permutation(len(labels))
+    return shuffled[np.argsort(labels[shuffled], kind='stable')]
+
+#concatenation of order[starts[i]:starts[i]+lengths[i]] for all i, without a Python loop
+def _gather(order, starts, lengths):
+    ends = np.cumsum(lengths)
+    positions = np.arange(ends[-1] if len(ends) else 0) + np.repeat(starts - (ends - lengths), lengths)
+    return order[positions]
+
+#CSR split from a (classes, users) matrix of sample counts, each class block of order is cut in user order
+def _split_classes(order, class_counts, counts):
+    class_starts = np.cumsum(class_counts) - class_counts
+    starts = class_starts[:, None] + np.cumsum(counts, axis=1) - counts
+    indices = _gather(order, starts.T.ravel(), counts.T.ravel())
+    offsets = np.concatenate([[0], np.cumsum(counts.sum(axis=0))])
+    return offsets, indices
+
+def dirichlet(labels, num_users, alpha, rng):
+    _, class_counts = np.unique(labels, return_counts=True)
+    proportions = rng.dirichlet(np.full(num_users, alpha), size=len(class_counts))
+    return _split_classes(_class_order(labels, rng), class_counts, largest_remainder(proportions, class_counts))
+
+def shards(labels, num_users, shards_per_user, rng):
+    num_shards = num_users * shards_per_user
+    shard_sizes = largest_remainder(np.ones(num_shards), len(labels))
+    shard_starts = np.cumsum(shard_sizes) - shard_sizes
+    #shards are dealt at random, user i gets shards dealt[i * shards_per_user:(i + 1) * shards_per_user]
+    dealt = rng.permutation(num_shards)
+    indices = _gather(_class_order(labels, rng), shard_starts[dealt], shard_sizes[dealt])
+    user_sizes = shard_sizes[dealt].reshape(num_users, shards_per_user).sum(axis=1)
+    return np.concatenate([[0], np.cumsum(user_sizes)]), indices
+
+def classes(labels, num_users, classes_per_user, rng):
+    _, class_counts = np.unique(labels, return_counts=True)
+    num_classes = len(class_counts)
+    classes_per_user = min(classes_per_user, num_classes)
+    #consecutive users take consecutive classes, so every class is held by about as many users
+    held = (np.arange(num_users)[:, None] * classes_per_user + np.arange(classes_per_user)) % num_classes
+    held = rng.permutation(num_classes)[held]
+    membership = np.zeros((num_classes, num_users))
+    membership[held, np.arange(num_users)[:, None]] = 1
+    #a class held by no user (fewer users than classes) is left out
+    totals = np.where(membership.any(axis=1), class_counts, 0)
+    return _split_classes(_class_order(labels, rng), class_counts, largest_remainder(membership, totals))
+
+#(num_users, num_classes) number of samples of each class held by each user
+def histograms(labels, offsets, indices):
+    _, class_ids = np.unique(labels, return_inverse=True)
+    num_users, num_classes = len(offsets) - 1, class_ids.max() + 1
+    user_ids = np.repeat(np.arange(num_users), np.diff(offsets))
+    return np.bincount(user_ids * num_classes + class_ids[indices],
+                       minlength=num_users * num_classes).reshape(num_users, num_classes)
+
+#splits labels among num_users with the scheme named in config['partition']
+def partition(config, labels, num_users, rng):
+    scheme = config['partition']
+    if scheme == 'dirichlet':
+        return dirichlet(labels, num_users, config.get('dirichlet_alpha', 0.5), rng)
+    if scheme == 'shards':
+        return shards(labels, num_users, config.get('shards_per_user', 2), rng)
+    if scheme == 'classes':
+        return classes(labels, num_users, config.get('classes_per_user', 2), rng)
+    raise ValueError(f"Unsupported partition scheme: {scheme}")
@@ -0,0 +1,74 @@
+import torch
+from torch.func import functional_call
+
+#The point a client trainer starts a round from.
+#
+#The parameters of the network are copied into one flat buffer, and the control variates of the round that
+#are not on the device of the network yet into others. The buffers are allocated once and reused in every
+#round, until the network changes. The network at the snapshot is evaluated with torch.func.functional_call
+#on the trained module itself instead of on a second instance of it. It runs in the train/eval mode the module
+#had when the snapshot was taken, with its own copy of the module buffers (batch norm statistics), as a deepcopy
+#of the module would.
+
+class ParameterSnapshot:
+    def __init__(self):
+        #flat buffer, its tensors as views and their shapes, by name
+        self.flat, self.tensors, self.shapes = {}, {}, {}
+
+    #copies tensors shaped like the parameters of net into the flat buffer called key and returns its views.
+    #with copy=False tensors already on the device of net are returned as they are
+    def hold(self, key, tensors, net, copy = False):
+        params = list(net.parameters())
+        tensors = list(tensors)
+        if not copy and all(tensor.device == params[0].device and tensor.dtype == params[0].dtype
+                            for tensor in tensors):
+            return tensors
+        shapes = [param.shape for param in params]
+        flat = self.flat.get(key)
+        if flat is None or self.shapes[key] != shapes or flat.device != params[0].device \
+                or flat.dtype != params[0].dtype:
+            flat = self.flat[key] = torch.empty(sum(param.numel() for param in params), dtype=params[0].dtype,
+                                                device=params[0].device)
+            self.tensors[key] = self._views(flat, shapes)
+            self.shapes[key] = shapes
+        with torch.no_grad():
+            for view, tensor in zip(self.tensors[key], tensors):
+                view.copy_(tensor)
+        return self.tensors[key]
+
+    @staticmethod
+    def _views(flat, shapes):
+        views = torch.split(flat, [shape.numel() for shape in shapes])
+        return [view.view(shape) for view, shape in zip(views, shapes)]
+
+    #takes the current parameters, buffers and mode of net as the starting point
+    def capture(self, net):
+        self.names = [name for name, _ in net.named_parameters()]
+        self.weights = self.hold("weights", net.parameters(), net, copy=True)
+        self.vector = self.flat["weights"]
+        self.buffers = {name: buffer.clone() for name, buffer in net.named_buffers()}
+        self.training = net.training
+        return self
+
+    #output of net at the snapshot, weights are its parameters (those of the snapshot by default)
+    def forward(self, net, inputs, weights = None):
+        training = net.training
+        if training != self.training:
+            net.train(self.training)
+        try:
+            parameters = dict(zip(self.names, self.weights if weights is None else weights))
+            return functional_call(net, (parameters, self.buffers), (inputs,))
+        finally:
+            if training != self.training:
+                net.train(training)
+
+    #gradient of criterion(net(images), labels) at the snapshot, one tensor per parameter
+    def gradient(self, net, criterion, images, labels):
+        weights = [weight.detach().requires_grad_(True) for weight in self.weights]
+        loss = criterion(self.forward(net, images, weights), labels)
+        return list(torch.autograd.grad(loss, weights))
+
+    #turns the parameters of net into their difference with the snapshot
+    def subtract_from(self, net):
+        with torch.no_grad():
+            torch._foreach_sub_(list(net.parameters()), self.weights)
@@ -4,11 +4,15 @@ import argparse
 parser = argparse.ArgumentParser()
 parser.add_argument("--ip", type=str, default = "localhost:8214", help="IP address of the server")
 parser.add_argument("--device", type=str, default = "cpu", help="Device to run the client on")
+parser.add_argument("--client_id", type=int, default = 0,
+                    help="Share of the partitioned dataset the client trains on, from 0 to num_users - 1. "
+                         "With feddyn it must be unique, its gradient correction is kept per client_id")
 args = parser.parse_args()
 
 configs = {
     "ip_address": args.ip,
-    "device": args.device
+    "device": args.device,
+    "client_id": args.client_id
 }
 
 if __name__ == '__main__':
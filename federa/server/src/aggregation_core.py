@@ -0,0 +1,140 @@
+from collections import OrderedDict
+import torch
+
+from .quantization import is_quantized, dequantize
+from .sparsification import is_sparse
+
+#client uploads may be quantized or sparse, see quantization.py and sparsification.py
+def is_compressed(tensor):
+    return is_quantized(tensor) or is_sparse(tensor)
+
+#key/shape/offset table used to pack a state dict (or a list of tensors) into one flat float32 vector,
+#so that averaging and the server optimizer steps run as a few large kernels instead of one op per key
+class FlatLayout:
+    def __init__(self, keys, tensors):
+        self.keys = list(keys)
+        self.shapes, self.dtypes, self.offsets = [], [], []
+        offset = 0
+        for tensor in tensors:
+            self.shapes.append(tensor.shape)
+            self.dtypes.append(tensor.dtype)
+            self.offsets.append(offset)
+            offset += tensor.numel()
+        self.numel = offset
+
+    @classmethod
+    def from_state_dict(cls, state_dict):
+        return cls(state_dict.keys(), state_dict.values())
+
+    #control variates and gradients travel as plain lists of tensors, they are keyed by position
+    @classmethod
+    def from_list(cls, tensors):
+        return cls(range(len(tensors)), tensors)
+
+    def zeros(self):
+        return torch.zeros(self.numel, dtype=torch.float32)
+
+    #packs the tensors into one contiguous vector, reusing out when it is given.
+    #quantized uploads are dequantized straight into their place, sparse ones are left at zero for
+    #FlatAccumulator to scatter their values. when base (a flat vector of this layout) is given they are
+    #updates relative to it
+    def flatten(self, tensors, out=None, base=None):
+        if isinstance(tensors, dict):
+            tensors = [tensors[key] for key in self.keys]
+        if out is None:
+            out = torch.empty(self.numel, dtype=torch.float32)
+        if not any(is_compressed(tensor) for tensor in tensors):
+            torch.cat([tensor.detach().reshape(-1).to(device="cpu", dtype=torch.float32) for tensor in tensors], out=out)
+            return out
+        for tensor, offset, shape in zip(tensors, self.offsets, self.shapes):
+            section = out[offset:offset + shape.numel()]
+            if is_quantized(tensor):
+                dequantize(tensor, out=section)
+            elif is_sparse(tensor):
+                section.zero_()
+            else:
+                section.copy_(tensor.detach().reshape(-1))
+                continue
+            if base is not None:
+                section.add_(base[offset:offset + shape.numel()])
+        return out
+
+    #splits a flat vector back into tensors of the original shapes and dtypes.
+    #float32 entries are views into flat, so flat must not be modified afterwards
+    def unflatten(self, flat):
+        tensors = []
+        for offset, shape, dtype in zip(self.offsets, self.shapes, self.dtypes):
+            tensor = flat[offset:offset + shape.numel()].view(shape)
+            if dtype != flat.dtype:
+                tensor = tensor.to(dtype)
+            tensors.append(tensor)
+        return tensors
+
+    def to_state_dict(self, flat):
+        return OrderedDict(zip(self.keys, self.unflatten(flat)))
+
+
+#running sum of flat client updates, the packed update is written into a reused scratch vector
+#so memory stays constant no matter how many clients are folded in
+class FlatAccumulator:
+    def __init__(self, layout):
+        self.layout = layout
+        self.total = layout.zeros()
+        self.scratch = torch.empty_like(self.total)
+        self.count = 0
+
+    def add(self, tensors, base=None):
+        if isinstance(tensors, dict):
+            tensors = [tensors[key] for key in self.layout.keys]
+        self.total.add_(self.layout.flatten(tensors, out=self.scratch, base=base))
+        #sparse uploads are scattered into the sum as they are, without densifying them
+        for tensor, offset, shape in zip(tensors, self.layout.offsets, self.layout.shapes):
+            if is_sparse(tensor):
+                self.total[offset:offset + shape.numel()].index_add_(0, tensor["indices"], tensor["values"])
+        self.count += 1
+
+    def mean(self):
+        return self.total / self.count
+
+
+#base class of the aggregation algorithms. A round is driven as
+#   begin_round(server_state_dict, control_variate, control_variate2)
+#   accumulate((trained_state_dict, updated_control_variate))   once per client, as soon as it replies
+#   finalize() -> (server_state_dict, control_variate, control_variate2)
+#so each update is folded into running sums and can be dropped right away.
+#updates may be compressed (quantized or sparse), they are decompressed as they are folded in
+class FlatAggregator:
+    #True for the algorithms whose clients upload the difference between their trained model and the global
+    #model rather than the trained model. compressed uploads are then restored without adding the global model
+    uploads_deltas = False
+
+    def begin_round(self, server_state_dict, control_variate=None, control_variate2=None):
+        self.server_state_dict = server_state_dict
+        self.control_variate = control_variate
+        self.control_variate2 = control_variate2
+        self.layout = FlatLayout.from_state_dict(server_state_dict)
+        self.model_sum = FlatAccumulator(self.layout)
+        self.control_variate_sum = None
+        #flat server model, compressed models are uploaded as updates relative to it
+        self.update_base = None
+
+    def accumulate(self, update):
+        state_dict, control_variate = update
+        if self.update_base is None and not self.uploads_deltas and \
+                any(is_compressed(tensor) for tensor in state_dict.values()):
+            self.update_base = self.layout.flatten(self.server_state_dict)
+        self.model_sum.add(state_dict, base=self.update_base)
+        #updated_control_variate is None when the algorithm does not use one
+        if control_variate is not None:
+            if self.control_variate_sum is None:
+                #uploads may be compressed, the layout is taken from the server's control variate when there is one
+                reference = self.control_variate if self.control_variate is not None else control_variate
+                self.control_variate_sum = FlatAccumulator(FlatLayout.from_list(reference))
+            self.control_variate_sum.add(control_variate)
+
+    #number of client updates accumulated in the current round
+    def num_updates(self):
+        return self.model_sum.count
+
+    def finalize(self):
+        raise NotImplementedError
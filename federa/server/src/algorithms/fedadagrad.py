@@ -1,9 +1,8 @@
-import functools
-from collections import OrderedDict
-import torch
+from ..aggregation_core import FlatAggregator
 
 #averages all of the given state dicts
-class fedadagrad():
+class fedadagrad(FlatAggregator):
+    uploads_deltas = True
 
     def __init__(self, config):
         self.algorithm = "FedAdagrad"
@@ -11,25 +10,18 @@ class fedadagrad():
         self.epsilon = 1e-6
         self.state = None
 
-    def aggregate(self,server_state_dict,state_dicts):
-
-        keys = server_state_dict.keys() #List of keys in a state_dict
+    def finalize(self):
 
         #Averages the differences that we got by subtracting the server_model from client_model (delta_y)
-        avg_delta_y = OrderedDict()
-        for key in keys:
-            current_key_tensors = [state_dict[key] for state_dict in state_dicts]
-            current_key_sum = functools.reduce( lambda accumulator, tensor: accumulator + tensor, current_key_tensors )
-            current_key_average = current_key_sum / len(state_dicts)
-            avg_delta_y[key] = current_key_average
+        avg_delta_y = self.model_sum.mean()
 
-        if not self.state: #If state = None, then the following line will execute.
+        if self.state is None: #If state = None, then the following line will execute.
             #So only at first round, it'll execute
-            self.state = [torch.zeros_like(server_state_dict[key]) for key in server_state_dict.keys()]
+            self.state = self.layout.zeros()
 
         #Updates the server_state_dict
-        for key, state in zip(keys, self.state):
-            state.data += torch.square(avg_delta_y[key])
-            server_state_dict[key] += self.lr * avg_delta_y[key] / torch.sqrt(state.data + self.epsilon)
+        self.state.addcmul_(avg_delta_y, avg_delta_y)
+        server_flat = self.layout.flatten(self.server_state_dict)
+        server_flat.addcdiv_(avg_delta_y, (self.state + self.epsilon).sqrt_(), value=self.lr)
 
-        return server_state_dict
+        return self.layout.to_state_dict(server_flat), None, None
@@ -1,9 +1,8 @@
-import functools
-from collections import OrderedDict
-import torch
+from ..aggregation_core import FlatAggregator
 
 #averages all of the given state dicts
-class fedadam():
+class fedadam(FlatAggregator):
+    uploads_deltas = True
 
     def __init__(self, config):
         self.algorithm = "FedAdam"
@@ -16,31 +15,23 @@ class fedadam():
         self.m = None #1st moment vectpr
         self.v = None #2nd moment vector
 
-    def aggregate(self,server_state_dict,state_dicts):
-
-        keys = server_state_dict.keys() #List of keys in a state_dict
+    def finalize(self):
 
         #Averages the differences that we got by subtracting the server_model from client_model (delta_y)
-        avg_delta_y = OrderedDict()
-        for key in keys:
-            current_key_tensors = [state_dict[key] for state_dict in state_dicts]
-            current_key_sum = functools.reduce( lambda accumulator, tensor: accumulator + tensor, current_key_tensors )
-            current_key_average = current_key_sum / len(state_dicts)
-            avg_delta_y[key] = current_key_average
+        avg_delta_y = self.model_sum.mean()
 
-        if not self.m: #If self.m = None, then the following line will execute. So only at first round, it'll execute
-            self.m = [torch.zeros_like(server_state_dict[key]) for key in server_state_dict.keys()]
-            self.v = [torch.zeros_like(server_state_dict[key]) for key in server_state_dict.keys()]
+        if self.m is None: #If self.m = None, then the following line will execute. So only at first round, it'll execute
+            self.m = self.layout.zeros()
+            self.v = self.layout.zeros()
 
         #Updates the server_state_dict
-        for key, m, v in zip(keys, self.m, self.v):
-            m.data = self.beta1 * m.data + (1 - self.beta1) * avg_delta_y[key].data
-            v.data = self.beta2 * v.data + (1 - self.beta2) * torch.square(avg_delta_y[key].data)
-            m_bias_corr = m / (1 - self.beta1**self.timestep)
-            v_bias_corr = v / (1 - self.beta2**self.timestep)
-            server_state_dict[key].data += self.lr * m_bias_corr / (torch.sqrt(v_bias_corr) + self.epsilon)
-
+        self.m.mul_(self.beta1).add_(avg_delta_y, alpha=1 - self.beta1)
+        self.v.mul_(self.beta2).addcmul_(avg_delta_y, avg_delta_y, value=1 - self.beta2)
+        m_bias_corr = self.m / (1 - self.beta1**self.timestep)
+        v_bias_corr = self.v / (1 - self.beta2**self.timestep)
+        server_flat = self.layout.flatten(self.server_state_dict)
+        server_flat.addcdiv_(m_bias_corr, v_bias_corr.sqrt_().add_(self.epsilon), value=self.lr)
 
         self.timestep += 1 #After each aggregation, timestep will increment by 1
 
-        return server_state_dict
+        return self.layout.to_state_dict(server_flat), None, None
@@ -1,8 +1,8 @@
-import functools
-from collections import OrderedDict
+from ..aggregation_core import FlatAggregator
 
 #averages all of the given state dicts
-class fedavgm():
+class fedavgm(FlatAggregator):
+    uploads_deltas = True
 
     def __init__(self, config):
         self.algorithm = "FedAvgM"
@@ -10,31 +10,21 @@ class fedavgm():
         self.lr = 1
         self.velocity = None
 
-    def aggregate(self,server_state_dict,state_dicts):
-
-        keys = server_state_dict.keys() #List of keys in a state_dict
+    def finalize(self):
 
         #Averages the differences that we got by subtracting the server_model from client_model (delta_y)
-        avg_delta_y = OrderedDict()
-        for key in keys:
-            current_key_tensors = [state_dict[key] for state_dict in state_dicts]
-            current_key_sum = functools.reduce( lambda accumulator, tensor: accumulator + tensor, current_key_tensors )
-            current_key_average = current_key_sum / len(state_dicts)
-            avg_delta_y[key] = current_key_average
-
-        #Updates the velocity
-        if self.velocity: #This will be False at the first round
-            for key in keys:
-                self.velocity[key] = self.momentum * self.velocity[key] + avg_delta_y[key]
-        else:
-            self.velocity = avg_delta_y
+        avg_delta_y = self.model_sum.mean()
+
+        #Updates the velocity, it starts from zero so the first round velocity equals avg_delta_y
+        if self.velocity is None:
+            self.velocity = self.layout.zeros()
+        self.velocity.mul_(self.momentum).add_(avg_delta_y)
 
         #Uses Nesterov gradient
-        for key in keys:
-            avg_delta_y[key] += self.momentum * self.velocity[key]
+        avg_delta_y.add_(self.velocity, alpha=self.momentum)
 
         #Updates server_state_dict
-        for key in keys:
-            server_state_dict[key] += self.lr * avg_delta_y[key]
+        server_flat = self.layout.flatten(self.server_state_dict)
+        server_flat.add_(avg_delta_y, alpha=self.lr)
 
-        return server_state_dict
+        return self.layout.to_state_dict(server_flat), None, None
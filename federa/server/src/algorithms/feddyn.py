@@ -1,9 +1,7 @@
-import functools
-from collections import OrderedDict
-import torch
+from ..aggregation_core import FlatAggregator
 
 #averages all of the given state dicts
-class feddyn():
+class feddyn(FlatAggregator):
 
     def __init__(self, config):
         self.algorithm = "Mime"
@@ -12,30 +10,20 @@ class feddyn():
         self.h = None
         self.alpha = 0.01
 
-    def aggregate(self, server_model_state_dict, state_dicts):
+    def finalize(self):
 
-        keys = server_model_state_dict.keys() #List of keys in a state_dict
+        num_clients = self.model_sum.count
 
-        if not self.h: #If self.h = None, then the following line will execute.
+        if self.h is None: #If self.h = None, then the following line will execute.
             #So only at first round, it'll execute
-            self.h = [torch.zeros_like(server_model_state_dict[key]) for key in server_model_state_dict.keys()]
+            self.h = self.layout.zeros()
 
-        sum_y = OrderedDict() #This will be our new server_model_state_dict
-        for key in keys:
-            current_key_tensors = [state_dict[key] for state_dict in state_dicts]
-            current_key_sum = functools.reduce( lambda accumulator, tensor: accumulator + tensor, current_key_tensors )
-            sum_y[key] = current_key_sum
-
-        delta_x = [torch.zeros_like(server_model_state_dict[key]) for key in server_model_state_dict.keys()]
-        for d_x, key in zip(delta_x, keys):
-            d_x.data = sum_y[key] - server_model_state_dict[key]
+        delta_x = self.model_sum.total - self.layout.flatten(self.server_state_dict)
 
         #Update h
-        for h, d_x in zip(self.h, delta_x):
-            h.data -= (self.alpha/len(state_dicts)) * d_x.data
+        self.h.sub_(delta_x, alpha=self.alpha/num_clients)
 
         #Update x
-        for key, h in zip(keys, self.h):
-            server_model_state_dict[key] = (sum_y[key]/len(state_dicts)) - (h.data/self.alpha)
+        server_flat = self.model_sum.mean().sub_(self.h, alpha=1/self.alpha)
 
-        return server_model_state_dict
+        return self.layout.to_state_dict(server_flat), None, None
@@ -1,9 +1,10 @@
 
+import asyncio
 from queue import Queue
 
 from . import ClientConnection_pb2_grpc
 
-from .client_wrapper import ClientWrapper
+from .client_wrapper import ClientWrapper, AsyncClientWrapper, BlockingClientWrapper
 
 #gRPC servicer that contains all functions that can be called by the client
 class ClientConnectionServicer( ClientConnection_pb2_grpc.ClientConnectionServicer ):
@@ -20,22 +21,28 @@ class ClientConnectionServicer( ClientConnection_pb2_grpc.ClientConnectionServic
         send_buffer = Queue(maxsize = 1)
         recieve_buffer = Queue(maxsize = 1)
 
-        client = ClientWrapper(send_buffer, recieve_buffer, client_id)
+        client = ClientWrapper(send_buffer, recieve_buffer, client_id, self.client_manager.payload_cache)
         register_result = self.client_manager.register(client)
         #if server is accepting connections, and registering was successful, True is returned
         if register_result:
             print(f"Client {client_id} connected.")
-            client_index = self.client_manager.num_connected_clients() - 1
 
             try:
                 while True:
                     server_message = send_buffer.get()
                     yield server_message
+                    #the chunks of a model are followed by the order they belong to, only orders are answered
+                    if server_message.HasField("modelChunk"):
+                        continue
+                    #a reply may itself come in chunks, all of them are passed on
                     client_message = next(client_message_iterator)
                     recieve_buffer.put(client_message)
+                    while client_message.HasField("modelChunk"):
+                        client_message = next(client_message_iterator)
+                        recieve_buffer.put(client_message)
             finally:
                 client.is_connected = False
-                self.client_manager.deregister(client_index)
+                self.client_manager.deregister(client)
                 print(f"Client {client_id} has disconnected.")
                 print(f"{self.client_manager.num_connected_clients()} clients remain active.")
         #server is not accepting connections or registering failed
@@ -44,4 +51,49 @@ class ClientConnectionServicer( ClientConnection_pb2_grpc.ClientConnectionServic
             server_message = send_buffer.get()
             yield server_message
             print(f"Client {client_id} attempted to connect. Connection refused.")
-            
\ No newline at end of file
+
+
+#grpc.aio counterpart of ClientConnectionServicer. every connected client is a coroutine on the event loop
+#instead of a thread of the server's pool, so one process can keep thousands of clients connected
+class AsyncClientConnectionServicer( ClientConnection_pb2_grpc.ClientConnectionServicer ):
+    def __init__(self, client_manager):
+        self.client_manager = client_manager
+
+    async def Connect(self, request_iterator, context):
+        client_id = context.peer()
+        client_message_iterator = request_iterator.__aiter__()
+        send_buffer = asyncio.Queue(maxsize = 1)
+        recieve_buffer = asyncio.Queue(maxsize = 1)
+
+        client = AsyncClientWrapper(send_buffer, recieve_buffer, client_id, self.client_manager.payload_cache)
+        #server_runner runs in its own thread, the client manager hands it a blocking view of the client
+        blocking_client = BlockingClientWrapper(client, asyncio.get_running_loop())
+        register_result = self.client_manager.register(blocking_client)
+        if register_result:
+            print(f"Client {client_id} connected.")
+
+            try:
+                while True:
+                    server_message = await send_buffer.get()
+                    yield server_message
+                    if server_message.HasField("modelChunk"):
+                        continue
+                    try:
+                        client_message = await client_message_iterator.__anext__()
+                        await recieve_buffer.put(client_message)
+                        while client_message.HasField("modelChunk"):
+                            client_message = await client_message_iterator.__anext__()
+                            await recieve_buffer.put(client_message)
+                    except StopAsyncIteration:
+                        break
+            finally:
+                client.is_connected = False
+                self.client_manager.deregister(blocking_client)
+                print(f"Client {client_id} has disconnected.")
+                print(f"{self.client_manager.num_connected_clients()} clients remain active.")
+        #server is not accepting connections or registering failed
+        else:
+            await client.disconnect()
+            server_message = await send_buffer.get()
+            yield server_message
+            print(f"Client {client_id} attempted to connect. Connection refused.")
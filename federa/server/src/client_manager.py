@@ -3,12 +3,15 @@ import random
 import threading
 from math import ceil
 
+from .payload_cache import PayloadCache
+
 #holds references to all live client_wrapper objects
 class ClientManager:
-    def __init__(self):
+    def __init__(self, chunk_size = None, model_versions = 0):
         self.client_list = []
         self.cv = threading.Condition()
         self.accepting_connections = True #set to false to stop accepting further connections
+        self.payload_cache = PayloadCache(chunk_size, model_versions) #serialized global model, shared by all clients of a round
 
     #returns a list of references to client wrapper objects in the order they connected
     def select(self, num_of_clients = None, fraction = None, timeout = None):
@@ -52,8 +55,10 @@ class ClientManager:
     def num_connected_clients(self):
         return len(self.client_list)
 
-    def deregister(self, client_index):
-        self.client_list.pop(client_index)
+    #removes the client wrapper object of a client that has disconnected
+    def deregister(self, client):
+        with self.cv:
+            self.client_list.remove(client)
 
     #wait for the number of clients to connect, indefinitely.
     # unless a timeout is specified, then just return after timeout
@@ -1,52 +1,104 @@
-
-from io import BytesIO
-import torch
+import asyncio
 import json
+import threading
 
-from .ClientConnection_pb2 import ServerMessage, TrainOrder, EvalOrder, SetParamsOrder, DisconnectOrder
+from .wire_format import decode_payload, PayloadDecoder
+from .ClientConnection_pb2 import ServerMessage, TrainOrder, EvalOrder, SetParamsOrder, DisconnectOrder, ModelChunk
 
 #serves as an abstraction of the actual connected client.
 #methods called here are called on the actual client with the same inputs and outputs
 class ClientWrapper:
-    def __init__(self, send_buffer, recieve_buffer, client_id):
+    def __init__(self, send_buffer, recieve_buffer, client_id, payload_cache):
         #data is placed in this buffer to send to client
         self.send_buffer = send_buffer
         #data recieved from client is extracted from this buffer
         self.recieve_buffer = recieve_buffer
         self.client_id = client_id
+        #round-scoped cache shared by all clients, so the same model is only serialized once
+        self.payload_cache = payload_cache
+        #version of the global model the client reported holding in its last reply, 0 if unknown
+        self.model_version = 0
         self.is_connected = True
+        #held from building an order until its reply is read. a client cut from a round keeps training,
+        #its next order waits for that reply and is only built once the model the client holds is known
+        self.lock = threading.Lock()
 
     #orders the connected client to train using the given parameters
     def train(self, model_parameters, control_variate, control_variate2, config_dict):
         self.check_disconnection()
+        with self.lock:
+            client_message, chunks = self.request(self.train_order(model_parameters, control_variate, control_variate2, config_dict))
+        return self.train_result(client_message, chunks)
+
+    #orders the connected client to evaluate the given parameters
+    def evaluate(self, model_parameters, config_dict):
+        self.check_disconnection()
+        with self.lock:
+            client_message, _ = self.request(self.eval_order(model_parameters, config_dict))
+        return self.eval_result(client_message)
+
+    #orders the client to set its own parameters as the ones passed
+    def set_parameters(self, model_parameters):
+        self.check_disconnection()
+        #client sends an empty set params message as response
+        with self.lock:
+            self.request(self.set_parameters_order(model_parameters))
+
+    #orders the client to disconnect. if a reconnect is specified (in seconds),
+    #the client will attempt to reconnect after that time
+    def disconnect(self, reconnect_time = 0, message = "Thank you for participating."):
+        self.check_disconnection()
+        self.send_buffer.put(self.disconnect_order(reconnect_time, message))
+
+    #sends an order (the chunks of its model, then the order itself) to the client and waits for its reply.
+    #returns the reply and the decoder of the model chunks that came before it
+    def request(self, messages_to_client):
+        for message_to_client in messages_to_client:
+            self.send_buffer.put(message_to_client)
+        chunks = PayloadDecoder()
+        client_message = self.recieve_buffer.get()
+        while client_message.HasField("modelChunk"):
+            chunks.feed(client_message.modelChunk.data)
+            client_message = self.recieve_buffer.get()
+        self.model_version = client_message.modelVersion
+        return client_message, chunks
 
-        #Create a dictionary where model_parameters and control_variate are stored
-        data = {}
-        data['model_parameters'] = model_parameters
-        data['control_variate'] = control_variate
-        data['control_variate2'] = control_variate2
+    def check_disconnection(self):
+        if not self.is_connected:
+            raise Exception(f"Cannot execute command. {self.client_id} is disconnected.")
 
-        #convert data to bytes
-        buffer = BytesIO()
-        torch.save(data, buffer)
-        buffer.seek(0)
-        data_bytes = buffer.read()
+    def is_disconnected(self):
+        return not self.is_connected
 
+    def train_order(self, model_parameters, control_variate, control_variate2, config_dict):
+        #model_parameters and control_variates are serialized together, once for all clients of the round
+        #the model itself is left out, or sent as a delta, when the client holds a recent version of it
+        data_bytes, version, base_version = self.payload_cache.train_payload(
+            model_parameters, control_variate, control_variate2, self.model_version)
+
+        #the client sends its trained model back in chunks of the same size
+        config_dict = dict(config_dict, chunk_size = self.payload_cache.chunk_size)
         #convert config_dict to bytes
         config_dict_bytes = json.dumps(config_dict).encode("utf-8")
 
-        #send bytes to client
+        if isinstance(data_bytes, list):
+            train_order_message = TrainOrder(configDict = config_dict_bytes, chunked = True,
+                                             modelVersion = version, baseVersion = base_version)
+            return self.chunk_messages(data_bytes) + [ServerMessage(trainOrder = train_order_message)]
         train_order_message = TrainOrder(
             modelParameters = data_bytes,
-            configDict = config_dict_bytes)
-        message_to_client = ServerMessage(trainOrder = train_order_message)
-        self.send_buffer.put(message_to_client)
+            configDict = config_dict_bytes,
+            modelVersion = version,
+            baseVersion = base_version)
+        return [ServerMessage(trainOrder = train_order_message)]
 
-        #get trained model_parameters and response_dict from client
-        client_message = self.recieve_buffer.get()
+    #get trained model_parameters and response_dict from client
+    def train_result(self, client_message, chunks):
         train_response_message = client_message.trainResponse
-        data_received_bytes = train_response_message.modelParameters
-        data_received = torch.load( BytesIO(data_received_bytes), map_location="cpu" )
+        if train_response_message.chunked:
+            data_received = chunks.result()
+        else:
+            data_received = decode_payload(train_response_message.modelParameters)
         #updated_control_variate will become None when no control_variate is involved at all
         trained_model_parameters = data_received['model_parameters']
         updated_control_variate = data_received['control_variate']
@@ -54,54 +106,134 @@ class ClientWrapper:
         response_dict = json.loads( response_dict_bytes.decode("utf-8") )
         return trained_model_parameters, updated_control_variate, response_dict
 
-    #orders the connected client to evaluate the given parameters
-    def evaluate(self, model_parameters, config_dict):
-        self.check_disconnection()
-        #convert state_dict inside model_parameters to bytes
-        buffer = BytesIO()
-        torch.save(model_parameters, buffer)
-        buffer.seek(0)
-        model_parameters_bytes = buffer.read()
+    def eval_order(self, model_parameters, config_dict):
+        #evaluation orders are not chunked, the model is sent as a single message
+        model_parameters_bytes = self.payload_cache.model_payload(model_parameters)
+        if isinstance(model_parameters_bytes, list):
+            model_parameters_bytes = b"".join(model_parameters_bytes)
         #convert config_dict to bytes
         config_dict_bytes = json.dumps(config_dict).encode("utf-8")
-        #send bytes to client
         eval_order_message = EvalOrder(
             modelParameters = model_parameters_bytes,
             configDict = config_dict_bytes)
-        message_to_client = ServerMessage(evalOrder = eval_order_message)
-        self.send_buffer.put(message_to_client)
-        #get response dict as bytes from client
-        client_message = self.recieve_buffer.get()
+        return [ServerMessage(evalOrder = eval_order_message)]
+
+    #get response dict as bytes from client
+    def eval_result(self, client_message):
         eval_response_message = client_message.evalResponse
         response_dict_bytes = eval_response_message.responseDict
         response_dict = json.loads(response_dict_bytes.decode("utf-8"))
         return response_dict
 
-    #orders the client to set its own parameters as the ones passed
-    def set_parameters(self, model_parameters):
+    def set_parameters_order(self, model_parameters):
+        model_parameters_bytes, version, base_version = self.payload_cache.set_parameters_payload(
+            model_parameters, self.model_version)
+        if isinstance(model_parameters_bytes, list):
+            set_parameters_order_message = SetParamsOrder(chunked = True, modelVersion = version, baseVersion = base_version)
+            return self.chunk_messages(model_parameters_bytes) + [ServerMessage(setParamsOrder = set_parameters_order_message)]
+        set_parameters_order_message = SetParamsOrder(modelParameters = model_parameters_bytes,
+                                                      modelVersion = version, baseVersion = base_version)
+        return [ServerMessage(setParamsOrder = set_parameters_order_message)]
+
+    #a model payload split by the payload cache, sent ahead of the order that uses it
+    def chunk_messages(self, chunks):
+        return [ServerMessage(modelChunk = ModelChunk(data = chunk)) for chunk in chunks]
+
+    def disconnect_order(self, reconnect_time, message):
+        disconnect_order_message = DisconnectOrder(reconnectTime = reconnect_time, message = message)
+        return ServerMessage(disconnectOrder = disconnect_order_message)
+
+
+#ClientWrapper of the grpc.aio server. the buffers are asyncio queues and every order is awaitable
+class AsyncClientWrapper(ClientWrapper):
+    def __init__(self, send_buffer, recieve_buffer, client_id, payload_cache):
+        super().__init__(send_buffer, recieve_buffer, client_id, payload_cache)
+        #replies still owed by the client for orders whose caller stopped waiting (e.g. on a timeout)
+        self.stale_responses = 0
+
+    async def train(self, model_parameters, control_variate, control_variate2, config_dict):
         self.check_disconnection()
-        buffer = BytesIO()
-        torch.save(model_parameters, buffer)
-        buffer.seek(0)
-        model_parameters_bytes = buffer.read()
-        set_parameters_order_message = SetParamsOrder(modelParameters = model_parameters_bytes)
-        message_to_client = ServerMessage(setParamsOrder = set_parameters_order_message)
-        self.send_buffer.put(message_to_client)
-        #client sends an empty set params message as response
-        self.recieve_buffer.get()
+        await self.drain()
+        client_message, chunks = await self.request(
+            self.train_order(model_parameters, control_variate, control_variate2, config_dict))
+        return self.train_result(client_message, chunks)
 
-    def check_disconnection(self):
-        if not self.is_connected:
-            raise Exception(f"Cannot execute command. {self.client_id} is disconnected.")
+    async def evaluate(self, model_parameters, config_dict):
+        self.check_disconnection()
+        await self.drain()
+        client_message, _ = await self.request(self.eval_order(model_parameters, config_dict))
+        return self.eval_result(client_message)
 
-    def is_disconnected(self):
-        return not self.is_connected
+    async def set_parameters(self, model_parameters):
+        self.check_disconnection()
+        await self.drain()
+        await self.request(self.set_parameters_order(model_parameters))
 
-    #orders the client to disconnect. if a reconnect is specified (in seconds),
-    #the client will attempt to reconnect after that time
-    def disconnect(self, reconnect_time = 0, message = "Thank you for participating."):
+    async def disconnect(self, reconnect_time = 0, message = "Thank you for participating."):
         self.check_disconnection()
-        disconnect_order_message = DisconnectOrder(reconnectTime = reconnect_time, message = message)
-        message_to_client = ServerMessage(disconnectOrder = disconnect_order_message)
-        self.send_buffer.put(message_to_client)
-        
\ No newline at end of file
+        await self.send_buffer.put(self.disconnect_order(reconnect_time, message))
+
+    #the client answers orders one at a time, so replies to abandoned orders come first.
+    #orders are only built after that, once the version of the model the client holds is known
+    async def drain(self):
+        while self.stale_responses:
+            await self.discard()
+            self.stale_responses -= 1
+
+    async def request(self, messages_to_client):
+        try:
+            #an order is never left half sent, the client would take the chunks of the next one for its own
+            await asyncio.shield(self.send(messages_to_client))
+            return await self.receive()
+        except asyncio.CancelledError:
+            self.stale_responses += 1
+            raise
+
+    async def send(self, messages_to_client):
+        for message_to_client in messages_to_client:
+            await self.send_buffer.put(message_to_client)
+
+    #reads a reply, along with the model chunks that come before it
+    async def receive(self):
+        chunks = PayloadDecoder()
+        client_message = await self.recieve_buffer.get()
+        while client_message.HasField("modelChunk"):
+            chunks.feed(client_message.modelChunk.data)
+            client_message = await self.recieve_buffer.get()
+        self.model_version = client_message.modelVersion
+        return client_message, chunks
+
+    #skips the rest of a reply, part of which may already have been read by an abandoned order
+    async def discard(self):
+        client_message = await self.recieve_buffer.get()
+        while client_message.HasField("modelChunk"):
+            client_message = await self.recieve_buffer.get()
+        #the client did take the abandoned order's model
+        self.model_version = client_message.modelVersion
+
+
+#blocking view of an AsyncClientWrapper for code running outside the event loop (server_runner, verify).
+#this is what the client manager holds in grpc.aio mode, the awaitable wrapper is available as async_client
+class BlockingClientWrapper:
+    def __init__(self, async_client, loop):
+        self.async_client = async_client
+        self.loop = loop
+        self.client_id = async_client.client_id
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def train(self, model_parameters, control_variate, control_variate2, config_dict):
+        return self.run(self.async_client.train(model_parameters, control_variate, control_variate2, config_dict))
+
+    def evaluate(self, model_parameters, config_dict):
+        return self.run(self.async_client.evaluate(model_parameters, config_dict))
+
+    def set_parameters(self, model_parameters):
+        self.run(self.async_client.set_parameters(model_parameters))
+
+    def disconnect(self, reconnect_time = 0, message = "Thank you for participating."):
+        self.run(self.async_client.disconnect(reconnect_time, message))
+
+    def is_disconnected(self):
+        return self.async_client.is_disconnected()
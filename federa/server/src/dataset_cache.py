@@ -0,0 +1,108 @@
+import os
+from collections import namedtuple
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils import data
+from torch.utils.data import default_collate
+
+#Batched loading of image datasets.
+#
+#Datasets holding their images as a uint8 array serve whole batches: a DataLoader with collate_fn=collate asks
+#for the indices of a batch at once (__getitems__) and gets them with a single fancy index. The batch is then
+#resized and converted to float in [0, 1] as a whole in collate, with interpolate on uint8, which gives the
+#same values as Resize followed by ToTensor on every PIL image. Upscaled images are identical, a few pixels
+#of downscaled ones differ by 1/255 or 2/255.
+#
+#The built-in datasets are also kept pre-resized: their images are resized once and stored as a uint8
+#(N, C, H, W) array in a .npy file next to the dataset, keyed by split and resize_size, with the labels in a
+#second file. CachedDataset memory-maps them and its batches need no resizing.
+#This module is kept identical on the client and on the server.
+
+#images is a uint8 (B, C, H, W) tensor, to be resized to size unless it is None
+Batch = namedtuple("Batch", ["images", "labels", "size"])
+
+#(H, W) of an image of height h and width w after Resize(size): its smaller edge becomes size
+def resized_shape(h, w, size):
+    if h <= w:
+        return size, int(size * w / h)
+    return int(size * h / w), size
+
+#uint8 (B, C, H, W) images resized as Resize(size) does, in one call for the whole batch
+def resize_images(images, size):
+    shape = resized_shape(images.shape[-2], images.shape[-1], size)
+    if tuple(images.shape[-2:]) == shape:
+        return images
+    return F.interpolate(images.contiguous(), size=shape, mode='bilinear', antialias=True, align_corners=False)
+
+#uint8 (N, H, W) or (N, H, W, C) images as a (N, C, H, W) view
+def as_nchw(images):
+    images = np.asarray(images)
+    return images[:, None] if images.ndim == 3 else images.transpose(0, 3, 1, 2)
+
+class ArrayDataset(data.Dataset):
+    #images is a uint8 (N, C, H, W) array, resized batch by batch to resize_size unless it is None
+    def __init__(self, images, targets, resize_size = None):
+        self.images = images
+        self.targets = np.asarray(targets, dtype=np.int64)
+        self.resize_size = resize_size
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, index):
+        images, labels = collate(self.__getitems__([index]))
+        return images[0], int(labels[0])
+
+    def __getitems__(self, indices):
+        indices = np.asarray(indices)
+        images = torch.from_numpy(np.ascontiguousarray(self.images[indices]))
+        return Batch(images, torch.from_numpy(self.targets[indices]), self.resize_size)
+
+class CachedDataset(ArrayDataset):
+    def __init__(self, path):
+        self.path = path
+        super().__init__(np.load(path + ".images.npy", mmap_mode='r'), np.load(path + ".labels.npy"))
+
+    #DataLoader worker processes map the files again instead of receiving a copy of the images
+    def __getstate__(self):
+        return self.path
+
+    def __setstate__(self, path):
+        self.__init__(path)
+
+#collate_fn of the DataLoaders of array datasets, batches come out of the dataset already collated
+def collate(samples):
+    if isinstance(samples, Batch):
+        images = samples.images if samples.size is None else resize_images(samples.images, samples.size)
+        return images.float().div_(255), samples.labels
+    return default_collate(samples)
+
+#a torchvision dataset (e.g. torchvision.datasets.MNIST) served as an array dataset, resized batch by batch
+def array_dataset(dataset_class, root, train, resize_size):
+    dataset = dataset_class(root=root, train=train, download=True)
+    return ArrayDataset(as_nchw(dataset.data), dataset.targets, resize_size)
+
+#cached copy of a torchvision dataset, built on first use. dataset_class is e.g. torchvision.datasets.MNIST
+def cached_dataset(dataset_class, root, train, resize_size):
+    path = os.path.join(root, "cache", f"{'train' if train else 'test'}_{resize_size}")
+    if not os.path.exists(path + ".labels.npy"):
+        _build(array_dataset(dataset_class, root, train, resize_size), path)
+    return CachedDataset(path)
+
+#resizes every image once, a block of images at a time. the files are written under temporary names and
+#renamed into place, labels last, so clients building the same cache at the same time never read a partial one
+def _build(dataset, path, block_size = 1024):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    shape = dataset.images.shape[1:2] + resized_shape(*dataset.images.shape[2:], dataset.resize_size)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    images = np.lib.format.open_memmap(temporary_path + ".images.npy", mode='w+', dtype=np.uint8,
+                                       shape=(len(dataset),) + shape)
+    for start in range(0, len(dataset), block_size):
+        block = dataset.__getitems__(range(start, min(start + block_size, len(dataset))))
+        images[start:start + len(block.labels)] = resize_images(block.images, block.size).numpy()
+    images.flush()
+    del images
+    np.save(temporary_path + ".labels.npy", dataset.targets)
+    os.replace(temporary_path + ".images.npy", path + ".images.npy")
+    os.replace(temporary_path + ".labels.npy", path + ".labels.npy")
@@ -0,0 +1,71 @@
+import zlib
+import torch
+
+#Lossless deltas between two versions of a state dict, used to send a client only what changed
+#in the global model since the version it already holds.
+#
+#The delta of a tensor is the XOR of its raw bytes with those of the base tensor. Bits that did not
+#change are zero, which for small updates covers the sign, the exponent and the top of the mantissa.
+#The bytes are split into planes by their position within the element (all first bytes, all second
+#bytes, ...) so that these zeros end up together, and every plane is compressed on its own. Applying
+#the delta restores the exact bits, so the client ends up with the same model as the server and no
+#error builds up over rounds.
+#A tensor that did not change is None in the delta, otherwise it is the list of its compressed planes,
+#where a plane without any changed bit is None.
+#This module is kept identical on the client and on the server.
+
+COMPRESSION_LEVEL = 1
+#planes whose first SAMPLE_SIZE bytes do not compress below COMPRESSIBLE of their size
+#(the low bytes of the mantissa) are stored as they are, compressing them would only cost time
+SAMPLE_SIZE = 65536
+COMPRESSIBLE = 0.9
+
+def _raw_bytes(tensor):
+    return tensor.detach().to("cpu").contiguous().reshape(-1).view(torch.uint8)
+
+def _compress(plane):
+    level = COMPRESSION_LEVEL
+    sample = plane[:SAMPLE_SIZE].numpy()
+    if len(zlib.compress(sample, level)) > COMPRESSIBLE * len(sample):
+        level = 0
+    return torch.frombuffer(bytearray(zlib.compress(plane.numpy(), level)), dtype=torch.uint8)
+
+#delta of state_dict against base_state_dict, None if they do not have the same keys, shapes and dtypes
+def encode_delta(state_dict, base_state_dict):
+    if state_dict.keys() != base_state_dict.keys():
+        return None
+    delta = {}
+    for key, tensor in state_dict.items():
+        base_tensor = base_state_dict[key]
+        if tensor.shape != base_tensor.shape or tensor.dtype != base_tensor.dtype:
+            return None
+        changed_bits = _raw_bytes(tensor) ^ _raw_bytes(base_tensor)
+        if not changed_bits.any():
+            delta[key] = None
+            continue
+        planes = changed_bits.view(-1, tensor.element_size())
+        delta[key] = []
+        for position in range(tensor.element_size()):
+            plane = planes[:, position].contiguous()
+            delta[key].append(_compress(plane) if plane.any() else None)
+    return delta
+
+#number of bytes a delta takes on the wire
+def delta_size(delta):
+    return sum(plane.numel() for planes in delta.values() if planes is not None
+               for plane in planes if plane is not None)
+
+#rebuilds the state dict a delta was encoded from
+def apply_delta(base_state_dict, delta):
+    state_dict = {}
+    for key, base_tensor in base_state_dict.items():
+        if delta[key] is None:
+            state_dict[key] = base_tensor
+            continue
+        changed_bits = torch.zeros(base_tensor.numel() * base_tensor.element_size(), dtype=torch.uint8)
+        planes = changed_bits.view(-1, base_tensor.element_size())
+        for position, plane in enumerate(delta[key]):
+            if plane is not None:
+                planes[:, position] = torch.frombuffer(bytearray(zlib.decompress(plane.numpy())), dtype=torch.uint8)
+        state_dict[key] = (changed_bits ^ _raw_bytes(base_tensor)).view(base_tensor.dtype).view(base_tensor.shape)
+    return state_dict
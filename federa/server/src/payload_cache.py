@@ -0,0 +1,127 @@
+import threading
+import time
+
+from .wire_format import encode_payload, encode_payload_chunks
+from .model_delta import encode_delta, delta_size
+
+#serializes a payload once per round and hands the same immutable bytes object to every client it is sent to.
+#payloads are keyed by the identity of the objects they were built from. the cache (or the versions, for a model
+#sent as a delta) keeps those objects referenced until new_round() is called,
+#so an id cannot be reused by another object within a round.
+#with a chunk_size (in bytes) every payload is a list of chunks of at most that size instead of a single bytes object.
+#the last model_versions global models are kept across rounds, clients holding one of them are sent a delta
+class PayloadCache:
+    def __init__(self, chunk_size = None, model_versions = 0):
+        self.lock = threading.Lock()
+        self.chunk_size = chunk_size
+        self.versions = ModelVersions(model_versions)
+        self.new_round()
+
+    #drops the payloads of the previous round and resets the metrics
+    def new_round(self):
+        with self.lock:
+            self.entries = {}
+            self.serialization_time = 0.0
+            self.bytes_serialized = 0
+            self.bytes_reused = 0
+
+    #payload of a TrainOrder for a client that holds held_version of the global model.
+    #returns the payload, the version of model_parameters and the version its model is a delta against,
+    #which is 0 when the full model is sent
+    def train_payload(self, model_parameters, control_variate, control_variate2, held_version = 0):
+        model_data, version, base_version = self.model_data(model_parameters, held_version)
+        data = {}
+        data['model_parameters'] = model_data
+        data['control_variate'] = control_variate
+        data['control_variate2'] = control_variate2
+        key = ("train", id(model_parameters), id(control_variate), id(control_variate2), base_version)
+        return self.get(key, data), version, base_version
+
+    #payload of a SetParamsOrder, same as train_payload
+    def set_parameters_payload(self, model_parameters, held_version = 0):
+        model_data, version, base_version = self.model_data(model_parameters, held_version)
+        key = ("set_parameters", id(model_parameters), base_version)
+        return self.get(key, model_data), version, base_version
+
+    #payload of an EvalOrder, always the full model
+    def model_payload(self, model_parameters):
+        return self.get(("model", id(model_parameters)), model_parameters)
+
+    def model_data(self, model_parameters, held_version):
+        with self.lock:
+            version = self.versions.version(model_parameters)
+            model_data, base_version = self.versions.model_data(model_parameters, version, held_version)
+        return model_data, version, base_version
+
+    def get(self, key, data):
+        #clients are trained from several threads, the first one serializes and the others wait for its bytes
+        with self.lock:
+            if key in self.entries:
+                payload = self.entries[key][1]
+                self.bytes_reused += payload_size(payload)
+                return payload
+            serialization_start = time.perf_counter()
+            if self.chunk_size:
+                payload = list(encode_payload_chunks(data, self.chunk_size))
+            else:
+                payload = encode_payload(data)
+            self.serialization_time += time.perf_counter() - serialization_start
+            self.bytes_serialized += payload_size(payload)
+            self.entries[key] = (data, payload)
+            return payload
+
+    def stats(self):
+        with self.lock:
+            return {"serialization_time": self.serialization_time,
+                    "bytes_serialized": self.bytes_serialized,
+                    "bytes_reused": self.bytes_reused}
+
+def payload_size(payload):
+    if isinstance(payload, list):
+        return sum(len(chunk) for chunk in payload)
+    return len(payload)
+
+
+#the most recent versions of the global model, numbered from 1. a model is recognised by its identity,
+#server_runner builds a new state dict for every aggregated model
+class ModelVersions:
+    def __init__(self, size):
+        self.size = size
+        self.models = {}
+        self.latest_version = 0
+        #deltas between two kept versions, by (version, base version). None when the full model is smaller
+        self.deltas = {}
+
+    #version of a global model, a model not seen before becomes the newest version. 0 when versions are disabled
+    def version(self, state_dict):
+        if not self.size:
+            return 0
+        for version, model in self.models.items():
+            if model is state_dict:
+                return version
+        self.latest_version += 1
+        self.models[self.latest_version] = state_dict
+        if len(self.models) > self.size:
+            oldest_version = min(self.models)
+            del self.models[oldest_version]
+            self.deltas = {versions: delta for versions, delta in self.deltas.items() if oldest_version not in versions}
+        return self.latest_version
+
+    #what to send of the given version of the model to a client that holds held_version,
+    #and the version it is relative to: nothing if the client already has it, a delta if the client holds
+    #a version that is still kept, otherwise the full model (relative to version 0)
+    def model_data(self, state_dict, version, held_version):
+        if version and held_version == version:
+            return None, version
+        if held_version not in self.models:
+            return state_dict, 0
+        if (version, held_version) not in self.deltas:
+            delta = encode_delta(state_dict, self.models[held_version])
+            full_size = sum(tensor.numel() * tensor.element_size() for tensor in state_dict.values())
+            if delta is not None and delta_size(delta) >= full_size:
+                delta = None
+            self.deltas[(version, held_version)] = delta
+        delta = self.deltas[(version, held_version)]
+        if delta is None:
+            return state_dict, 0
+        return delta, held_version
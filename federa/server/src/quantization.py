@@ -0,0 +1,91 @@
+import torch
+
+#Stochastic quantization of the updates clients upload.
+#
+#A quantized tensor is a dict {"codes", "scale", "offset", "shape"}. Its values are split in rows, a single
+#row per tensor or one row per output channel (first dimension), and every row is mapped linearly from
+#[min, max] onto the 2**bits - 1 levels of its codes, rounding up or down at random in proportion to the
+#distance to either level so that the dequantized values are unbiased. 4 bit codes are packed two per byte.
+#Floating point tensors of a model are quantized as the difference with the global model the client trained
+#from, which the server still holds, unless the algorithm already uploads differences. Control variates are
+#quantized as they are. Other tensors (integer buffers such as num_batches_tracked) are sent unchanged.
+#This module is kept identical on the client and on the server.
+
+def is_quantized(node):
+    return isinstance(node, dict) and "codes" in node
+
+def quantize(tensor, bits, per_channel):
+    tensor = tensor.detach().to(device="cpu", dtype=torch.float32)
+    if per_channel and tensor.dim() > 1:
+        rows = tensor.reshape(tensor.shape[0], -1)
+    else:
+        rows = tensor.reshape(1, -1)
+    offset = rows.amin(dim=1, keepdim=True)
+    levels = 2 ** bits - 1
+    scale = (rows.amax(dim=1, keepdim=True) - offset) / levels
+    #constant rows have a scale of 0 and are restored exactly from their offset
+    step = torch.where(scale > 0, scale, torch.ones_like(scale))
+    codes = ((rows - offset) / step + torch.rand_like(rows)).floor_().clamp_(0, levels).to(torch.uint8).reshape(-1)
+    if bits == 4:
+        if codes.numel() % 2:
+            codes = torch.cat([codes, codes.new_zeros(1)])
+        codes = codes[0::2] | (codes[1::2] << 4)
+    return {"codes": codes, "scale": scale.reshape(-1), "offset": offset.reshape(-1),
+            "shape": torch.tensor(list(tensor.shape), dtype=torch.int64)}
+
+#dequantizes into out (a float32 tensor with as many elements) when it is given
+def dequantize(node, out=None):
+    shape = torch.Size(node["shape"].tolist())
+    codes = node["codes"]
+    #4 bit codes take half a byte each
+    if codes.numel() < shape.numel():
+        codes = torch.stack([codes & 0xF, codes >> 4], dim=1).reshape(-1)[:shape.numel()]
+    rows = codes.to(torch.float32).view(node["scale"].numel(), -1)
+    if out is None:
+        out = torch.empty(shape, dtype=torch.float32)
+    torch.addcmul(node["offset"].unsqueeze(1), rows, node["scale"].unsqueeze(1), out=out.view(rows.shape))
+    return out.view(shape)
+
+def _quantizable(tensor):
+    return tensor.is_floating_point() and tensor.numel() > 0
+
+#quantizes a trained state dict as its difference with base_state_dict, the model it was trained from.
+#a base_state_dict of None quantizes the tensors as they are
+def quantize_update(state_dict, base_state_dict, bits, per_channel):
+    quantized = {}
+    for key, tensor in state_dict.items():
+        if _quantizable(tensor):
+            update = tensor.detach().to(device="cpu", dtype=torch.float32)
+            if base_state_dict is not None:
+                update = update - base_state_dict[key].to(torch.float32)
+            quantized[key] = quantize(update, bits, per_channel)
+        else:
+            quantized[key] = tensor
+    return quantized
+
+def quantize_tensors(tensors, bits, per_channel):
+    return [quantize(tensor, bits, per_channel) if _quantizable(tensor) else tensor for tensor in tensors]
+
+#inverse of quantize_update, for the code that needs the trained state dict itself
+def dequantize_update(state_dict, base_state_dict):
+    if base_state_dict is None:
+        return {key: dequantize(tensor) if is_quantized(tensor) else tensor for key, tensor in state_dict.items()}
+    return {key: (base_state_dict[key] + dequantize(tensor)).to(base_state_dict[key].dtype)
+            if is_quantized(tensor) else tensor for key, tensor in state_dict.items()}
+
+def dequantize_tensors(tensors):
+    return [dequantize(tensor) if is_quantized(tensor) else tensor for tensor in tensors]
+
+#bytes taken by the tensors of a payload tree, and what they would take uncompressed (as float32).
+#compressed tensors, quantized or sparse (see sparsification.py), are the dicts with a shape
+def payload_nbytes(node):
+    if node is None:
+        return 0, 0
+    if isinstance(node, torch.Tensor):
+        return node.numel() * node.element_size(), node.numel() * node.element_size()
+    if isinstance(node, dict) and "shape" in node:
+        nbytes = sum(tensor.numel() * tensor.element_size() for tensor in node.values())
+        return nbytes, 4 * torch.Size(node["shape"].tolist()).numel()
+    children = node.values() if isinstance(node, dict) else node
+    sizes = [payload_nbytes(child) for child in children]
+    return sum(size[0] for size in sizes), sum(size[1] for size in sizes)
@@ -1,8 +1,10 @@
 from .client_manager import ClientManager
-from .client_connection_servicer import ClientConnectionServicer
+from .client_connection_servicer import ClientConnectionServicer, AsyncClientConnectionServicer
 
 from .verification import verify
 from .server_evaluate import server_eval
+from .quantization import payload_nbytes, dequantize_update, dequantize_tensors
+from .sparsification import densify_update
 
 import grpc
 from . import ClientConnection_pb2_grpc
@@ -10,12 +12,17 @@ from concurrent import futures
 
 import os
 import json
+import asyncio
 import threading
+from queue import Queue, Empty
+from math import ceil
+import time
 import torch
 from datetime import datetime
 
-#the business logic of the server, i.e what interactions take place with the clients
-def server_runner(client_manager, configurations):
+#the business logic of the server, i.e what interactions take place with the clients.
+#loop is the event loop of the grpc.aio server when running in that mode
+def server_runner(client_manager, configurations, loop = None):
     print("\nServer Running")
 
     #get hyperparameters from the passed configurations dict
@@ -38,6 +45,9 @@ def server_runner(client_manager, configurations):
     batch_size = configurations["batch_size"]
     niid = configurations["niid"]
     carbon=configurations["carbon"]
+    client_timeout = configurations.get("client_timeout")
+    round_deadline = configurations.get("round_deadline")
+    quorum = configurations.get("quorum", 1.0)
 
     #create a new directory inside FL_checkpoints and store the aggragted models in each round
     fl_timestamp = f"{datetime.now().strftime('%Y-%m-%d %H-%M-%S')}"
@@ -75,42 +85,96 @@ def server_runner(client_manager, configurations):
     client_manager.accepting_connections = accept_conn_after_FL_begin
     config_dict = {"epochs": epochs, "timeout": timeout, "algorithm":algorithm, "message":"train",
                    "dataset":dataset, "net":net, "resize_size":resize_size, "batch_size":batch_size,
-                   "niid": niid, "carbon-tracker":carbon}
+                   "niid": niid, "carbon-tracker":carbon,
+                   "dataset_cache": configurations.get("dataset_cache", 1),
+                   "prefetch": configurations.get("prefetch", 0),
+                   "num_workers": configurations.get("num_workers", 0),
+                   "persistent_workers": configurations.get("persistent_workers", 1),
+                   "pin_memory": configurations.get("pin_memory", 0),
+                   "prefetch_factor": configurations.get("prefetch_factor", 2),
+                   "partition": configurations.get("partition", "niid"),
+                   "num_users": configurations.get("num_users", 5),
+                   "dirichlet_alpha": configurations.get("dirichlet_alpha", 0.5),
+                   "shards_per_user": configurations.get("shards_per_user", 2),
+                   "classes_per_user": configurations.get("classes_per_user", 2),
+                   "upload_bits": configurations.get("upload_bits", 0),
+                   "upload_granularity": configurations.get("upload_granularity", "tensor"),
+                   "upload_topk": configurations.get("upload_topk", 0),
+                   "upload_threshold": configurations.get("upload_threshold", 0),
+                   "uploads_deltas": aggregator.uploads_deltas,
+                   "gradient_batch_size": configurations.get("gradient_batch_size", 0),
+                   "compile": configurations.get("compile", 0),
+                   "precision": configurations.get("precision", "fp32"),
+                   "client_eval": configurations.get("client_eval", "full"),
+                   "client_eval_every": configurations.get("client_eval_every", 1),
+                   "client_eval_samples": configurations.get("client_eval_samples", 1000),
+                   "num_of_rounds": communRound}
     for round in range(1, communRound + 1):
         clients = client_manager.random_select(client_manager.num_connected_clients(), fraction_of_clients)
 
 
         print(f"\nCR {round}/{communRound} with {len(clients)}/{client_manager.num_connected_clients()} client(s)")
-        trained_model_state_dicts = []
-        updated_control_variates = []
-        with futures.ThreadPoolExecutor(max_workers=5) as executor:
-            result_futures = {executor.submit(
-                client.train, server_model_state_dict, control_variate, control_variate2, config_dict
-                ) for client in clients}
-            for client_index, result_future in zip(range(len(clients)), futures.as_completed(result_futures)):
-                trained_model_state_dict, updated_control_variate, results = result_future.result()
-                trained_model_state_dicts.append(trained_model_state_dict)
-                updated_control_variates.append(updated_control_variate)
-                print(f"Training results (client {clients[client_index].client_id}): ", results)
+        #client updates are folded into the aggregator as soon as they arrive and then dropped,
+        #so server memory does not grow with the number of clients.
+        #verification needs every model to be passed around first, so then they are kept until it is done
+        aggregator.begin_round(server_model_state_dict, control_variate, control_variate2)
+        client_manager.payload_cache.new_round()
+        aggregation_time = 0.0
+        #tensor bytes uploaded by the clients, and what they would have been without quantization
+        upload_bytes, upload_raw_bytes = 0, 0
+        updates, updated_clients = [], []
+        cut_clients = []
+        round_start = time.perf_counter()
+        #clients evaluate their trained model in the rounds set by client_eval_every
+        train_args = (server_model_state_dict, control_variate, control_variate2, dict(config_dict, round = round))
+        for client, result in train_clients(clients, train_args, loop, client_timeout, round_deadline, quorum):
+            if result is None:
+                print(f"Client {client.client_id} did not reply in time, skipping its update")
+                cut_clients.append(client.client_id)
+                continue
+            trained_model_state_dict, updated_control_variate, results = result
+            print(f"Training results (client {client.client_id}): ", results)
+            nbytes, raw_nbytes = payload_nbytes((trained_model_state_dict, updated_control_variate))
+            upload_bytes += nbytes
+            upload_raw_bytes += raw_nbytes
+            if verification:
+                #verification evaluates the models themselves, compressed updates are restored first
+                base = None if aggregator.uploads_deltas else server_model_state_dict
+                trained_model_state_dict = dequantize_update(trained_model_state_dict, base)
+                trained_model_state_dict = densify_update(trained_model_state_dict, base)
+                if updated_control_variate is not None:
+                    updated_control_variate = dequantize_tensors(updated_control_variate)
+                updates.append((trained_model_state_dict, updated_control_variate))
+                updated_clients.append(client)
+                continue
+            aggregation_start = time.perf_counter()
+            aggregator.accumulate((trained_model_state_dict, updated_control_variate))
+            aggregation_time += time.perf_counter() - aggregation_start
+            del result, trained_model_state_dict, updated_control_variate
+        training_time = time.perf_counter() - round_start
+        if cut_clients:
+            print(f"{len(cut_clients)}/{len(clients)} client(s) cut from the round")
 
         if verification:
             print("Performing verification round...")
-            selected_state_dicts = verify(clients,
-                        trained_model_state_dicts, save_dir_path, threshold=verification_threshold)
-            print(f"\nAggregating {len(selected_state_dicts)}/{len(trained_model_state_dicts)} clients above threshold")
-        else:
-            selected_state_dicts = trained_model_state_dicts
-
-        #aggregate model, save it, then send to some client to evaluate#aggregate model, save it,
-        # then send to some client to evaluate
-        if control_variate2:
-            server_model_state_dict, control_variate, control_variate2 = aggregator.aggregate(server_model_state_dict,
-                                                    control_variate, selected_state_dicts, updated_control_variates)
-        elif control_variate:
-            server_model_state_dict, control_variate = aggregator.aggregate(server_model_state_dict,
-                                        control_variate, selected_state_dicts, updated_control_variates)
+            selected_state_dicts = verify(updated_clients,
+                        [update[0] for update in updates], save_dir_path, threshold=verification_threshold)
+            print(f"\nAggregating {len(selected_state_dicts)}/{len(updates)} clients above threshold")
+            aggregation_start = time.perf_counter()
+            for update in updates:
+                if any(update[0] is state_dict for state_dict in selected_state_dicts):
+                    aggregator.accumulate(update)
+            aggregation_time += time.perf_counter() - aggregation_start
+            del updates, selected_state_dicts
+
+        #aggregate model, save it, then send to some client to evaluate
+        aggregation_start = time.perf_counter()
+        if aggregator.num_updates():
+            server_model_state_dict, control_variate, control_variate2 = aggregator.finalize()
         else:
-            server_model_state_dict = aggregator.aggregate(server_model_state_dict,selected_state_dicts)
+            print("No client updates to aggregate, keeping the current global model")
+        aggregation_time += time.perf_counter() - aggregation_start
+        print(f"Aggregation time: {aggregation_time:.4f}s")
 
         torch.save(server_model_state_dict, f"{save_dir_path}/round_{round}_aggregated_model.pt")
 
@@ -118,12 +182,19 @@ def server_runner(client_manager, configurations):
         print("Evaluating on server test set...")
         eval_result = server_eval(server_model_state_dict, configurations)
         eval_result["round"] = round
+        eval_result["aggregation_time"] = aggregation_time
+        eval_result["training_time"] = training_time
+        eval_result["cut_clients"] = cut_clients
+        eval_result["upload_bytes"] = upload_bytes
+        eval_result["upload_compression_ratio"] = upload_raw_bytes / upload_bytes if upload_bytes else 1.0
+        eval_result.update(client_manager.payload_cache.stats())
         print("Eval results: ", eval_result)
         #store the results
         with open(f"{save_dir_path}/FL_results.txt", "a", encoding='UTF-8') as file:
             file.write( str(eval_result) + "\n" )
 
     #sync all connected clients with current global model and order them to disconnect
+    client_manager.payload_cache.new_round()
     for client in client_manager.random_select():
         client.set_parameters(server_model_state_dict)
         client.disconnect()
@@ -131,9 +202,71 @@ def server_runner(client_manager, configurations):
     print("Server runner stopped.")
 
 
+#trains the given clients and yields (client, result) as soon as each one replies.
+#the round is cut once a quorum (fraction) of the clients has replied or round_deadline seconds have passed,
+#the clients that are left are then yielded with a result of None and their late updates are discarded.
+#result is also None for a client that did not reply within client_timeout (grpc.aio mode only)
+def train_clients(clients, train_args, loop = None, client_timeout = None, round_deadline = None, quorum = 1.0):
+    results = Queue()
+    if loop is None:
+        def train_client(client):
+            try:
+                result = client.train(*train_args)
+            except Exception as error:
+                result = error
+            results.put((client, result))
+
+        executor = futures.ThreadPoolExecutor(max_workers=5)
+        submitted = [executor.submit(train_client, client) for client in clients]
+    else:
+        training = asyncio.run_coroutine_threadsafe(gather_training(clients, train_args, results, client_timeout), loop)
+
+    deadline = time.perf_counter() + round_deadline if round_deadline else None
+    pending = list(clients)
+    replies_needed = ceil(quorum * len(clients))
+    try:
+        while pending and len(clients) - len(pending) < replies_needed:
+            try:
+                client, result = results.get(timeout = None if deadline is None else max(0, deadline - time.perf_counter()))
+            except Empty:
+                break
+            if isinstance(result, Exception):
+                raise result
+            pending.remove(client)
+            yield client, result
+    finally:
+        #clients that have not started are dropped, those still training finish on their own and their
+        #reply is read by their next order (see ClientWrapper.lock and AsyncClientWrapper.drain)
+        if loop is None:
+            for future in submitted:
+                future.cancel()
+            executor.shutdown(wait = False)
+        else:
+            training.cancel()
+    for client in pending:
+        yield client, None
+
+#runs on the event loop of the grpc.aio server: all clients train concurrently as coroutines and
+#each result is handed back to server_runner through results as soon as it arrives
+async def gather_training(clients, train_args, results, client_timeout):
+    async def train_client(client):
+        try:
+            result = await asyncio.wait_for(client.async_client.train(*train_args), client_timeout)
+        except asyncio.TimeoutError:
+            result = None
+        except Exception as error:
+            result = error
+        results.put((client, result))
+
+    await asyncio.gather(*(train_client(client) for client in clients))
+
 #starts the gRPC server and then runs server_runner concurrently
 def server_start(configurations):
-    client_manager = ClientManager()
+    if configurations.get("server_mode", "threaded") == "aio":
+        asyncio.run(aio_server_start(configurations))
+        return
+
+    client_manager = ClientManager(configurations.get("chunk_size"), configurations.get("model_versions", 3))
     client_connection_servicer = ClientConnectionServicer(client_manager)
 
     channel_opt = [('grpc.max_send_message_length', -1), ('grpc.max_receive_message_length', -1)]
@@ -147,3 +280,22 @@ def server_start(configurations):
     server_runner_thread.join()
 
     server.stop(None)
+
+
+#grpc.aio variant of server_start. connected clients are coroutines on a single event loop instead of
+#threads, server_runner keeps running in its own thread and hands client orders over to the loop
+async def aio_server_start(configurations):
+    client_manager = ClientManager(configurations.get("chunk_size"), configurations.get("model_versions", 3))
+    client_connection_servicer = AsyncClientConnectionServicer(client_manager)
+
+    channel_opt = [('grpc.max_send_message_length', -1), ('grpc.max_receive_message_length', -1)]
+    server = grpc.aio.server(options=channel_opt)
+    ClientConnection_pb2_grpc.add_ClientConnectionServicer_to_server( client_connection_servicer, server )
+    server.add_insecure_port('localhost:8214')
+    await server.start()
+
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, server_runner, client_manager, configurations, loop)
+
+    #give the clients a moment to receive their disconnect order and close their streams
+    await server.stop(5)
@@ -1,13 +1,31 @@
 import torch
-from ..server_lib import load_data, get_net, test_model
+from ..server_lib import load_data, get_net, compile_net, test_model
+
+#settings of the configuration the test loader depends on
+LOADER_SETTINGS = ('dataset', 'resize_size', 'batch_size', 'dataset_cache', 'prefetch',
+                   'num_workers', 'persistent_workers', 'pin_memory', 'prefetch_factor')
+#the test loader is built once and reused in every round, with its worker processes
+_loader_key, _testloader = None, None
+#so is the network, compiled once with --compile
+_model_key, _model = None, None
 
 def server_eval(model_state_dict, config):
+    global _loader_key, _testloader, _model_key, _model
     device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-    testloader, _ = load_data(config)
-    model = get_net(config)
-    model = model.to(device)
+    loader_key = tuple(config.get(setting) for setting in LOADER_SETTINGS)
+    if loader_key != _loader_key:
+        _testloader, _ = load_data(config)
+        _loader_key = loader_key
+    testloader = _testloader
+    model_key = (config['net'], config['dataset'], config.get('compile', 0))
+    if model_key != _model_key:
+        _model = get_net(config).to(device)
+        if config.get('compile', 0):
+            _model = compile_net(_model)
+        _model_key = model_key
+    model = _model
     model.load_state_dict(model_state_dict)
 
-    eval_loss, eval_accuracy = test_model(model, testloader)
+    eval_loss, eval_accuracy = test_model(model, testloader, config.get('precision', 'fp32'))
     eval_results = {"eval_loss": eval_loss, "eval_accuracy": eval_accuracy}
     return eval_results
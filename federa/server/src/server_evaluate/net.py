@@ -21,7 +21,7 @@ class LeNet(nn.Module):
         x = self.conv2(x)
         x = self.relu(x)
         x = self.pool2(x)
-        x = x.view(-1, 400)
+        x = x.reshape(-1, 400)
         x = self.fc1(x)
         x = self.relu(x)
         x = self.fc2(x)
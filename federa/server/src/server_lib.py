@@ -8,13 +8,27 @@ from torchvision import models
 from torch.utils import data
 import numpy as np
 from PIL import Image
+from .dataset_cache import cached_dataset, array_dataset, as_nchw, collate, Batch
+from .packed_dataset import open_packed, PrefetchDataLoader
 
 device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
 #serverlib and eval_lib should be on the same device
 
+#DataLoader arguments of the loader settings of the configuration, as on the clients
+def loader_options(config):
+    options = {"collate_fn": collate, "num_workers": config.get('num_workers', 0),
+               "pin_memory": bool(config.get('pin_memory', 0)) and torch.cuda.is_available()}
+    if options["num_workers"]:
+        options["persistent_workers"] = bool(config.get('persistent_workers', 1))
+        options["prefetch_factor"] = config.get('prefetch_factor', 2)
+    return options
+
 def load_data(config):
     testset = get_data(config)
-    testloader = DataLoader(testset, batch_size=config['batch_size'])
+    #CUSTOM samples are transformed one by one, the next batch can be prepared in the background
+    prefetch = config['dataset'] == 'CUSTOM' and config.get('prefetch', 0)
+    testloader = (PrefetchDataLoader if prefetch else DataLoader)(testset, batch_size=config['batch_size'],
+                                                                  **loader_options(config))
     num_examples = {"testset": len(testset)}
     return testloader, num_examples
 
@@ -23,45 +37,52 @@ def get_data(config):
     dataset_path="./server_dataset"
     if not os.path.exists(dataset_path):
         os.makedirs(dataset_path)
-    if config['dataset'] == 'MNIST':
-        apply_transform = transforms.Compose([transforms.Resize(config['resize_size']), transforms.ToTensor()])
-        testset = datasets.MNIST(root='./server_dataset/MNIST',
-                                train=False, download=True, transform=apply_transform)
-    if config['dataset'] == 'FashionMNIST':
-        apply_transform = transforms.Compose([transforms.Resize(config['resize_size']), transforms.ToTensor()])
-        testset = datasets.FashionMNIST(root='./server_dataset/FashionMNIST',
-                                        train=False, download=True, transform=apply_transform)
-
-    if config['dataset'] == 'CIFAR10':
-        apply_transform = transforms.Compose([transforms.Resize(config['resize_size']), transforms.ToTensor()])
-        testset = datasets.CIFAR10(root='./server_dataset/CIFAR10',
-                                   train=False, download=True, transform=apply_transform)
-
-    if config['dataset'] == 'CIFAR100':
-        apply_transform = transforms.Compose([transforms.Resize(config['resize_size']), transforms.ToTensor()])
-        testset = datasets.CIFAR100(root='./server_dataset/CIFAR100',
-                                    train=False, download=True, transform=apply_transform)
-
+    builtin_datasets = {'MNIST': datasets.MNIST, 'FashionMNIST': datasets.FashionMNIST,
+                        'CIFAR10': datasets.CIFAR10, 'CIFAR100': datasets.CIFAR100}
+    #images are resized batch by batch after collation, or once into a memory-mapped cache, see dataset_cache.py
+    if config['dataset'] in builtin_datasets:
+        load = cached_dataset if config.get('dataset_cache', 1) else array_dataset
+        return load(builtin_datasets[config['dataset']], f"./server_dataset/{config['dataset']}",
+                    False, config['resize_size'])
     if config['dataset'] == 'CUSTOM':
         apply_transform = transforms.Compose([transforms.Resize(config['resize_size']), transforms.ToTensor()])
-        testset = customDataset(root='./server_custom_dataset/CUSTOM/test', transform=apply_transform)
+        #packed into memory-mapped shards on first use, see packed_dataset.py, and resized batch by batch
+        #after collation when its images allow it
+        testset = customDataset(root='./server_custom_dataset/CUSTOM/test', transform=apply_transform,
+                                packed=config.get('dataset_cache', 1), resize_size=config['resize_size'])
 
     return testset
 
 class customDataset(data.Dataset):
-    def __init__(self, root, transform=None):
+    #with resize_size, packed uint8 images of one shape are served as whole batches resized after collation,
+    #transform is then left unused
+    def __init__(self, root, transform=None, packed=True, resize_size=None):
 
         self.root = root
-        samples = sample_return(root)
+        if packed:
+            self.shards = open_packed(root, sample_return)
+            self.samples = None
+            self.targets = self.shards.labels
+        else:
+            self.shards = None
+            samples = sample_return(root)
 
-        self.samples = samples
+            self.samples = samples
+            self.targets = np.array([label for _, label in samples], dtype=np.int64)
 
         self.transform = transform
+        self.resize_size = resize_size if self.shards is not None and batchable(self.shards) else None
 
     def __getitem__(self, index):
-        img, label= self.samples[index]
+        if self.resize_size is not None:
+            images, labels = collate(self.__getitems__([index]))
+            return images[0], int(labels[0])
+        if self.shards is not None:
+            img, label = self.shards.array(index), int(self.targets[index])
+        else:
+            img, label= self.samples[index]
 
-        img = np.load(img)
+            img = np.load(img)
 
         img = Image.fromarray(img)
 
@@ -71,8 +92,22 @@ class customDataset(data.Dataset):
 
         return img, label
 
+    def __getitems__(self, indices):
+        if self.resize_size is None:
+            return [self[index] for index in indices]
+        indices = np.asarray(indices)
+        images = torch.from_numpy(np.ascontiguousarray(as_nchw(self.shards.stack(indices))))
+        return Batch(images, torch.from_numpy(self.targets[indices]), self.resize_size)
+
     def __len__(self):
-        return len(self.samples)
+        return len(self.targets)
+
+#whether packed samples are uint8 grayscale, RGB or RGBA images of one shape, which can be resized as a batch
+#the way PIL resizes them one by one
+def batchable(shards):
+    if shards.shape is None or shards.dtype != np.uint8:
+        return False
+    return len(shards.shape) == 2 or (len(shards.shape) == 3 and shards.shape[2] in (3, 4))
 
 def sample_return(root):
     newdataset = []
@@ -110,7 +145,7 @@ class LeNet(nn.Module):
         x = self.conv2(x)
         x = self.relu(x)
         x = self.pool2(x)
-        x = x.view(-1, 400)
+        x = x.reshape(-1, 400)
         x = self.fc1(x)
         x = self.relu(x)
         x = self.fc2(x)
@@ -157,6 +192,15 @@ def get_net(config):
             net = models.alexnet(num_classes=100)
     return net
 
+#--compile: the network runs with channels_last weights and a forward compiled by torch.compile. only its
+#forward is replaced, so it stays the same module with the parameters and state_dict keys of the eager network
+#(torch.compile(net) would wrap it), and the compiled graphs are built on its first batches and kept for as
+#long as the network is
+def compile_net(net):
+    net = net.to(memory_format=torch.channels_last)
+    net.forward = torch.compile(net.forward)
+    return net
+
 def train_model(net, trainloader):
     criterion = torch.nn.CrossEntropyLoss()
     optimizer = torch.optim.SGD(net.parameters(), lr=0.001, momentum=0.9)
@@ -170,15 +214,17 @@ def train_model(net, trainloader):
     optimizer.step()
     return net
 
-def test_model(net, testloader):
+#with precision "bf16" (--precision) the network runs under autocast to bfloat16
+def test_model(net, testloader, precision = "fp32"):
     criterion = torch.nn.CrossEntropyLoss()
     correct, total, loss = 0, 0, 0.0
     net.eval()
-    with torch.no_grad():
+    with torch.inference_mode():
         for images, labels in tqdm(testloader) :
             images, labels = images.to(device), labels.to(device)
-            outputs = net(images)
-            loss += criterion(outputs, labels).item()
+            with torch.autocast(device.type, dtype=torch.bfloat16, enabled=precision == "bf16"):
+                outputs = net(images)
+                loss += criterion(outputs, labels).item()
             _, predicted = torch.max(outputs.data, 1)
             total += labels.size(0)
             correct += (predicted == labels).sum().item()
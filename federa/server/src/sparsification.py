@@ -0,0 +1,60 @@
+from math import ceil
+import torch
+
+#Sparsification of the updates clients upload.
+#
+#A sparse tensor is a dict {"indices", "values", "shape"} holding the flat positions (int32) and values of
+#the entries that were kept, either the topk fraction of largest magnitude or those at least threshold
+#in magnitude. Floating point tensors of a model are sparsified as their difference with the global model
+#the client trained from, unless the algorithm already uploads differences. Other tensors (integer buffers)
+#are sent unchanged.
+#What is left out is not lost: the client keeps it as a residual and adds it to its next update
+#(error feedback), so small but steady changes still reach the server after a few rounds.
+#This module is kept identical on the client and on the server.
+
+def is_sparse(node):
+    return isinstance(node, dict) and "indices" in node
+
+def sparsify(tensor, topk, threshold):
+    flat = tensor.reshape(-1)
+    if topk:
+        k = max(1, ceil(topk * flat.numel()))
+        indices = flat.abs().topk(min(k, flat.numel()), sorted=False).indices
+    else:
+        indices = (flat.abs() >= threshold).nonzero().reshape(-1)
+    return {"indices": indices.to(torch.int32), "values": flat[indices],
+            "shape": torch.tensor(list(tensor.shape), dtype=torch.int64)}
+
+#writes the sparse tensor into out (a float32 tensor with as many elements) when it is given
+def densify(node, out=None):
+    shape = torch.Size(node["shape"].tolist())
+    if out is None:
+        out = torch.empty(shape, dtype=torch.float32)
+    out.zero_().view(-1)[node["indices"].to(torch.int64)] = node["values"]
+    return out.view(shape)
+
+#sparsifies a trained state dict as its difference with base_state_dict, the model it was trained from.
+#a base_state_dict of None sparsifies the tensors as they are.
+#residual holds what earlier uploads left out, it is added to the update and replaced by what this one leaves out
+def sparsify_update(state_dict, base_state_dict, residual, topk, threshold):
+    sparse = {}
+    for key, tensor in state_dict.items():
+        if not tensor.is_floating_point() or tensor.numel() == 0:
+            sparse[key] = tensor
+            continue
+        update = tensor.detach().to(device="cpu", dtype=torch.float32, copy=True)
+        if base_state_dict is not None:
+            update.sub_(base_state_dict[key].to(torch.float32))
+        if key in residual and residual[key].shape == update.shape:
+            update.add_(residual[key])
+        sparse[key] = sparsify(update, topk, threshold)
+        update.view(-1)[sparse[key]["indices"].to(torch.int64)] = 0
+        residual[key] = update
+    return sparse
+
+#inverse of sparsify_update, for the code that needs the trained state dict itself
+def densify_update(state_dict, base_state_dict):
+    if base_state_dict is None:
+        return {key: densify(tensor) if is_sparse(tensor) else tensor for key, tensor in state_dict.items()}
+    return {key: (base_state_dict[key] + densify(tensor)).to(base_state_dict[key].dtype)
+            if is_sparse(tensor) else tensor for key, tensor in state_dict.items()}
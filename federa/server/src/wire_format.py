@@ -0,0 +1,194 @@
+import json
+import struct
+import warnings
+import torch
+
+#Framed tensor format used for every model payload exchanged with the clients.
+#
+#   MAGIC | header length (uint64, little endian) | JSON header | padding | raw tensor data
+#
+#The header describes the payload tree: dicts and lists of tensors (or None), where every tensor
+#leaf records its dtype, shape and byte offset into the data section. Every offset is aligned to
+#ALIGNMENT bytes, so on receive each tensor is a torch.frombuffer view of the message bytes, decoded
+#without copies and without running the unpickler on data coming from the network.
+#This module is kept identical on the client and on the server.
+
+MAGIC = b"FLTW"
+ALIGNMENT = 64
+_HEADER_LENGTH = struct.Struct("<Q")
+_PADDING = bytes(ALIGNMENT)
+
+#dtypes a payload may hold, by the name its header gives them. the header comes from the network, so
+#only these names are accepted
+_DTYPES = {str(dtype).replace("torch.", ""): dtype for dtype in
+           (torch.float64, torch.float32, torch.float16, torch.bfloat16, torch.complex64, torch.complex128,
+            torch.int64, torch.int32, torch.int16, torch.int8, torch.uint8, torch.bool)}
+_ITEM_SIZES = {name: torch.empty((), dtype=dtype).element_size() for name, dtype in _DTYPES.items()}
+
+def _dtype_name(dtype):
+    name = str(dtype).replace("torch.", "")
+    if name not in _DTYPES:
+        raise TypeError(f"Cannot encode {dtype} tensors in a model payload")
+    return name
+
+def _check_dtype(name):
+    if name not in _DTYPES:
+        raise ValueError(f"Model payload holds tensors of unknown dtype {name!r}")
+    return name
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+#builds the header node of a payload tree and collects its tensors in order
+def _describe(node, tensors, offset):
+    if node is None:
+        return None, offset
+    if isinstance(node, torch.Tensor):
+        tensor = node.detach().to("cpu").contiguous()
+        tensors.append((offset, tensor))
+        description = ["t", _dtype_name(tensor.dtype), list(tensor.shape), offset]
+        return description, _aligned(offset + tensor.numel() * tensor.element_size())
+    if isinstance(node, dict):
+        keys, children = [], []
+        for key, child in node.items():
+            child_description, offset = _describe(child, tensors, offset)
+            keys.append(key)
+            children.append(child_description)
+        return ["d", keys, children], offset
+    if isinstance(node, (list, tuple)):
+        children = []
+        for child in node:
+            child_description, offset = _describe(child, tensors, offset)
+            children.append(child_description)
+        return ["l", children], offset
+    raise TypeError(f"Cannot encode {type(node).__name__} in a model payload")
+
+#splits a payload tree into the parts of its frame: the prefix (magic, header and padding) followed by
+#the raw bytes of every tensor and the padding between them. the parts are not copied
+def _frame(payload):
+    tensors = []
+    tree, data_length = _describe(payload, tensors, 0)
+    header = json.dumps(tree).encode("utf-8")
+    data_start = _aligned(len(MAGIC) + _HEADER_LENGTH.size + len(header))
+
+    parts = [MAGIC + _HEADER_LENGTH.pack(len(header)) + header
+             + _PADDING[:data_start - len(MAGIC) - _HEADER_LENGTH.size - len(header)]]
+    written = 0
+    for offset, tensor in tensors:
+        parts.append(_PADDING[:offset - written])
+        #raw bytes of the tensor, whatever its dtype
+        raw = tensor.reshape(-1).view(torch.uint8).numpy()
+        parts.append(raw)
+        written = offset + raw.nbytes
+    parts.append(_PADDING[:data_length - written])
+    return parts
+
+#encodes a payload tree (dicts and lists of tensors, or None) into bytes
+def encode_payload(payload):
+    #a single copy into the final immutable bytes object
+    return b"".join(_frame(payload))
+
+#encodes a payload tree as a sequence of chunks of at most chunk_size bytes, produced lazily so that the
+#whole frame never exists as one bytes object. the first chunk is the prefix (the manifest of the payload),
+#concatenated the chunks are identical to encode_payload(payload)
+def encode_payload_chunks(payload, chunk_size):
+    parts = _frame(payload)
+    yield parts[0]
+    chunk = bytearray()
+    for part in parts[1:]:
+        view = memoryview(part)
+        while len(view):
+            #full chunks of a large tensor are copied only once
+            if not chunk and len(view) >= chunk_size:
+                yield bytes(view[:chunk_size])
+                view = view[chunk_size:]
+                continue
+            taken = chunk_size - len(chunk)
+            chunk += view[:taken]
+            view = view[taken:]
+            if len(chunk) == chunk_size:
+                yield bytes(chunk)
+                chunk = bytearray()
+    if chunk:
+        yield bytes(chunk)
+
+def _build(node, data, data_start):
+    if node is None:
+        return None
+    kind = node[0]
+    if kind == "t":
+        _, dtype, shape, offset = node
+        dtype = _DTYPES[_check_dtype(dtype)]
+        numel = 1
+        for size in shape:
+            numel *= size
+        if numel == 0:
+            return torch.empty(shape, dtype=dtype)
+        return torch.frombuffer(data, dtype=dtype, count=numel, offset=data_start + offset).view(shape)
+    if kind == "d":
+        return {key: _build(child, data, data_start) for key, child in zip(node[1], node[2])}
+    return [_build(child, data, data_start) for child in node[1]]
+
+#decodes bytes produced by encode_payload. tensors are read-only views into data,
+#they have to be copied (e.g. by load_state_dict or clone) before being modified
+def decode_payload(data):
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("Model payload is not in the tensor wire format")
+    (header_length,) = _HEADER_LENGTH.unpack_from(data, len(MAGIC))
+    header_start = len(MAGIC) + _HEADER_LENGTH.size
+    tree = json.loads(bytes(data[header_start:header_start + header_length]).decode("utf-8"))
+    data_start = _aligned(header_start + header_length)
+    with warnings.catch_warnings():
+        #protobuf hands out immutable bytes, torch warns that the views are not writable
+        warnings.simplefilter("ignore", UserWarning)
+        return _build(tree, data, data_start)
+
+#decodes a payload sent with encode_payload_chunks while its chunks are still arriving.
+#as soon as the manifest is in, the tensors are created as views of a single preallocated buffer
+#and every further chunk is copied straight into place, so at most one chunk is held on top of the payload
+class PayloadDecoder:
+    def __init__(self):
+        self.prefix = b""
+        self.data = None
+        self.received = 0
+        self.payload = None
+
+    def feed(self, chunk):
+        if self.data is None:
+            self.prefix += chunk
+            header_start = len(MAGIC) + _HEADER_LENGTH.size
+            if len(self.prefix) < header_start:
+                return
+            if self.prefix[:len(MAGIC)] != MAGIC:
+                raise ValueError("Model payload is not in the tensor wire format")
+            (header_length,) = _HEADER_LENGTH.unpack_from(self.prefix, len(MAGIC))
+            data_start = _aligned(header_start + header_length)
+            if len(self.prefix) < data_start:
+                return
+            tree = json.loads(self.prefix[header_start:header_start + header_length].decode("utf-8"))
+            self.data = bytearray(_data_length(tree))
+            self.payload = _build(tree, self.data, 0)
+            chunk, self.prefix = self.prefix[data_start:], None
+        if self.received + len(chunk) > len(self.data):
+            raise ValueError("Model payload is longer than its manifest")
+        self.data[self.received:self.received + len(chunk)] = chunk
+        self.received += len(chunk)
+
+    #the decoded payload. unlike decode_payload, its tensors are writable
+    def result(self):
+        if self.data is None or self.received != len(self.data):
+            raise ValueError("Model payload is incomplete")
+        return self.payload
+
+#length of the data section described by a header tree
+def _data_length(node):
+    if node is None:
+        return 0
+    if node[0] == "t":
+        _, dtype, shape, offset = node
+        numel = 1
+        for size in shape:
+            numel *= size
+        return _aligned(offset + numel * _ITEM_SIZES[_check_dtype(dtype)])
+    children = node[2] if node[0] == "d" else node[1]
+    return max((_data_length(child) for child in children), default=0)
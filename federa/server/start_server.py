@@ -32,8 +32,78 @@ parser.add_argument('--net', type = str, default = 'LeNet', help= 'client networ
 parser.add_argument('--dataset', type = str, default= 'FashionMNIST',
                      help= 'datsset.Use CUSTOME for local dataset')
 parser.add_argument('--niid', type = int, default= 1, help= 'value should be [1, 5]')
+parser.add_argument('--dataset_cache', type = int, default = 1,
+                     help= '''1 decodes and resizes built-in datasets once into a memory-mapped cache that
+                     whole batches are read from, 0 resizes whole batches each time they are used.
+                     CUSTOM datasets are packed into memory-mapped shards instead of one .npy file per sample''')
+parser.add_argument('--prefetch', type = int, default = 0,
+                     help= '1 prepares the next batch of CUSTOM datasets in a background thread')
+parser.add_argument('--num_workers', type = int, default = 0,
+                     help= '''Worker processes preparing batches on the clients and for server evaluation,
+                     0 prepares them in the training thread''')
+parser.add_argument('--persistent_workers', type = int, default = 1,
+                     help= '1 keeps the worker processes from one round to the next, 0 starts them every epoch')
+parser.add_argument('--pin_memory', type = int, default = 0,
+                     help= '1 puts batches in pinned memory for faster copies to the GPU')
+parser.add_argument('--prefetch_factor', type = int, default = 2,
+                     help= 'Batches prepared ahead by every worker process')
+parser.add_argument('--partition', type = str, default = 'niid', choices = ['niid', 'dirichlet', 'shards', 'classes'],
+                     help= '''How the training set is split among the users. niid uses the niid degree,
+                     dirichlet, shards and classes are vectorized schemes that scale to thousands of users''')
+parser.add_argument('--num_users', type = int, default = 5, help= 'number of users the training set is split among')
+parser.add_argument('--dirichlet_alpha', type = float, default = 0.5,
+                     help= 'concentration of the dirichlet partition, lower is more non-IID')
+parser.add_argument('--shards_per_user', type = int, default = 2, help= 'shards of the shards partition per user')
+parser.add_argument('--classes_per_user', type = int, default = 2, help= 'classes of the classes partition per user')
 parser.add_argument('--carbon', type = int, default= 0,
                      help= '1 enable carbon emission at client')
+parser.add_argument('--server_mode', type = str, default = 'threaded', choices = ['threaded', 'aio'],
+                     help= '''threaded serves every client from a thread pool,
+                     aio serves them as coroutines of a grpc.aio server to scale to many clients''')
+parser.add_argument('--client_timeout', type = float, default = None,
+                     help= '''aio mode only. Seconds the server waits for a client to finish
+                     training before skipping its update''')
+parser.add_argument('--round_deadline', type = float, default = None,
+                     help= '''Seconds after which a round is aggregated with the updates received so far,
+                     the clients that have not replied are cut from the round''')
+parser.add_argument('--quorum', type = float, default = 1.0,
+                     help= '''Fraction of the selected clients whose updates end a round, the others are
+                     cut from it''')
+parser.add_argument('--chunk_size', type = float, default = 0,
+                     help= '''Size in MB of the chunks models are streamed in, both to and from
+                     the clients. 0 sends every model as a single message''')
+parser.add_argument('--model_versions', type = int, default = 3,
+                     help= '''Number of recent global models kept by the server. Clients holding one
+                     of them only download a delta against it. 0 always sends the full model''')
+parser.add_argument('--upload_bits', type = int, default = 0, choices = [0, 4, 8],
+                     help= '''Bits per value of the stochastically quantized updates clients upload.
+                     0 uploads full precision models''')
+parser.add_argument('--upload_granularity', type = str, default = 'tensor', choices = ['tensor', 'channel'],
+                     help= '''Quantize uploads with one scale per tensor or one per output channel''')
+parser.add_argument('--upload_topk', type = float, default = 0,
+                     help= '''Fraction of the values of every tensor clients upload, the largest changes
+                     are sent and the rest is carried over to later rounds. 0 uploads dense models''')
+parser.add_argument('--upload_threshold', type = float, default = 0,
+                     help= '''Used when upload_topk is 0. Clients upload only the changes of at least this
+                     magnitude and carry the rest over to later rounds. 0 uploads dense models''')
+parser.add_argument('--gradient_batch_size', type = int, default = 0,
+                     help= '''Batch size in which mimelite clients accumulate the gradient over their whole
+                     dataset. 0 uses batch_size''')
+parser.add_argument('--compile', type = int, default = 0,
+                     help= '''1 trains and evaluates the networks compiled with torch.compile, with channels_last
+                     weights. Compiling takes a while the first time, then the graphs are reused every round''')
+parser.add_argument('--precision', type = str, default = 'fp32', choices = ['fp32', 'bf16'],
+                     help= '''bf16 runs the forward passes of training and evaluation under autocast to bfloat16,
+                     the weights and the uploaded models stay float32''')
+parser.add_argument('--client_eval', type = str, default = 'full', choices = ['full', 'sampled', 'async', 'off'],
+                     help= '''Evaluation of the trained model clients report with their update: on their whole test
+                     set, on a fixed random subset of it, on the whole test set after the update has been sent
+                     (reported with the next update, the last round is evaluated before it is sent since no
+                     update follows it), or none''')
+parser.add_argument('--client_eval_every', type = int, default = 1,
+                     help= 'Clients evaluate their trained model in the rounds that are a multiple of this')
+parser.add_argument('--client_eval_samples', type = int, default = 1000,
+                     help= 'Size of the test subset of client_eval sampled')
 args = parser.parse_args()
                     
                     
@@ -54,6 +124,33 @@ configurations = {
     "dataset": args.dataset,
     "niid": args.niid,
     "carbon":args.carbon,
+    "dataset_cache": args.dataset_cache,
+    "prefetch": args.prefetch,
+    "num_workers": args.num_workers,
+    "persistent_workers": args.persistent_workers,
+    "pin_memory": args.pin_memory,
+    "prefetch_factor": args.prefetch_factor,
+    "partition": args.partition,
+    "num_users": args.num_users,
+    "dirichlet_alpha": args.dirichlet_alpha,
+    "shards_per_user": args.shards_per_user,
+    "classes_per_user": args.classes_per_user,
+    "server_mode": args.server_mode,
+    "client_timeout": args.client_timeout,
+    "round_deadline": args.round_deadline,
+    "quorum": args.quorum,
+    "chunk_size": int(args.chunk_size * 2**20),
+    "model_versions": args.model_versions,
+    "upload_bits": args.upload_bits,
+    "upload_granularity": args.upload_granularity,
+    "upload_topk": args.upload_topk,
+    "upload_threshold": args.upload_threshold,
+    "gradient_batch_size": args.gradient_batch_size,
+    "compile": args.compile,
+    "precision": args.precision,
+    "client_eval": args.client_eval,
+    "client_eval_every": args.client_eval_every,
+    "client_eval_samples": args.client_eval_samples,
 }
 
                     
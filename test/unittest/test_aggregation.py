@@ -0,0 +1,198 @@
+import unittest
+import os
+import sys
+from collections import OrderedDict
+import torch
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from federa.server.src.algorithms.fedavg import fedavg
+from federa.server.src.algorithms.fedavgm import fedavgm
+from federa.server.src.algorithms.fedadam import fedadam
+from federa.server.src.algorithms.fedadagrad import fedadagrad
+from federa.server.src.algorithms.fedyogi import fedyogi
+from federa.server.src.algorithms.feddyn import feddyn
+from federa.server.src.algorithms.scaffold import scaffold
+from federa.server.src.algorithms.mime import mime
+from federa.server.src.algorithms.mimelite import mimelite
+
+NUM_CLIENTS = 3
+NUM_ROUNDS = 3
+
+
+def random_state_dict(generator):
+    return OrderedDict([("conv.weight", torch.randn(4, 3, 3, 3, generator=generator)),
+                        ("conv.bias", torch.randn(4, generator=generator)),
+                        ("fc.weight", torch.randn(10, 36, generator=generator)),
+                        ("fc.bias", torch.randn(10, generator=generator))])
+
+
+def mean(tensors):
+    return sum(tensors[1:], tensors[0]) / len(tensors)
+
+
+def key_mean(state_dicts):
+    return OrderedDict((key, mean([state_dict[key] for state_dict in state_dicts])) for key in state_dicts[0])
+
+
+def list_mean(tensor_lists):
+    return [mean(list(tensors)) for tensors in zip(*tensor_lists)]
+
+
+class Reference:
+    """ Per-key aggregation, one tensor operation per key as the algorithms did before
+    the flat aggregator. aggregate takes the server state of a round and every client
+    update and returns what finalize should.
+    """
+
+    def __init__(self, algorithm):
+        self.algorithm = algorithm
+        self.state = {}
+        self.timestep = 1
+
+    def zeros(self, name, server_state_dict):
+        if name not in self.state:
+            self.state[name] = OrderedDict((key, torch.zeros_like(tensor)) for key, tensor in server_state_dict.items())
+        return self.state[name]
+
+    def aggregate(self, server_state_dict, control_variate, control_variate2, updates):
+        state_dicts = [update[0] for update in updates]
+        control_variates = [update[1] for update in updates]
+        server = OrderedDict((key, tensor.clone()) for key, tensor in server_state_dict.items())
+        if self.algorithm == "fedavg":
+            return key_mean(state_dicts), None, None
+        if self.algorithm == "fedavgm":
+            avg_delta_y = key_mean(state_dicts)
+            velocity = self.zeros("velocity", server)
+            for key in server:
+                velocity[key] = 0.9 * velocity[key] + avg_delta_y[key]
+                server[key] += avg_delta_y[key] + 0.9 * velocity[key]
+            return server, None, None
+        if self.algorithm in ("fedadam", "fedyogi"):
+            avg_delta_y = key_mean(state_dicts)
+            m, v = self.zeros("m", server), self.zeros("v", server)
+            for key in server:
+                square = torch.square(avg_delta_y[key])
+                m[key] = 0.9 * m[key] + 0.1 * avg_delta_y[key]
+                if self.algorithm == "fedadam":
+                    v[key] = 0.999 * v[key] + (1 - 0.999) * square
+                else:
+                    v[key] = v[key] + (1 - 0.999) * torch.sign(square - v[key]) * square
+                m_bias_corr = m[key] / (1 - 0.9**self.timestep)
+                v_bias_corr = v[key] / (1 - 0.999**self.timestep)
+                server[key] += 0.01 * m_bias_corr / (torch.sqrt(v_bias_corr) + 1e-6)
+            self.timestep += 1
+            return server, None, None
+        if self.algorithm == "fedadagrad":
+            avg_delta_y = key_mean(state_dicts)
+            state = self.zeros("state", server)
+            for key in server:
+                state[key] = state[key] + torch.square(avg_delta_y[key])
+                server[key] += 0.01 * avg_delta_y[key] / torch.sqrt(state[key] + 1e-6)
+            return server, None, None
+        if self.algorithm == "feddyn":
+            h = self.zeros("h", server)
+            for key in server:
+                sum_y = sum(state_dict[key] for state_dict in state_dicts)
+                h[key] = h[key] - 0.01 / len(state_dicts) * (sum_y - server[key])
+                server[key] = sum_y / len(state_dicts) - h[key] / 0.01
+            return server, None, None
+        if self.algorithm == "scaffold":
+            delta_x = key_mean(state_dicts)
+            delta_c = list_mean(control_variates)
+            for key in server:
+                server[key] += delta_x[key]
+            return server, [c + 1.0 * d for c, d in zip(control_variate, delta_c)], None
+        #mime and mimelite: control_variate is the optimizer state, the clients upload gradients
+        avg_grads = list_mean(control_variates)
+        optimizer_state = [0.9 * state + 0.1 * grad for state, grad in zip(control_variate, avg_grads)]
+        return key_mean(state_dicts), optimizer_state, avg_grads if self.algorithm == "mime" else None
+
+
+def create_aggregation_test(algorithm_class, with_control_variate=False):
+    """ Verify that the flat aggregator of an algorithm, fed one client update at a time,
+    gives the same model and control variates as the per-key reference over a few rounds.
+    """
+
+    class AggregationTest(unittest.TestCase):
+        def test_matches_reference(self):
+            generator = torch.Generator().manual_seed(0)
+            aggregator = algorithm_class({"fraction_of_clients": 1.0})
+            reference = Reference(algorithm_class.__name__)
+            server_state_dict = random_state_dict(generator)
+            control_variate = [torch.zeros_like(tensor) for tensor in server_state_dict.values()] \
+                if with_control_variate else None
+            control_variate2 = None
+            for _ in range(NUM_ROUNDS):
+                updates = [(random_state_dict(generator),
+                            list(random_state_dict(generator).values()) if with_control_variate else None)
+                           for _ in range(NUM_CLIENTS)]
+                expected = reference.aggregate(server_state_dict, control_variate, control_variate2, updates)
+
+                aggregator.begin_round(server_state_dict, control_variate, control_variate2)
+                for update in updates:
+                    aggregator.accumulate(update)
+                self.assertEqual(aggregator.num_updates(), NUM_CLIENTS)
+                server_state_dict, control_variate, control_variate2 = aggregator.finalize()
+
+                self.assertEqual(list(server_state_dict), list(expected[0]))
+                for key in server_state_dict:
+                    torch.testing.assert_close(server_state_dict[key], expected[0][key])
+                for tensors, expected_tensors in zip((control_variate, control_variate2), expected[1:]):
+                    if expected_tensors is None:
+                        self.assertIsNone(tensors)
+                        continue
+                    for tensor, expected_tensor in zip(tensors, expected_tensors):
+                        torch.testing.assert_close(tensor, expected_tensor)
+
+    return AggregationTest
+
+
+class TestAggregation_fedavg(create_aggregation_test(fedavg)):
+    'Aggregation test case for fedavg'
+
+
+class TestAggregation_fedavgm(create_aggregation_test(fedavgm)):
+    'Aggregation test case for fedavgm'
+
+    def test_first_velocity_is_the_average_update(self):
+        #the velocity starts from zero, the first one is the average update and not an alias of it
+        #that the nesterov step modifies
+        aggregator = fedavgm({})
+        server_state_dict = OrderedDict([("weight", torch.zeros(3))])
+        aggregator.begin_round(server_state_dict)
+        aggregator.accumulate((OrderedDict([("weight", torch.tensor([1.0, 2.0, 3.0]))]), None))
+        aggregator.accumulate((OrderedDict([("weight", torch.tensor([3.0, 2.0, 1.0]))]), None))
+        new_state_dict, _, _ = aggregator.finalize()
+        torch.testing.assert_close(aggregator.velocity, torch.full((3,), 2.0))
+        torch.testing.assert_close(new_state_dict["weight"], torch.full((3,), 2.0 + 0.9 * 2.0))
+
+
+class TestAggregation_fedadam(create_aggregation_test(fedadam)):
+    'Aggregation test case for fedadam'
+
+
+class TestAggregation_fedadagrad(create_aggregation_test(fedadagrad)):
+    'Aggregation test case for fedadagrad'
+
+
+class TestAggregation_fedyogi(create_aggregation_test(fedyogi)):
+    'Aggregation test case for fedyogi'
+
+
+class TestAggregation_feddyn(create_aggregation_test(feddyn)):
+    'Aggregation test case for feddyn'
+
+
+class TestAggregation_scaffold(create_aggregation_test(scaffold, with_control_variate=True)):
+    'Aggregation test case for scaffold'
+
+
+class TestAggregation_mime(create_aggregation_test(mime, with_control_variate=True)):
+    'Aggregation test case for mime'
+
+
+class TestAggregation_mimelite(create_aggregation_test(mimelite, with_control_variate=True)):
+    'Aggregation test case for mimelite'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+import os
+import sys
+import tempfile
+import torch
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from federa.client.src.client_lib import ClientSession
+
+DEVICE = torch.device("cpu")
+
+
+class TestFedDynState(unittest.TestCase):
+    """ Verify that the FedDyn state of a client_id is kept in its own file, used by one
+    client at a time, and picked up again by the next client with that client_id.
+    """
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+        os.makedirs("client_checkpoints")
+        self.model = torch.nn.Linear(3, 2)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def test_same_client_id_is_refused(self):
+        session = ClientSession(DEVICE, client_id = 1)
+        session.get_feddyn_state(self.model)
+        with self.assertRaises(RuntimeError):
+            ClientSession(DEVICE, client_id = 1).get_feddyn_state(self.model)
+        #other client ids have their own file
+        ClientSession(DEVICE, client_id = 2).get_feddyn_state(self.model).add_(1)
+        session.feddyn_lock.close()
+
+    def test_restarted_client_picks_up_its_state(self):
+        session = ClientSession(DEVICE, client_id = 1)
+        state = session.get_feddyn_state(self.model)
+        self.assertTrue(torch.equal(state, torch.zeros(8)))
+        session.set_feddyn_state(torch.arange(8.0))
+        #the lock goes away with the client
+        session.feddyn_lock.close()
+        restarted = ClientSession(DEVICE, client_id = 1)
+        self.assertTrue(torch.equal(restarted.get_feddyn_state(self.model), torch.arange(8.0)))
+        restarted.feddyn_lock.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import unittest
+import os
+import sys
+from collections import OrderedDict
+import torch
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from federa.client.src.quantization import quantize, quantize_update, quantize_tensors
+from federa.client.src.wire_format import encode_payload
+from federa.client.src.sparsification import sparsify, sparsify_update
+from federa.server.src.quantization import dequantize, dequantize_update, dequantize_tensors
+from federa.server.src.sparsification import densify, densify_update
+from federa.server.src.wire_format import decode_payload
+from federa.server.src.algorithms.fedavg import fedavg
+from federa.server.src.algorithms.fedadam import fedadam
+from federa.server.src.algorithms.scaffold import scaffold
+
+NUM_CLIENTS = 3
+
+
+def random_state_dict(generator, scale=1.0):
+    return OrderedDict([("conv.weight", scale * torch.randn(8, 3, 3, 3, generator=generator)),
+                        ("conv.bias", scale * torch.randn(8, generator=generator)),
+                        ("bn.num_batches_tracked", torch.tensor(5)),
+                        ("fc.weight", scale * torch.randn(10, 72, generator=generator))])
+
+
+#sends an upload through the wire format, as it reaches the server
+def upload(payload):
+    return decode_payload(encode_payload(payload))
+
+
+def aggregate(aggregator, server_state_dict, control_variate, updates):
+    aggregator.begin_round(server_state_dict, control_variate)
+    for update in updates:
+        aggregator.accumulate(update)
+    return aggregator.finalize()
+
+
+def assert_same_aggregate(result, expected):
+    for key in expected[0]:
+        torch.testing.assert_close(result[0][key], expected[0][key])
+    if expected[1] is not None:
+        for tensor, expected_tensor in zip(result[1], expected[1]):
+            torch.testing.assert_close(tensor, expected_tensor)
+
+
+class TestQuantization(unittest.TestCase):
+    """ Verify that quantized tensors are restored within one quantization level, without
+    bias, and that aggregating quantized uploads gives the same model as aggregating the
+    uploads they dequantize to.
+    """
+
+    def test_error_within_one_level(self):
+        generator = torch.Generator().manual_seed(0)
+        tensor = torch.randn(16, 3, 5, 5, generator=generator)
+        for bits in (8, 4):
+            for per_channel in (False, True):
+                node = quantize(tensor, bits, per_channel)
+                rows = node["scale"].numel()
+                self.assertEqual(rows, 16 if per_channel else 1)
+                error = (dequantize(node) - tensor).abs().reshape(rows, -1)
+                self.assertTrue(bool((error <= node["scale"].unsqueeze(1) * 1.0001).all()))
+
+    def test_constant_tensors_are_exact(self):
+        tensor = torch.full((4, 5), 0.25)
+        self.assertTrue(torch.equal(dequantize(quantize(tensor, 4, True)), tensor))
+
+    def test_unbiased(self):
+        torch.manual_seed(0)
+        tensor = torch.linspace(-1, 1, 101)
+        node = quantize(tensor, 4, False)
+        average = torch.stack([dequantize(quantize(tensor, 4, False)) for _ in range(400)]).mean(dim=0)
+        self.assertLess((average - tensor).abs().max().item(), node["scale"].item() / 5)
+
+    def test_aggregate_model_uploads(self):
+        #fedavg clients upload their trained model, quantized as its difference with the global model
+        generator = torch.Generator().manual_seed(1)
+        server_state_dict = random_state_dict(generator)
+        trained = [OrderedDict((key, tensor + 0.01 * torch.randn(tensor.shape, generator=generator)
+                                if tensor.is_floating_point() else tensor)
+                               for key, tensor in server_state_dict.items()) for _ in range(NUM_CLIENTS)]
+        for bits, per_channel in ((8, False), (4, True)):
+            uploads = [upload(quantize_update(state_dict, server_state_dict, bits, per_channel))
+                       for state_dict in trained]
+            result = aggregate(fedavg({}), server_state_dict, None, [(update, None) for update in uploads])
+            expected = aggregate(fedavg({}), server_state_dict, None,
+                                 [(dequantize_update(update, server_state_dict), None) for update in uploads])
+            assert_same_aggregate(result, expected)
+
+    def test_aggregate_delta_uploads(self):
+        #fedadam and scaffold clients upload differences, they are quantized as they are
+        generator = torch.Generator().manual_seed(2)
+        server_state_dict = random_state_dict(generator)
+        deltas = [random_state_dict(generator, scale=0.01) for _ in range(NUM_CLIENTS)]
+        uploads = [upload(quantize_update(delta, None, 8, True)) for delta in deltas]
+        result = aggregate(fedadam({}), server_state_dict, None, [(update, None) for update in uploads])
+        expected = aggregate(fedadam({}), server_state_dict, None,
+                             [(dequantize_update(update, None), None) for update in uploads])
+        assert_same_aggregate(result, expected)
+
+        control_variate = [torch.zeros_like(tensor) for tensor in server_state_dict.values()]
+        updated_control_variates = [upload(quantize_tensors(list(random_state_dict(generator).values()), 8, True))
+                                    for _ in range(NUM_CLIENTS)]
+        config = {"fraction_of_clients": 1.0}
+        result = aggregate(scaffold(config), server_state_dict, control_variate,
+                           list(zip(uploads, updated_control_variates)))
+        expected = aggregate(scaffold(config), server_state_dict, control_variate,
+                             [(dequantize_update(update, None), dequantize_tensors(updated_control_variate))
+                              for update, updated_control_variate in zip(uploads, updated_control_variates)])
+        assert_same_aggregate(result, expected)
+
+
+class TestSparsification(unittest.TestCase):
+    """ Verify that sparse uploads keep the right entries, that what they leave out is
+    carried over in the residual, and that aggregating them gives the same model as
+    aggregating the uploads they densify to.
+    """
+
+    def test_topk_and_threshold(self):
+        tensor = torch.tensor([[0.5, -3.0, 0.1], [2.0, -0.2, 1.0]])
+        self.assertEqual(sorted(sparsify(tensor, 0.3, 0)["indices"].tolist()), [1, 3])
+        self.assertEqual(sorted(sparsify(tensor, 0, 1.0)["indices"].tolist()), [1, 3, 5])
+        dense = densify(sparsify(tensor, 0, 1.0))
+        self.assertTrue(torch.equal(dense, torch.tensor([[0.0, -3.0, 0.0], [2.0, 0.0, 1.0]])))
+
+    def test_error_feedback(self):
+        #what an upload leaves out is added to the next one, so the uploads sum up to the updates
+        generator = torch.Generator().manual_seed(3)
+        base = random_state_dict(generator)
+        residual = {}
+        sent = OrderedDict((key, torch.zeros_like(tensor, dtype=torch.float32)) for key, tensor in base.items())
+        total = OrderedDict((key, torch.zeros_like(tensor, dtype=torch.float32)) for key, tensor in base.items())
+        for _ in range(3):
+            trained = OrderedDict((key, tensor + 0.01 * torch.randn(tensor.shape, generator=generator)
+                                   if tensor.is_floating_point() else tensor) for key, tensor in base.items())
+            sparse = upload(sparsify_update(trained, base, residual, 0.1, 0))
+            for key, tensor in base.items():
+                if tensor.is_floating_point():
+                    total[key] += trained[key] - tensor
+                    sent[key] += densify(sparse[key])
+                    self.assertLessEqual(sparse[key]["indices"].numel(), 0.1 * tensor.numel() + 1)
+                else:
+                    self.assertTrue(torch.equal(sparse[key], trained[key]))
+        for key, tensor in base.items():
+            if tensor.is_floating_point():
+                torch.testing.assert_close(sent[key] + residual[key], total[key])
+
+    def test_aggregate_model_uploads(self):
+        generator = torch.Generator().manual_seed(4)
+        server_state_dict = random_state_dict(generator)
+        trained = [OrderedDict((key, tensor + 0.01 * torch.randn(tensor.shape, generator=generator)
+                                if tensor.is_floating_point() else tensor)
+                               for key, tensor in server_state_dict.items()) for _ in range(NUM_CLIENTS)]
+        uploads = [upload(sparsify_update(state_dict, server_state_dict, {}, 0.1, 0)) for state_dict in trained]
+        result = aggregate(fedavg({}), server_state_dict, None, [(update, None) for update in uploads])
+        expected = aggregate(fedavg({}), server_state_dict, None,
+                             [(densify_update(update, server_state_dict), None) for update in uploads])
+        assert_same_aggregate(result, expected)
+
+    def test_aggregate_delta_uploads(self):
+        generator = torch.Generator().manual_seed(5)
+        server_state_dict = random_state_dict(generator)
+        deltas = [random_state_dict(generator, scale=0.01) for _ in range(NUM_CLIENTS)]
+        uploads = [upload(sparsify_update(delta, None, {}, 0, 0.01)) for delta in deltas]
+        result = aggregate(fedadam({}), server_state_dict, None, [(update, None) for update in uploads])
+        expected = aggregate(fedadam({}), server_state_dict, None,
+                             [(densify_update(update, None), None) for update in uploads])
+        assert_same_aggregate(result, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
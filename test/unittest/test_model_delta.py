@@ -0,0 +1,90 @@
+import unittest
+import os
+import sys
+from collections import OrderedDict
+import torch
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from federa.server.src.model_delta import encode_delta, delta_size
+from federa.client.src import model_delta as client_model_delta
+from federa.client.src.wire_format import encode_payload, decode_payload
+from federa.client.src.client_lib import GlobalModel
+
+
+def state_dicts():
+    generator = torch.Generator().manual_seed(0)
+    base = OrderedDict([("conv.weight", torch.randn(16, 3, 3, 3, generator=generator)),
+                        ("conv.bias", torch.randn(16, generator=generator)),
+                        ("bn.num_batches_tracked", torch.tensor(10)),
+                        ("half", torch.randn(8, generator=generator).to(torch.bfloat16))])
+    updated = OrderedDict(base)
+    updated["conv.weight"] = base["conv.weight"] + 1e-3 * torch.randn(16, 3, 3, 3, generator=generator)
+    updated["bn.num_batches_tracked"] = torch.tensor(11)
+    updated["half"] = (base["half"].float() * 1.01).to(torch.bfloat16)
+    return base, updated
+
+
+def bitwise_equal(tensor, other):
+    return tensor.dtype == other.dtype and tensor.shape == other.shape and \
+        torch.equal(tensor.reshape(-1).view(torch.uint8), other.reshape(-1).view(torch.uint8))
+
+
+class TestModelDelta(unittest.TestCase):
+    """ Verify that a model delta restores the exact bits of the new model and that it is
+    only sent when it can be applied.
+    """
+
+    def test_round_trip(self):
+        base, updated = state_dicts()
+        delta = encode_delta(updated, base)
+        #conv.bias did not change
+        self.assertIsNone(delta["conv.bias"])
+        #the delta is applied by the client after going through the wire format
+        restored = client_model_delta.apply_delta(base, decode_payload(encode_payload(delta)))
+        self.assertEqual(list(restored), list(updated))
+        for key in updated:
+            self.assertTrue(bitwise_equal(restored[key], updated[key]), key)
+
+    def test_small_updates_compress(self):
+        base, updated = state_dicts()
+        raw_size = sum(tensor.numel() * tensor.element_size() for tensor in updated.values())
+        self.assertLess(delta_size(encode_delta(updated, base)), raw_size)
+        self.assertEqual(delta_size(encode_delta(base, base)), 0)
+
+    def test_incompatible_models(self):
+        base, updated = state_dicts()
+        renamed = OrderedDict(updated)
+        renamed["extra"] = torch.zeros(1)
+        self.assertIsNone(encode_delta(renamed, base))
+        reshaped = OrderedDict(updated)
+        reshaped["conv.bias"] = torch.zeros(8)
+        self.assertIsNone(encode_delta(reshaped, base))
+        retyped = OrderedDict(updated)
+        retyped["conv.bias"] = updated["conv.bias"].double()
+        self.assertIsNone(encode_delta(retyped, base))
+
+
+class TestGlobalModel(unittest.TestCase):
+    """ Verify that a client follows the versions of the global model it is sent.
+    """
+
+    def test_versions(self):
+        base, updated = state_dicts()
+        global_model = GlobalModel()
+        self.assertIs(global_model.receive(base, 1, 0), base)
+        #the model did not change since version 1
+        self.assertIs(global_model.receive(None, 2, 1), base)
+        restored = global_model.receive(encode_delta(updated, base), 3, 2)
+        self.assertEqual(global_model.version, 3)
+        for key in updated:
+            self.assertTrue(bitwise_equal(restored[key], updated[key]), key)
+
+    def test_delta_against_another_version(self):
+        base, updated = state_dicts()
+        global_model = GlobalModel()
+        global_model.receive(base, 1, 0)
+        with self.assertRaises(ValueError):
+            global_model.receive(encode_delta(updated, base), 3, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+import os
+import sys
+import threading
+import time
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from federa.client.src.packed_dataset import PrefetchDataLoader
+from federa.server.src import packed_dataset as server_packed_dataset
+
+
+def make_dataset():
+    return TensorDataset(torch.arange(40).view(20, 2), torch.arange(20))
+
+
+#waits for the threads started after threads to end, returns those still running
+def wait_threads(threads, timeout=5):
+    end = time.time() + timeout
+    running = [thread for thread in threading.enumerate() if thread not in threads]
+    while running and time.time() < end:
+        time.sleep(0.05)
+        running = [thread for thread in running if thread.is_alive()]
+    return running
+
+
+class TestPrefetchDataLoader(unittest.TestCase):
+    """ Verify that the prefetching loader gives the batches of a DataLoader and that its
+    background thread ends when iteration stops early.
+    """
+
+    def test_same_batches(self):
+        for loader_class in (PrefetchDataLoader, server_packed_dataset.PrefetchDataLoader):
+            batches = list(loader_class(make_dataset(), batch_size=3))
+            expected = list(DataLoader(make_dataset(), batch_size=3))
+            self.assertEqual(len(batches), len(expected))
+            for batch, expected_batch in zip(batches, expected):
+                for tensor, expected_tensor in zip(batch, expected_batch):
+                    self.assertTrue(torch.equal(tensor, expected_tensor))
+
+    def test_stops_early(self):
+        threads = threading.enumerate()
+        loader = PrefetchDataLoader(make_dataset(), batch_size=2)
+        #one batch per epoch, as train_feddyn takes them
+        for _ in range(3):
+            next(iter(loader))
+        #a loop left with break
+        for batch in loader:
+            break
+        del batch
+        self.assertEqual(wait_threads(threads), [])
+
+    def test_errors_are_raised(self):
+        threads = threading.enumerate()
+        def collate(_):
+            raise RuntimeError("collate")
+        with self.assertRaises(RuntimeError):
+            list(PrefetchDataLoader(make_dataset(), batch_size=2, collate_fn=collate))
+        self.assertEqual(wait_threads(threads), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+import os
+import sys
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from federa.client.src.partitioner import largest_remainder, dirichlet, shards, classes, histograms, partition
+
+NUM_USERS = 7
+
+
+def random_labels(num_samples=1000, num_classes=10, seed=0):
+    return np.random.default_rng(seed).integers(0, num_classes, num_samples)
+
+
+class TestLargestRemainder(unittest.TestCase):
+    """ Verify that rounded counts add up to their totals and stay within one of their quotas.
+    """
+
+    def test_counts(self):
+        rng = np.random.default_rng(0)
+        weights = rng.random((5, 9))
+        totals = rng.integers(0, 100, 5)
+        counts = largest_remainder(weights, totals)
+        self.assertTrue(np.array_equal(counts.sum(axis=1), totals))
+        quotas = weights / weights.sum(axis=1, keepdims=True) * totals[:, None]
+        self.assertTrue(np.all(np.abs(counts - quotas) < 1))
+
+    def test_zero_weights_are_split_evenly(self):
+        counts = largest_remainder(np.zeros((1, 4)), [10])
+        self.assertEqual(sorted(counts[0].tolist()), [2, 2, 3, 3])
+
+
+class TestPartitioner(unittest.TestCase):
+    """ Verify that every scheme splits the samples among the users without giving a sample
+    to two users, and with the class structure it promises.
+    """
+
+    def check_split(self, labels, offsets, indices, num_users=NUM_USERS):
+        self.assertEqual(len(offsets), num_users + 1)
+        self.assertEqual(offsets[0], 0)
+        self.assertTrue(np.all(np.diff(offsets) >= 0))
+        self.assertEqual(offsets[-1], len(indices))
+        #disjoint: no sample is given twice
+        self.assertEqual(len(np.unique(indices)), len(indices))
+        self.assertTrue(np.all((indices >= 0) & (indices < len(labels))))
+        return histograms(labels, offsets, indices)
+
+    def test_dirichlet(self):
+        labels = random_labels()
+        offsets, indices = dirichlet(labels, NUM_USERS, 0.5, np.random.default_rng(0))
+        histogram = self.check_split(labels, offsets, indices)
+        #every sample is given out, each class in full
+        self.assertEqual(len(indices), len(labels))
+        self.assertTrue(np.array_equal(histogram.sum(axis=0), np.bincount(labels)))
+
+    def test_shards(self):
+        labels = random_labels()
+        offsets, indices = shards(labels, NUM_USERS, 2, np.random.default_rng(0))
+        self.check_split(labels, offsets, indices)
+        self.assertEqual(len(indices), len(labels))
+        #num_users * 2 shards of as equal sizes as possible, two per user
+        shard_size = len(labels) / (NUM_USERS * 2)
+        self.assertTrue(np.all(np.abs(np.diff(offsets) - 2 * shard_size) <= 2))
+
+    def test_classes(self):
+        labels = random_labels()
+        offsets, indices = classes(labels, NUM_USERS, 3, np.random.default_rng(0))
+        histogram = self.check_split(labels, offsets, indices)
+        self.assertTrue(np.all((histogram > 0).sum(axis=1) <= 3))
+        #the samples of a class are split evenly among the users holding it
+        for class_counts in histogram.T:
+            held = class_counts[class_counts > 0]
+            if len(held):
+                self.assertLessEqual(held.max() - held.min(), 1)
+
+    def test_classes_with_fewer_users_than_classes(self):
+        labels = random_labels()
+        offsets, indices = classes(labels, 2, 2, np.random.default_rng(0))
+        histogram = self.check_split(labels, offsets, indices, num_users=2)
+        #the classes nobody holds are left out
+        self.assertEqual(int((histogram.sum(axis=0) > 0).sum()), 4)
+
+    def test_many_users(self):
+        labels = random_labels(num_samples=60000)
+        for scheme in ("dirichlet", "shards", "classes"):
+            offsets, indices = partition({"partition": scheme}, labels, 10000, np.random.default_rng(0))
+            self.check_split(labels, offsets, indices, num_users=10000)
+
+    def test_same_seed_same_split(self):
+        labels = random_labels()
+        for scheme in ("dirichlet", "shards", "classes"):
+            first = partition({"partition": scheme}, labels, NUM_USERS, np.random.default_rng(3))
+            second = partition({"partition": scheme}, labels, NUM_USERS, np.random.default_rng(3))
+            self.assertTrue(np.array_equal(first[0], second[0]) and np.array_equal(first[1], second[1]))
+
+    def test_unknown_scheme(self):
+        with self.assertRaises(ValueError):
+            partition({"partition": "random"}, random_labels(), NUM_USERS, np.random.default_rng(0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,235 @@
+import unittest
+import os
+import sys
+from copy import deepcopy
+from math import ceil
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from federa.client.src.net_lib import train_model, train_scaffold, train_mime, train_mimelite, train_feddyn
+from federa.client.src.net_lib import SampleCounter
+
+DEVICE = torch.device("cpu")
+EPOCHS = 2
+
+
+def make_net():
+    torch.manual_seed(0)
+    return torch.nn.Sequential(torch.nn.Linear(6, 8), torch.nn.ReLU(), torch.nn.Linear(8, 3))
+
+
+def make_loader():
+    generator = torch.Generator().manual_seed(0)
+    dataset = TensorDataset(torch.randn(40, 6, generator=generator), torch.randint(0, 3, (40,), generator=generator))
+    return DataLoader(dataset, batch_size=8)
+
+
+def random_tensors(net, seed):
+    generator = torch.Generator().manual_seed(seed)
+    return [torch.randn(param.shape, generator=generator) for param in net.parameters()]
+
+
+#the per-parameter training loops the trainers replaced, without the progress bar and the deadline
+
+def reference_scaffold(net, server_c, trainloader, epochs):
+    x = deepcopy(net)
+    client_c = deepcopy(server_c)
+    criterion = torch.nn.CrossEntropyLoss()
+    lr = 0.001
+    for _ in range(epochs):
+        for images, labels in trainloader:
+            loss = criterion(net(images), labels)
+            grads = torch.autograd.grad(loss, net.parameters())
+            for param, grad, s_c, c_c in zip(net.parameters(), grads, server_c, client_c):
+                param.data = param.data - lr * (grad.data + (s_c.data - c_c.data))
+    for param_net, param_x in zip(net.parameters(), x.parameters()):
+        param_net.data = param_net.data - param_x.data
+    a = ceil(len(trainloader.dataset) / trainloader.batch_size) * epochs * lr
+    new_client_c = [c_l - c_g - diff.data / a for c_l, c_g, diff in zip(client_c, server_c, net.parameters())]
+    return net, [n_c - c_l for n_c, c_l in zip(new_client_c, client_c)]
+
+
+def reference_full_gradient(x, trainloader, criterion):
+    data = DataLoader(trainloader.dataset, batch_size=len(trainloader) * trainloader.batch_size)
+    for images, labels in data:
+        gradient_x = torch.autograd.grad(criterion(x(images), labels), x.parameters())
+    return gradient_x
+
+
+def reference_mimelite(net, state, trainloader, epochs):
+    x = deepcopy(net)
+    criterion = torch.nn.CrossEntropyLoss()
+    lr = 0.001
+    momentum = 0.9
+    for _ in range(epochs):
+        for images, labels in trainloader:
+            grads = torch.autograd.grad(criterion(net(images), labels), net.parameters())
+            with torch.no_grad():
+                for param, grad, s in zip(net.parameters(), grads, state):
+                    param.data = param.data - lr * ((1-momentum) * grad.data + momentum * s.data)
+    return net, reference_full_gradient(x, trainloader, criterion)
+
+
+def reference_mime(net, state, control_variate, trainloader, epochs):
+    x = deepcopy(net)
+    criterion = torch.nn.CrossEntropyLoss()
+    lr = 0.001
+    momentum = 0.9
+    for epoch in range(epochs):
+        for images, labels in trainloader:
+            grads_y = torch.autograd.grad(criterion(net(images), labels), net.parameters())
+            if epoch == 0:
+                grads_x = torch.autograd.grad(criterion(x(images), labels), x.parameters())
+            with torch.no_grad():
+                for g_y, g_x, c in zip(grads_y, grads_x, control_variate):
+                    g_y.data -= g_x.data + c
+                for param, grad, s in zip(net.parameters(), grads_y, state):
+                    param.data = param.data - lr * ((1-momentum) * grad.data + momentum * s.data)
+    return net, reference_full_gradient(x, trainloader, criterion)
+
+
+def reference_feddyn(net, prev_grads, trainloader, epochs):
+    x = deepcopy(net)
+    criterion = torch.nn.CrossEntropyLoss()
+    lr = 0.001
+    alpha = 0.01
+    for _ in range(epochs):
+        inputs, labels = next(iter(trainloader))
+        loss = criterion(net(inputs), labels)
+        curr_params = torch.cat([param.view(-1) for param in net.parameters()])
+        loss -= torch.sum(curr_params * prev_grads)
+        quad_penalty = 0.0
+        for y, z in zip(net.parameters(), x.parameters()):
+            quad_penalty += torch.nn.functional.mse_loss(y.data, z.data, reduction='sum')
+        loss += (alpha/2) * quad_penalty
+        gradients = torch.autograd.grad(loss, net.parameters())
+        for param, grad in zip(net.parameters(), gradients):
+            param.data -= lr * grad.data
+    delta = torch.cat([(y.data - z.data).view(-1) for y, z in zip(net.parameters(), x.parameters())])
+    return net, torch.sub(prev_grads, delta, alpha=alpha)
+
+
+def assert_same_result(test, result, expected):
+    for param, expected_param in zip(result[0].parameters(), expected[0].parameters()):
+        torch.testing.assert_close(param, expected_param)
+    test.assertEqual(len(result[1]), len(expected[1]))
+    for tensor, expected_tensor in zip(result[1], expected[1]):
+        torch.testing.assert_close(tensor, expected_tensor)
+
+
+class TestOptimizers(unittest.TestCase):
+    """ Verify that the foreach optimizers of the scaffold, mime and mimelite trainers train the
+    same model and return the same control variates as the per-parameter loops they replaced.
+    """
+
+    def test_scaffold(self):
+        net = make_net()
+        server_c = random_tensors(net, 1)
+        expected = reference_scaffold(make_net(), [tensor.clone() for tensor in server_c], make_loader(), EPOCHS)
+        result = train_scaffold(net, server_c, make_loader(), EPOCHS, DEVICE)
+        assert_same_result(self, result, expected)
+
+    def test_mimelite(self):
+        net = make_net()
+        state = random_tensors(net, 2)
+        expected = reference_mimelite(make_net(), [tensor.clone() for tensor in state], make_loader(), EPOCHS)
+        result = train_mimelite(net, state, make_loader(), EPOCHS, DEVICE)
+        assert_same_result(self, result, expected)
+
+    def test_mime(self):
+        net = make_net()
+        state, control_variate = random_tensors(net, 3), random_tensors(net, 4)
+        expected = reference_mime(make_net(), [tensor.clone() for tensor in state],
+                                  [tensor.clone() for tensor in control_variate], make_loader(), EPOCHS)
+        result = train_mime(net, state, control_variate, make_loader(), EPOCHS, DEVICE)
+        assert_same_result(self, result, expected)
+
+    def test_inputs_are_not_modified(self):
+        #the server state and control variates are shared with the next rounds
+        net = make_net()
+        state, control_variate = random_tensors(net, 3), random_tensors(net, 4)
+        train_mime(net, state, control_variate, make_loader(), EPOCHS, DEVICE)
+        for tensor, expected in zip(state + control_variate, random_tensors(net, 3) + random_tensors(net, 4)):
+            self.assertTrue(torch.equal(tensor, expected))
+
+
+class TestFedDyn(unittest.TestCase):
+    """ Verify that FedDyn trained on one flat parameter vector gives the same model and
+    gradient correction as the per-parameter loop it replaced, round after round.
+    """
+
+    def test_matches_reference(self):
+        net, expected_net = make_net(), make_net()
+        #a correction left by earlier rounds
+        prev_grads = expected_prev_grads = torch.cat([tensor.view(-1) for tensor in random_tensors(net, 5)])
+        for _ in range(2):
+            expected_net, expected_prev_grads = reference_feddyn(expected_net, expected_prev_grads,
+                                                                 make_loader(), EPOCHS)
+            net, prev_grads = train_feddyn(net, prev_grads, make_loader(), EPOCHS, DEVICE)
+            for param, expected_param in zip(net.parameters(), expected_net.parameters()):
+                torch.testing.assert_close(param, expected_param)
+            torch.testing.assert_close(prev_grads, expected_prev_grads)
+
+
+class TestTrainMode(unittest.TestCase):
+    """ Verify that the trainers train a network left in eval mode by an evaluation, as the
+    client session reuses it, the same way as a new network in train mode.
+    """
+
+    def make_batch_norm_net(self, evaluated):
+        torch.manual_seed(0)
+        net = torch.nn.Sequential(torch.nn.Linear(6, 8), torch.nn.BatchNorm1d(8), torch.nn.ReLU(),
+                                  torch.nn.Linear(8, 3))
+        return net.eval() if evaluated else net
+
+    def test_trainers(self):
+        trainers = {"train_model": lambda net: (train_model(net, make_loader(), EPOCHS, DEVICE), []),
+                    "train_scaffold": lambda net: train_scaffold(net, random_tensors(net, 1), make_loader(),
+                                                                 EPOCHS, DEVICE),
+                    "train_mimelite": lambda net: train_mimelite(net, random_tensors(net, 2), make_loader(),
+                                                                 EPOCHS, DEVICE),
+                    "train_mime": lambda net: train_mime(net, random_tensors(net, 3), random_tensors(net, 4),
+                                                         make_loader(), EPOCHS, DEVICE),
+                    "train_feddyn": lambda net: train_feddyn(net, torch.zeros(sum(param.numel() for param
+                                                                                  in net.parameters())),
+                                                             make_loader(), EPOCHS, DEVICE)}
+        for name, trainer in trainers.items():
+            with self.subTest(trainer=name):
+                result = trainer(self.make_batch_norm_net(evaluated=True))
+                expected = trainer(self.make_batch_norm_net(evaluated=False))
+                self.assertTrue(result[0].training)
+                assert_same_result(self, result, expected)
+                #the batch norm statistics are updated as well
+                for key, tensor in expected[0].state_dict().items():
+                    torch.testing.assert_close(result[0].state_dict()[key], tensor)
+
+
+class TestSampleCounter(unittest.TestCase):
+    """ Verify that the samples the trainers go through are counted, and that the trainers
+    train the same with the counter in place of their loader.
+    """
+
+    def test_counts(self):
+        trainloader = SampleCounter(make_loader())
+        train_model(make_net(), trainloader, EPOCHS, DEVICE)
+        self.assertEqual(trainloader.samples, EPOCHS * 40)
+        #one batch per epoch
+        trainloader = SampleCounter(make_loader())
+        train_feddyn(make_net(), torch.zeros(83), trainloader, EPOCHS, DEVICE)
+        self.assertEqual(trainloader.samples, EPOCHS * 8)
+
+    def test_same_training(self):
+        net = make_net()
+        server_c = random_tensors(net, 1)
+        expected = train_scaffold(make_net(), server_c, make_loader(), EPOCHS, DEVICE)
+        trainloader = SampleCounter(make_loader())
+        result = train_scaffold(net, server_c, trainloader, EPOCHS, DEVICE)
+        assert_same_result(self, result, expected)
+        #the full-dataset gradient of mimelite is not training
+        trainloader = SampleCounter(make_loader())
+        train_mimelite(make_net(), random_tensors(net, 2), trainloader, EPOCHS, DEVICE)
+        self.assertEqual(trainloader.samples, EPOCHS * 40)
+
+
+if __name__ == '__main__':
+    unittest.main()
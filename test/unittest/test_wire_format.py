@@ -0,0 +1,109 @@
+import unittest
+import os
+import sys
+import torch
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from federa.client.src.wire_format import encode_payload, decode_payload, encode_payload_chunks, PayloadDecoder
+from federa.server.src import wire_format as server_wire_format
+
+
+def sample_payload():
+    generator = torch.Generator().manual_seed(0)
+    return {"model_parameters": {"conv.weight": torch.randn(4, 3, 3, 3, generator=generator),
+                                 "bn.num_batches_tracked": torch.tensor(7),
+                                 "half": torch.randn(5, generator=generator).to(torch.bfloat16),
+                                 "empty": torch.zeros(0, 3)},
+            "control_variate": [torch.arange(6, dtype=torch.int32).view(2, 3), None,
+                                torch.tensor([True, False])]}
+
+
+def assert_same_payload(test, payload, decoded):
+    if isinstance(payload, torch.Tensor):
+        test.assertEqual(decoded.dtype, payload.dtype)
+        test.assertEqual(decoded.shape, payload.shape)
+        test.assertTrue(torch.equal(decoded, payload))
+    elif isinstance(payload, dict):
+        test.assertEqual(list(decoded), list(payload))
+        for key in payload:
+            assert_same_payload(test, payload[key], decoded[key])
+    elif isinstance(payload, (list, tuple)):
+        test.assertEqual(len(decoded), len(payload))
+        for item, decoded_item in zip(payload, decoded):
+            assert_same_payload(test, item, decoded_item)
+    else:
+        test.assertIsNone(payload)
+        test.assertIsNone(decoded)
+
+
+class TestWireFormat(unittest.TestCase):
+    """ Verify that payloads survive the tensor wire format unchanged and that
+    malformed payloads are rejected.
+    """
+
+    def test_round_trip(self):
+        payload = sample_payload()
+        assert_same_payload(self, payload, decode_payload(encode_payload(payload)))
+
+    def test_client_and_server_agree(self):
+        payload = sample_payload()
+        assert_same_payload(self, payload, server_wire_format.decode_payload(encode_payload(payload)))
+        assert_same_payload(self, payload, decode_payload(server_wire_format.encode_payload(payload)))
+
+    def test_rejects_other_formats(self):
+        with self.assertRaises(ValueError):
+            decode_payload(b"not a payload")
+
+    def test_rejects_unknown_dtypes(self):
+        data = encode_payload({"weight": torch.zeros(2)})
+        #same length, so only the dtype name is wrong
+        data = data.replace(b'"float32"', b'"Tensor" ')
+        with self.assertRaises(ValueError):
+            decode_payload(data)
+
+    def test_rejects_unsupported_tensors(self):
+        with self.assertRaises(TypeError):
+            encode_payload({"weight": torch.zeros(2, dtype=torch.complex32)})
+        with self.assertRaises(TypeError):
+            encode_payload({"weight": "not a tensor"})
+
+
+class TestChunks(unittest.TestCase):
+    """ Verify that a payload streamed in chunks decodes to the same tensors as the
+    unchunked payload, whatever the chunk size.
+    """
+
+    def test_round_trip(self):
+        payload = sample_payload()
+        data = encode_payload(payload)
+        for chunk_size in (1, 7, 64, 1000, len(data), 10 * len(data)):
+            chunks = list(encode_payload_chunks(payload, chunk_size))
+            self.assertEqual(b"".join(chunks), data)
+            #the first chunk is the manifest, the data follows in chunks of chunk_size
+            self.assertTrue(all(len(chunk) == chunk_size for chunk in chunks[1:-1]))
+            self.assertLessEqual(len(chunks[-1]), chunk_size)
+            decoder = PayloadDecoder()
+            for chunk in chunks:
+                decoder.feed(chunk)
+            decoded = decoder.result()
+            assert_same_payload(self, payload, decoded)
+            #unlike decode_payload, the decoded tensors are writable
+            decoded["model_parameters"]["conv.weight"].add_(1)
+
+    def test_incomplete_payload(self):
+        chunks = list(encode_payload_chunks(sample_payload(), 64))
+        decoder = PayloadDecoder()
+        for chunk in chunks[:-1]:
+            decoder.feed(chunk)
+        with self.assertRaises(ValueError):
+            decoder.result()
+
+    def test_payload_longer_than_its_manifest(self):
+        decoder = PayloadDecoder()
+        for chunk in encode_payload_chunks(sample_payload(), 64):
+            decoder.feed(chunk)
+        with self.assertRaises(ValueError):
+            decoder.feed(b"extra")
+
+
+if __name__ == '__main__':
+    unittest.main()